@@ -0,0 +1,140 @@
+"""
+    End-to-end load test
+
+    Boots the app against a local mongod, a fake S3 and a fake SMS gateway,
+    and runs each scenario in turn for a fixed duration with a number of
+    concurrent clients. Reports throughput, latency percentiles and MongoDB
+    round trips per scenario as JSON, so runs can be compared over time.
+
+    The database given by --db-name is dropped after the run unless --keep-db
+    is passed. A throwaway mongod is enough, ex.
+
+        docker run --rm -p 27017:27017 mongo:6
+
+    Usage:
+        python -m benchmarks.load --duration 20 --concurrency 8 --output load.json
+        python -m benchmarks.load --scenarios stolen_lookup,transfer_lifecycle
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import MongoClient
+
+from benchmarks.login_burst import percentile
+from benchmarks.load.scenarios import SCENARIOS, Scenario
+from benchmarks.load.server import AppServer
+from benchmarks.load.stubs import FakeS3, FakeSmsGateway
+
+
+def run_scenario(scenario: Scenario, server: AppServer, concurrency: int, duration: float) -> dict:
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        states = list(pool.map(lambda _: scenario.setup(), range(concurrency)))
+    scenario.timings.clear()
+
+    iterations = 0
+    failures = 0
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker(state):
+        nonlocal iterations, failures
+        while not stop.is_set():
+            try:
+                scenario.run(state)
+                succeeded = True
+            except Exception:
+                succeeded = False
+            with lock:
+                iterations += 1
+                failures += not succeeded
+
+    round_trips_before = server.mongo_round_trips()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(state,)) for state in states]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    round_trips_after = server.mongo_round_trips()
+
+    round_trips = {command: count - round_trips_before.get(command, 0) for command, count in round_trips_after.items()}
+    round_trips = {command: count for command, count in round_trips.items() if count}
+
+    requests_report = {}
+    for name, samples in scenario.timings.latencies.items():
+        requests_report[name] = {
+            'count': len(samples),
+            'errors': scenario.timings.errors.get(name, 0),
+            'p50_ms': round(percentile(samples, 50) * 1000, 2),
+            'p90_ms': round(percentile(samples, 90) * 1000, 2),
+            'p99_ms': round(percentile(samples, 99) * 1000, 2),
+            'max_ms': round(max(samples) * 1000, 2),
+        }
+
+    return {
+        'iterations': iterations,
+        'failed_iterations': failures,
+        'iterations_per_second': round(iterations / elapsed, 2),
+        'requests_per_second': round(sum(len(samples) for samples in scenario.timings.latencies.values()) / elapsed, 2),
+        'mongo_round_trips': sum(round_trips.values()),
+        'mongo_round_trips_per_iteration': round(sum(round_trips.values()) / max(iterations, 1), 2),
+        'mongo_commands': round_trips,
+        'requests': requests_report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--db-name', default='mybike_load_test')
+    parser.add_argument('--keep-db', action='store_true')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma separated. Default is all of them")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds each scenario runs")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients per scenario")
+    parser.add_argument('--bcrypt-rounds', type=int, default=None, help="Overrides BCRYPT_ROUNDS of the app")
+    parser.add_argument('--output', help="Write the report to this file instead of stdout")
+    args = parser.parse_args()
+
+    names = args.scenarios.split(',')
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    s3, sms = FakeS3(), FakeSmsGateway()
+    extra_env = {'BCRYPT_ROUNDS': str(args.bcrypt_rounds)} if args.bcrypt_rounds else {}
+    server = AppServer(args.mongo_uri, args.db_name, s3_url=s3.start(), sms_url=sms.start(), extra_env=extra_env)
+    server.start()
+
+    report = {
+        'config': {'duration': args.duration, 'concurrency': args.concurrency, 'bcrypt_rounds': args.bcrypt_rounds},
+        'scenarios': {},
+    }
+    try:
+        for name in names:
+            print(f"Running {name}", file=sys.stderr)
+            report['scenarios'][name] = run_scenario(SCENARIOS[name](server.url, sms), server, args.concurrency, args.duration)
+    finally:
+        server.stop()
+        s3.stop()
+        sms.stop()
+        if not args.keep_db:
+            MongoClient(args.mongo_uri).drop_database(args.db_name)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+    The scenarios driven by the load test
+
+    A scenario is set up once per simulated client and then run in a loop.
+    Each iteration is one realistic flow through the API, and every request
+    made during it is timed under its own name.
+"""
+
+import itertools
+import random
+import re
+import string
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from benchmarks.load.stubs import FakeSmsGateway
+
+
+# 1x1 transparent png
+PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+PASSWORD = 'load-test-password'
+
+# Numbers and frame numbers must be unique per run since the database may be reused
+_run_prefix = ''.join(random.choices(string.ascii_lowercase, k=3))
+_sequence = itertools.count(random.randrange(10_000_000))
+_sequence_lock = threading.Lock()
+
+
+def _next() -> int:
+    with _sequence_lock:
+        return next(_sequence)
+
+
+def new_phone_number() -> str:
+    return f"+45{_next() % 100_000_000:08d}"
+
+
+def new_frame_number() -> str:
+    return f"{_run_prefix}{_next()}x"
+
+
+class Timings:
+    """ Latencies per request name, filled in by Client """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def clear(self):
+        """ Drops what was recorded during setup """
+        self.latencies.clear()
+        self.errors.clear()
+
+
+class Client:
+    """ A simulated app user. Raises on unexpected status codes so the iteration is counted as failed """
+
+    def __init__(self, base_url: str, sms: FakeSmsGateway, timings: Timings):
+        self.base_url = base_url
+        self.sms = sms
+        self.timings = timings
+        self.session = requests.Session()
+        self.phone_number: str | None = None
+        self.owner_id: str | None = None
+
+    def request(self, name: str, method: str, path: str, expected: tuple[int, ...] = (200, 201, 202), **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        self.timings.latencies[name].append(time.perf_counter() - started)
+        if response.status_code not in expected:
+            self.timings.errors[name] += 1
+            raise RuntimeError(f"{name}: {response.status_code} {response.text[:200]}")
+        return response
+
+    def register(self):
+        """ Registers a new owner and verifies it with the OTP sent to the fake gateway """
+        self.phone_number = new_phone_number()
+        session = self.request('register', 'POST', '/auth/register/me',
+                               json={'phone_number': self.phone_number, 'password': PASSWORD}).json()
+        otp = re.search(r'(\d{6})', self.sms.last_message(self.phone_number)).group(1)
+        tokens = self.request('register_verify_otp', 'POST', '/auth/register/me/check-otp',
+                              json={'session_id': session['session_id'], 'otp': otp}).json()
+
+        self.session.headers['Authorization'] = f"Bearer {tokens['access_token']}"
+        self.owner_id = self.request('owner_me', 'GET', '/owners/me').json()['user_id']
+
+    def register_bike(self) -> tuple[str, str]:
+        """ Registers a bike to this owner's phone number and returns the frame number and claim token """
+        frame_number = new_frame_number()
+        self.request('register_bike', 'POST', '/bikes', data={
+            'phone_number': self.phone_number,
+            'frame_number': frame_number,
+            'gender': 'male',
+            'is_electric': 'false',
+            'kind': 'city',
+            'brand': 'Load test',
+            'color': 'black',
+        }, files={'image': ('bike.png', PNG, 'image/png')})
+        return frame_number, self.sms.last_message(self.phone_number)
+
+    def claim_bike(self, claim_token: str) -> dict:
+        return self.request('claim_bike', 'POST', f"/bikes/claim/{claim_token}").json()
+
+
+class Scenario:
+    name: str
+
+    def __init__(self, base_url: str, sms: FakeSmsGateway):
+        self.base_url = base_url
+        self.sms = sms
+        self.timings = Timings()
+
+    def client(self) -> Client:
+        return Client(self.base_url, self.sms, self.timings)
+
+    def setup(self) -> object:
+        """ Runs once per simulated client before timing starts. The result is passed to run """
+        return None
+
+    def run(self, state: object):
+        raise NotImplementedError
+
+
+class RegisterOwner(Scenario):
+    """ Sign up: register, receive an OTP and verify it """
+    name = 'register'
+
+    def run(self, state):
+        self.client().register()
+
+
+class RegisterAndClaimBike(Scenario):
+    """ A shop registers a bike with an image and the owner claims it with the code from the SMS """
+    name = 'claim'
+
+    def setup(self):
+        client = self.client()
+        client.register()
+        return client
+
+    def run(self, client: Client):
+        _, claim_token = client.register_bike()
+        client.claim_bike(claim_token)
+
+
+class StolenLookup(Scenario):
+    """ Looking up frame numbers, a quarter of which belong to stolen bikes """
+    name = 'stolen_lookup'
+
+    def setup(self):
+        client = self.client()
+        client.register()
+        frame_numbers = []
+        for index in range(8):
+            frame_number, claim_token = client.register_bike()
+            bike = client.claim_bike(claim_token)
+            if index % 4 == 0:
+                client.request('report_stolen', 'PUT', f"/bikes/{bike['_id']}/reportstolen")
+            frame_numbers.append(frame_number)
+        return client, frame_numbers
+
+    def run(self, state):
+        client, frame_numbers = state
+        client.request('stolen_lookup', 'GET', f"/bikes/{random.choice(frame_numbers)}", expected=(200, 204))
+
+
+class TransferLifecycle(Scenario):
+    """ Two owners passing a bike back and forth: create, view, accept, list activities """
+    name = 'transfer_lifecycle'
+
+    def setup(self):
+        sender, receiver = self.client(), self.client()
+        sender.register()
+        receiver.register()
+        _, claim_token = sender.register_bike()
+        bike = sender.claim_bike(claim_token)
+        return [sender, receiver, bike['_id']]
+
+    def run(self, state):
+        sender, receiver, bike_id = state
+        transfer = sender.request('create_transfer', 'POST', '/transfers',
+                                  json={'receiver_phone_number': receiver.phone_number, 'bike_id': bike_id}).json()
+        receiver.request('get_transfer', 'GET', f"/transfers/{transfer['_id']}")
+        receiver.request('accept_transfer', 'PUT', f"/transfers/{transfer['_id']}/accept")
+        receiver.request('activities', 'GET', '/activities')
+
+        # Next iteration sends it back
+        state[0], state[1] = receiver, sender
+
+
+class ActivitiesPolling(Scenario):
+    """ The app polling for the activity badge and occasionally opening the list """
+    name = 'activities_polling'
+
+    def setup(self):
+        sender, receiver = self.client(), self.client()
+        sender.register()
+        receiver.register()
+        for _ in range(3):
+            _, claim_token = sender.register_bike()
+            bike = sender.claim_bike(claim_token)
+            sender.request('create_transfer', 'POST', '/transfers',
+                           json={'receiver_phone_number': receiver.phone_number, 'bike_id': bike['_id']})
+        return receiver
+
+    def run(self, client: Client):
+        client.request('activity_count', 'GET', '/activities/count')
+        if random.random() < 0.2:
+            client.request('activities', 'GET', '/activities')
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (
+    RegisterOwner, RegisterAndClaimBike, StolenLookup, TransferLifecycle, ActivitiesPolling)}
@@ -0,0 +1,108 @@
+"""
+    Runs the app in a subprocess wired up to the local stand-ins
+"""
+
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import requests
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class AppServer:
+    """
+    Starts `uvicorn src.main:app`, or gunicorn when given a number of workers,
+    from a temporary directory holding an .env.local that points the app at
+    the given mongod and the stubs.
+    """
+
+    def __init__(self, mongo_uri: str, db_name: str, s3_url: str, sms_url: str, extra_env: dict | None = None, workers: int | None = None):
+        self.workers = workers
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = {
+            'ATLAS_URI': mongo_uri,
+            'DB_NAME': db_name,
+            'MONGO_TLS': 'NO',
+            'JWT_SECRET': 'load-test-secret',
+            'JWT_EXPIARY_TIME_MINS': '60',
+            'SMS_ENABLED': 'YES',
+            'SMS_API_URL': f"{sms_url}/Messages.json",
+            'TWILLIO_ACCOUNT_SID': 'load-test',
+            'TWILLIO_AUTH_TOKEN': 'load-test',
+            'TWILLIO_SENDER_PHONE_NUMBER': '+4500000000',
+            'AWS_ENDPOINT_URL': s3_url,
+            'AWS_ACCESS_KEY_ID': 'load-test',
+            'AWS_SECRET_ACCESS_KEY': 'load-test',
+            'AWS_DEFAULT_REGION': 'eu-north-1',
+            'AWS_BUCKET_NAME': 'load-test',
+            # Every simulated user comes from the same ip, which the limits would otherwise block
+            'RATE_LIMIT_ENABLED': 'NO',
+            # Keeps the database round trips of a scenario free of background noise
+            'JOBS_ENABLED': 'NO',
+            **(extra_env or {}),
+        }
+
+    def start(self, timeout: float = 30):
+        self._workdir = tempfile.mkdtemp(prefix='mybike-load-')
+        with open(os.path.join(self._workdir, '.env.local'), 'w') as file:
+            file.writelines(f"{key}={value}\n" for key, value in self.env.items())
+
+        self._log = open(os.path.join(self._workdir, 'server.log'), 'w+')
+        if self.workers:
+            # The production setup, see gunicorn.conf.py
+            command = [sys.executable, '-m', 'gunicorn', 'src.main:app', '-c', os.path.join(REPO_ROOT, 'gunicorn.conf.py'),
+                       '--bind', f"127.0.0.1:{self.port}", '--workers', str(self.workers)]
+        else:
+            command = [sys.executable, '-m', 'uvicorn', 'src.main:app', '--host', '127.0.0.1', '--port', str(self.port), '--no-access-log']
+
+        self._process = subprocess.Popen(
+            command,
+            cwd=self._workdir,
+            # Recycling workers in the middle of a measurement would only add noise
+            env={**os.environ, 'PYTHONPATH': REPO_ROOT, 'MAX_REQUESTS': '0'},
+            stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                break
+            try:
+                if requests.get(f"{self.url}/health/ready", timeout=1).ok:
+                    return
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.2)
+
+        self._log.seek(0)
+        raise RuntimeError(f"App did not start:\n{self._log.read()}")
+
+    def stop(self):
+        self._process.terminate()
+        self._process.wait(timeout=10)
+        self._log.close()
+        shutil.rmtree(self._workdir, ignore_errors=True)
+
+    def mongo_round_trips(self) -> dict[str, int]:
+        """ Number of MongoDB commands the app has sent so far, per command """
+        metrics = requests.get(f"{self.url}/internal/metrics").text
+        counts = defaultdict(int)
+        for command, count in re.findall(r'^mongo_command_duration_seconds_count\{command="(\w+)"\} (\d+)', metrics, re.M):
+            counts[command] += int(count)
+        return counts
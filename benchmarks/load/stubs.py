@@ -0,0 +1,123 @@
+"""
+    Local stand-ins for the external services the app talks to
+
+    Both run in a background thread of the load test process and keep
+    everything in memory, so a load test never touches AWS or Twilio.
+"""
+
+import hashlib
+import threading
+import urllib.parse
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubServer:
+    handler: type[BaseHTTPRequestHandler]
+
+    def start(self) -> str:
+        stub = self
+
+        class Handler(self.handler):
+            server_stub = stub
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _S3Handler(BaseHTTPRequestHandler):
+    """ Path style S3: /<bucket>/<key>. Only what boto3 needs for single part uploads """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status: int, body: bytes = b'', headers: dict | None = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        # boto3 streams uploads with chunked transfer encoding unless the size is known
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_PUT(self):
+        body = self._read_body()
+        self.server_stub.objects[urllib.parse.urlsplit(self.path).path] = body
+        self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+    def do_GET(self):
+        body = self.server_stub.objects.get(urllib.parse.urlsplit(self.path).path)
+        if body is None:
+            return self._reply(404)
+        self._reply(200, body)
+
+    def do_HEAD(self):
+        # A bucket, as checked by the warm-up on startup
+        if '/' not in urllib.parse.urlsplit(self.path).path.strip('/'):
+            return self._reply(200)
+        self.do_GET()
+
+    def do_DELETE(self):
+        self.server_stub.objects.pop(urllib.parse.urlsplit(self.path).path, None)
+        self._reply(204)
+
+
+class FakeS3(_StubServer):
+    handler = _S3Handler
+
+    def __init__(self):
+        self.objects: dict[str, bytes] = {}
+
+
+class _SmsHandler(BaseHTTPRequestHandler):
+    """ Accepts messages in the same form encoding as Twilio's Messages.json """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        form = dict(urllib.parse.parse_qsl(body))
+        self.server_stub.record(form.get('To', ''), form.get('Body', ''))
+
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeSmsGateway(_StubServer):
+    handler = _SmsHandler
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages: dict[str, list[str]] = defaultdict(list)
+
+    def record(self, to: str, body: str):
+        with self._lock:
+            self.messages[to].append(body)
+
+    def last_message(self, to: str) -> str:
+        with self._lock:
+            return self.messages[to][-1]
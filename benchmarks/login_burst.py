@@ -0,0 +1,99 @@
+"""
+    Login burst benchmark
+
+    Fires a burst of concurrent logins against a running server while a
+    second set of clients polls an unrelated endpoint, and reports login
+    throughput together with the latency percentiles of the unrelated
+    endpoint. With bcrypt running on the event loop the p99 of the
+    unrelated endpoint grows with the burst, with the hashing executor it
+    should stay flat.
+
+    The account must already exist and the benchmarking machine must be a
+    trusted device for it.
+
+    Usage:
+        python -m benchmarks.login_burst --phone +4512345678 --password <password>
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def login(session: requests.Session, base_url: str, phone: str, password: str) -> requests.Response:
+    return session.post(f"{base_url}/auth/token", json={'phone_number': phone, 'password': password})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--phone', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--logins', type=int, default=200, help="Total number of logins in the burst")
+    parser.add_argument('--concurrency', type=int, default=32, help="Concurrent login clients")
+    parser.add_argument('--pollers', type=int, default=4, help="Clients polling the unrelated endpoint")
+    args = parser.parse_args()
+
+    response = login(requests.Session(), args.base_url, args.phone, args.password)
+    response.raise_for_status()
+    headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+    stop = threading.Event()
+    unrelated_latencies: list[float] = []
+
+    def poll():
+        session = requests.Session()
+        while not stop.is_set():
+            started = time.perf_counter()
+            session.get(f"{args.base_url}/owners/me", headers=headers)
+            unrelated_latencies.append(time.perf_counter() - started)
+
+    def burst(_):
+        started = time.perf_counter()
+        response = login(requests.Session(), args.base_url, args.phone, args.password)
+        return response.status_code, time.perf_counter() - started
+
+    pollers = [threading.Thread(target=poll, daemon=True) for _ in range(args.pollers)]
+    for poller in pollers:
+        poller.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(burst, range(args.logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for poller in pollers:
+        poller.join()
+
+    login_latencies = [latency for _, latency in results]
+    report = {
+        'logins': args.logins,
+        'concurrency': args.concurrency,
+        'login_throughput_per_s': args.logins / elapsed,
+        'login_status_codes': {str(code): sum(1 for c, _ in results if c == code) for code in {c for c, _ in results}},
+        'login_p50_ms': percentile(login_latencies, 50) * 1000,
+        'login_p99_ms': percentile(login_latencies, 99) * 1000,
+        'unrelated_requests': len(unrelated_latencies),
+        'unrelated_mean_ms': statistics.fmean(unrelated_latencies) * 1000 if unrelated_latencies else 0.0,
+        'unrelated_p50_ms': percentile(unrelated_latencies, 50) * 1000,
+        'unrelated_p99_ms': percentile(unrelated_latencies, 99) * 1000,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+    Microbenchmarks of the model and serialization layer
+
+    Times the pure Python paths every request goes through: building models
+    from documents, .dict() with include/exclude, Entity.save, expand_transfer
+    and the JSON encoding of responses. Every case runs over lists of 1, 100
+    and 10k synthetic documents and reports ns/op and allocated bytes/op.
+
+    Entity.save runs against an in-memory collection so only the Python side
+    is measured. The documents are generated from a fixed seed so runs are
+    comparable. Like the app, it must run from a directory with an .env.local.
+
+    Usage:
+        python -m benchmarks.micro
+        python -m benchmarks.micro --save-baseline micro_baseline.json
+        python -m benchmarks.micro --compare micro_baseline.json --threshold 1.2
+"""
+
+import argparse
+import datetime
+import json
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from src.bikes.models import Bike
+from src.database import MongoDatabase
+from src.owners.models import BikeOwner
+from src.transfers.models import BIKE_SNAPSHOT_FIELDS, BikeSnapshot, BikeTransfer, PartySnapshot
+from src.transfers.utils import expand_transfer
+
+
+SIZES = (1, 100, 10_000)
+NOW = datetime.datetime(2023, 5, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+class _MemoryCollection:
+    """ Just enough of a pymongo collection for Entity.save """
+
+    def __init__(self):
+        self.docs = {}
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False):
+        self.docs.setdefault(filter['_id'], {'_id': filter['_id']}).update(update['$set'])
+
+    def find_one(self, filter: dict):
+        return self.docs.get(filter['_id'])
+
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _s3_file(rng: random.Random, path: str) -> dict:
+    name = f"{path}/{_uuid(rng)}photo.png"
+    return {
+        'content_type': 'image/png',
+        'size': 120_000,
+        'filename': 'photo.png',
+        'obj_name': name,
+        'obj_url': f"https://bucket.s3.eu-north-1.amazonaws.com/{name}",
+    }
+
+
+def bike_docs(count: int) -> list[dict]:
+    rng = random.Random(count)
+    return [{
+        '_id': _uuid(rng),
+        'frame_number': f"wbk{index}x",
+        'owner': _uuid(rng),
+        'gender': 'male',
+        'is_electric': index % 2 == 0,
+        'kind': 'city',
+        'brand': 'Kildemoes',
+        'color': 'black',
+        'image': _s3_file(rng, 'bike-images'),
+        'receipt': _s3_file(rng, 'bike-receipts'),
+        'reported_stolen': index % 10 == 0,
+        'claim_token': _uuid(rng),
+        'claimed_date': NOW,
+        'stolen_date': None,
+        'created_at': NOW,
+        'state': 'transferable',
+        'pending_transfer': None,
+    } for index in range(count)]
+
+
+def owner_docs(count: int) -> list[dict]:
+    rng = random.Random(count)
+    return [{
+        '_id': _uuid(rng),
+        'phone_number': f"+45{index:08d}",
+        'hash': b'$2b$12$' + bytes(rng.getrandbits(8) % 26 + 97 for _ in range(53)),
+        'created_at': NOW,
+    } for index in range(count)]
+
+
+def transfer_docs(count: int) -> list[dict]:
+    rng = random.Random(count)
+    bikes = bike_docs(count)
+    docs = []
+    for bike in bikes:
+        sender, receiver = _uuid(rng), _uuid(rng)
+        docs.append({
+            '_id': _uuid(rng),
+            'sender': sender,
+            'receiver': receiver,
+            'bike_id': bike['_id'],
+            'created_at': NOW,
+            'closed_at': None,
+            'state': 'pending',
+            'sender_snapshot': PartySnapshot(id=sender, phone_number='+4511111111').dict(),
+            'receiver_snapshot': PartySnapshot(id=receiver, phone_number='+4522222222').dict(),
+            'bike_snapshot': BikeSnapshot.from_doc({'_id': bike['_id'], **{field: bike[field] for field in BIKE_SNAPSHOT_FIELDS}}).dict(),
+        })
+    return docs
+
+
+def _cases(size: int) -> dict:
+    """ Each case is (setup, op). setup builds the input outside the timed region """
+    def bikes():
+        return [Bike(**doc) for doc in bike_docs(size)]
+
+    def owners():
+        return [BikeOwner(**doc) for doc in owner_docs(size)]
+
+    def transfers():
+        return [BikeTransfer(**doc) for doc in transfer_docs(size)]
+
+    def save(items):
+        MongoDatabase.collections = {'bikes': _MemoryCollection()}
+        for bike in items:
+            bike.save()
+
+    return {
+        'Bike(**doc)':              (lambda: bike_docs(size), lambda docs: [Bike(**doc) for doc in docs]),
+        'BikeOwner(**doc)':         (lambda: owner_docs(size), lambda docs: [BikeOwner(**doc) for doc in docs]),
+        'BikeTransfer(**doc)':      (lambda: transfer_docs(size), lambda docs: [BikeTransfer(**doc) for doc in docs]),
+        'Bike.dict()':              (bikes, lambda items: [bike.dict() for bike in items]),
+        'Bike.dict(exclude)':       (bikes, lambda items: [bike.dict(exclude={'receipt'}) for bike in items]),
+        'BikeOwner.dict(include)':  (owners, lambda items: [owner.dict(include={'id', 'phone_number'}) for owner in items]),
+        'Entity.save':              (bikes, save),
+        'expand_transfer':          (transfers, lambda items: [expand_transfer(transfer, None) for transfer in items]),
+        'json_response(bikes)':     (bikes, lambda items: JSONResponse(jsonable_encoder(items)).body),
+    }
+
+
+def measure(setup, op, size: int, min_time: float) -> dict:
+    # Enough repeats to run for about min_time, at least once
+    data = setup()
+    started = time.perf_counter()
+    op(data)
+    once = time.perf_counter() - started
+    repeats = max(1, int(min_time / max(once, 1e-9)))
+
+    best = once
+    for _ in range(repeats):
+        data = setup()
+        started = time.perf_counter()
+        op(data)
+        best = min(best, time.perf_counter() - started)
+
+    data = setup()
+    tracemalloc.start()
+    op(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ns_per_op': round(best / size * 1e9),
+        'alloc_bytes_per_op': round(peak / size),
+        'repeats': repeats,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """ Prints cases slower than threshold times the baseline and returns whether there were any """
+    regressed = False
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['ns_per_op'] / max(baseline[key]['ns_per_op'], 1)
+        marker = 'REGRESSION' if ratio > threshold else 'ok'
+        regressed |= ratio > threshold
+        print(f"{marker:>10}  {key:<40} {baseline[key]['ns_per_op']:>10} -> {result['ns_per_op']:>10} ns/op  x{ratio:.2f}", file=sys.stderr)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)))
+    parser.add_argument('--filter', default='', help="Only run cases whose name contains this")
+    parser.add_argument('--min-time', type=float, default=0.5, help="Seconds to spend on each case and size")
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH', help="Baseline to compare against. Exits with 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Allowed slowdown relative to the baseline")
+    args = parser.parse_args()
+
+    results = {}
+    for size in map(int, args.sizes.split(',')):
+        for name, (setup, op) in _cases(size).items():
+            if args.filter in name:
+                results[f"{name}[{size}]"] = measure(setup, op, size, args.min_time)
+
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            if compare(results, json.load(file), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
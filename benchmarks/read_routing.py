@@ -0,0 +1,105 @@
+"""
+    Read routing benchmark
+
+    Runs load test scenarios twice against a replica set, once with every read
+    on the primary and once with the read only hot paths routed to secondaries,
+    and reports the operations each member served. The drop in operations on
+    the primary is the load that read routing takes off it.
+
+    A local three member replica set is enough:
+
+        docker network create mybike-rs
+        for i in 1 2 3; do
+            docker run -d --rm --name mongo$i --network mybike-rs -p 2701$i:27017 mongo:6 --replSet rs0 --bind_ip_all
+        done
+        docker exec mongo1 mongosh --eval 'rs.initiate({_id: "rs0", members: [
+            {_id: 0, host: "mongo1:27017"}, {_id: 1, host: "mongo2:27017"}, {_id: 2, host: "mongo3:27017"}]})'
+
+    The member host names must resolve from where the benchmark runs, ex. by
+    adding "127.0.0.1 mongo1 mongo2 mongo3" to /etc/hosts and mapping the ports,
+    or by running the benchmark in a container on the same network.
+
+    Usage:
+        python -m benchmarks.read_routing --mongo-uri "mongodb://mongo1:27017,mongo2:27017,mongo3:27017/?replicaSet=rs0"
+"""
+
+import argparse
+import json
+import sys
+
+from pymongo import MongoClient
+
+from benchmarks.load.__main__ import run_scenario
+from benchmarks.load.scenarios import SCENARIOS
+from benchmarks.load.server import AppServer
+from benchmarks.load.stubs import FakeS3, FakeSmsGateway
+
+
+# Every policy in src/database.py DEFAULT_READ_PREFERENCES except 'primary'
+ROUTED_POLICIES = ('STOLEN_LOOKUP', 'MY_BIKES', 'ACTIVITIES')
+
+
+def member_operations(client: MongoClient) -> dict[str, int]:
+    """ Reads and commands served so far by each member, keyed on 'host:port (state)' """
+    operations = {}
+    for member in client.admin.command('replSetGetStatus')['members']:
+        host = member['name']
+        with MongoClient(host, directConnection=True) as direct:
+            counters = direct.admin.command('serverStatus')['opcounters']
+        operations[f"{host} ({member['stateStr']})"] = counters['query'] + counters['getmore'] + counters['command']
+    return operations
+
+
+def run(args, mode: str, s3_url: str, sms_url: str, sms: FakeSmsGateway, client: MongoClient) -> dict:
+    extra_env = {f"READ_PREFERENCE_{policy}": mode for policy in ROUTED_POLICIES}
+    server = AppServer(args.mongo_uri, args.db_name, s3_url=s3_url, sms_url=sms_url, extra_env=extra_env)
+    server.start()
+
+    report = {}
+    try:
+        for name in args.scenarios.split(','):
+            print(f"Running {name} with {mode} reads", file=sys.stderr)
+            scenario = SCENARIOS[name](server.url, sms)
+            before = member_operations(client)
+            result = run_scenario(scenario, server, args.concurrency, args.duration)
+            after = member_operations(client)
+
+            # Includes replication and monitoring traffic, which is the same in both runs
+            report[name] = {
+                'requests_per_second': result['requests_per_second'],
+                'operations_per_second': {member: round((after[member] - before.get(member, 0)) / args.duration, 1) for member in after},
+            }
+    finally:
+        server.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', required=True, help="Replica set connection string")
+    parser.add_argument('--db-name', default='mybike_load_test')
+    parser.add_argument('--scenarios', default='stolen_lookup,activities_polling')
+    parser.add_argument('--secondary-mode', default='secondaryPreferred', choices=['secondary', 'secondaryPreferred', 'nearest'])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    s3, sms = FakeS3(), FakeSmsGateway()
+    s3_url, sms_url = s3.start(), sms.start()
+
+    try:
+        report = {
+            'primary': run(args, 'primary', s3_url, sms_url, sms, client),
+            args.secondary_mode: run(args, args.secondary_mode, s3_url, sms_url, sms, client),
+        }
+    finally:
+        s3.stop()
+        sms.stop()
+        client.drop_database(args.db_name)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
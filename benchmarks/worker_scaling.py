@@ -0,0 +1,81 @@
+"""
+    Worker scaling benchmark
+
+    Runs a load test scenario against the production server setup (see
+    gunicorn.conf.py) with 1, 2, 4 ... up to --max-workers workers, and
+    reports the throughput of each relative to a single worker.
+
+    The load generator runs in this process, so give it a machine, or at
+    least cores, of its own for the numbers to mean anything. Needs a local
+    mongod just like benchmarks.load.
+
+    Usage:
+        python -m benchmarks.worker_scaling --max-workers 8 --scenario stolen_lookup
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from pymongo import MongoClient
+
+from benchmarks.load.__main__ import run_scenario
+from benchmarks.load.scenarios import SCENARIOS
+from benchmarks.load.server import AppServer
+from benchmarks.load.stubs import FakeS3, FakeSmsGateway
+
+
+def worker_counts(max_workers: int) -> list[int]:
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default='mongodb://127.0.0.1:27017')
+    parser.add_argument('--db-name', default='mybike_load_test')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--scenario', default='stolen_lookup', choices=list(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=64, help="Concurrent clients. Should be enough to saturate the most workers")
+    args = parser.parse_args()
+
+    s3, sms = FakeS3(), FakeSmsGateway()
+    s3_url, sms_url = s3.start(), sms.start()
+
+    results = []
+    try:
+        for workers in worker_counts(args.max_workers):
+            print(f"Running {args.scenario} with {workers} workers", file=sys.stderr)
+            server = AppServer(args.mongo_uri, args.db_name, s3_url=s3_url, sms_url=sms_url, workers=workers)
+            server.start()
+            try:
+                result = run_scenario(SCENARIOS[args.scenario](server.url, sms), server, args.concurrency, args.duration)
+            finally:
+                server.stop()
+
+            results.append({
+                'workers': workers,
+                'requests_per_second': result['requests_per_second'],
+                'failed_iterations': result['failed_iterations'],
+                'p99_ms': {name: request['p99_ms'] for name, request in result['requests'].items()},
+            })
+    finally:
+        s3.stop()
+        sms.stop()
+        MongoClient(args.mongo_uri).drop_database(args.db_name)
+
+    single = results[0]['requests_per_second'] or 1
+    for result in results:
+        result['speedup'] = round(result['requests_per_second'] / single, 2)
+
+    print(json.dumps({'scenario': args.scenario, 'concurrency': args.concurrency, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
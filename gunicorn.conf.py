@@ -0,0 +1,42 @@
+"""
+    Production server settings
+
+    Runs the app in several uvicorn workers managed by gunicorn:
+
+        gunicorn src.main:app -c gunicorn.conf.py
+
+    The app is not preloaded, so every worker imports it after the fork and
+    opens its own MongoDB, S3 and HTTP connections. Each worker also keeps its
+    own metrics, so a scrape of /internal/metrics shows a single worker.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:80')
+
+# One worker per core. The workers are async so more than that only adds contention
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Picks uvloop and httptools when they are installed
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Recycle workers now and then to bound the effect of leaks. The jitter keeps
+# them from all restarting at the same time
+max_requests = int(os.getenv('MAX_REQUESTS', 10_000))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', 1_000))
+
+# Time a worker gets to finish its in-flight requests on restart or shutdown
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+timeout = int(os.getenv('WORKER_TIMEOUT', 60))
+keepalive = 5
+
+preload_app = False
+
+# X-Forwarded-For is only trusted from these addresses. Rate limits and trusted devices are keyed
+# on request.client.host, so set this to the load balancer's addresses, never '*', which would let
+# any client pick its own ip. Like uvicorn and gunicorn themselves, only trusts localhost by default
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+accesslog = None
+errorlog = '-'
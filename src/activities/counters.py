@@ -0,0 +1,98 @@
+"""
+    Per owner activity counters
+
+    Keeps a small document per bike owner in 'activity_counters' with the number
+    of pending incoming and outgoing transfers and discoveries. The write paths
+    of transfers and discoveries update it with $inc, so the alert badge can be
+    served with a single _id lookup. Drift, e.g. from a crash between two writes,
+    is repaired by the periodic reconcile job.
+"""
+
+import uuid
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from src.database import MongoDatabase
+from src.settings import config
+from src.transfers.models import BikeTransferState
+
+
+COLLECTION_NAME = 'activity_counters'
+FIELDS = ('pending_incoming', 'pending_outgoing', 'discoveries')
+RECONCILE_INTERVAL_SECONDS = int(config.get('ACTIVITY_COUNTERS_RECONCILE_SECONDS', 60 * 60))
+
+
+def _collection():
+    return MongoDatabase().collections[COLLECTION_NAME]
+
+
+def increment(owner_id: uuid.UUID, **deltas: int):
+    """ Adds the deltas to the counters of an owner. Ex: increment(owner_id, pending_incoming=-1) """
+    _collection().update_one({'_id': owner_id}, {'$inc': deltas}, upsert=True)
+
+
+def increment_many(deltas: dict[uuid.UUID, dict[str, int]]):
+    """ Adds deltas to the counters of several owners in one round trip """
+    if not deltas:
+        return
+    _collection().bulk_write([
+        UpdateOne({'_id': owner_id}, {'$inc': owner_deltas}, upsert=True)
+        for owner_id, owner_deltas in deltas.items()
+    ], ordered=False)
+
+
+def transfer_deltas(transfers: list[tuple[uuid.UUID, uuid.UUID]], sign: int) -> dict[uuid.UUID, dict[str, int]]:
+    """ Builds the deltas for opening (sign=1) or closing (sign=-1) (sender, receiver) transfers """
+    deltas: dict[uuid.UUID, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for sender, receiver in transfers:
+        deltas[sender]['pending_outgoing'] += sign
+        deltas[receiver]['pending_incoming'] += sign
+    return {owner_id: dict(owner_deltas) for owner_id, owner_deltas in deltas.items()}
+
+
+def get_counts(owner_id: uuid.UUID) -> dict[str, int]:
+    doc = _collection().find_one({'_id': owner_id}) or {}
+    # Counters can dip below zero while drifting, never show that
+    return {field: max(0, doc.get(field, 0)) for field in FIELDS}
+
+
+def reconcile() -> int:
+    """
+    Recomputes every counter from the transfers and discoveries collections and
+    repairs the ones that have drifted.
+
+    The counters are read before the collections are counted, and a repair only
+    applies while the counter still holds what was read. A counter incremented
+    concurrently is left alone, rather than having that increment overwritten,
+    and is repaired on the next run if it still drifts.
+
+    :returns the number of repaired owners
+    """
+    db = MongoDatabase()
+    snapshot = {doc['_id']: doc for doc in _collection().find({})}
+    actual: dict[uuid.UUID, dict[str, int]] = defaultdict(lambda: {field: 0 for field in FIELDS})
+
+    pending = {'$match': {'state': BikeTransferState.PENDING}}
+    for row in db.collections['transfers'].aggregate([pending, {'$group': {'_id': '$sender', 'count': {'$sum': 1}}}]):
+        actual[row['_id']]['pending_outgoing'] = row['count']
+    for row in db.collections['transfers'].aggregate([pending, {'$group': {'_id': '$receiver', 'count': {'$sum': 1}}}]):
+        actual[row['_id']]['pending_incoming'] = row['count']
+    for row in db.collections['discoveries'].aggregate([{'$group': {'_id': '$bike_owner', 'count': {'$sum': 1}}}]):
+        actual[row['_id']]['discoveries'] = row['count']
+
+    repairs = []
+    for owner_id, doc in snapshot.items():
+        expected = actual.pop(owner_id, {field: 0 for field in FIELDS})
+        if any(doc.get(field, 0) != expected[field] for field in FIELDS):
+            # Unchanged since the snapshot. A field that was never set must still be missing
+            unchanged = {field: doc[field] if field in doc else {'$exists': False} for field in FIELDS}
+            repairs.append(UpdateOne({'_id': owner_id, **unchanged}, {'$set': expected}))
+
+    # Owners with activity but no counters document yet. Left alone if one was created in the meantime
+    for owner_id, expected in actual.items():
+        repairs.append(UpdateOne({'_id': owner_id}, {'$setOnInsert': expected}, upsert=True))
+
+    if repairs:
+        _collection().bulk_write(repairs, ordered=False)
+    return len(repairs)
@@ -2,9 +2,11 @@ from fastapi import APIRouter, Depends, Request, status
 import pymongo
 
 from src.auth.dependencies import authenticated_request
+from src.database import MongoDatabase
 from src.owners.models import BikeOwner
 from src.transfers.models import BikeTransfer, BikeTransferState
 from src.transfers.utils import expand_transfer
+from src.activities import counters
 
 
 router = APIRouter(
@@ -16,13 +18,15 @@ router = APIRouter(
 @router.get('', summary="Get all activities for a user", status_code=status.HTTP_200_OK)
 def get_activities(request: Request, user: BikeOwner = Depends(authenticated_request)):
 
-    discoveries = list(request.app.collections["discoveries"].find({'bike_owner': user.id}))
+    # Read only, so the reads follow the 'activities' read preference
+    db = MongoDatabase()
+    discoveries = list(db.read_collection("discoveries", 'activities').find({'bike_owner': user.id}))
 
     outgoing_requests = [expand_transfer(BikeTransfer(**transfer), request)
-                         for transfer in request.app.collections['transfers'].find({'sender': user.id, 'state': BikeTransferState.PENDING})]
+                         for transfer in db.read_collection('transfers', 'activities').find({'sender': user.id, 'state': BikeTransferState.PENDING})]
     incoming_requests = [expand_transfer(BikeTransfer(**transfer), request)
-                         for transfer in request.app.collections['transfers'].find({'receiver': user.id, 'state': BikeTransferState.PENDING})]
-    completed_requests = [expand_transfer(BikeTransfer(**transfer), request) for transfer in request.app.collections['transfers'].find({
+                         for transfer in db.read_collection('transfers', 'activities').find({'receiver': user.id, 'state': BikeTransferState.PENDING})]
+    completed_requests = [expand_transfer(BikeTransfer(**transfer), request) for transfer in db.read_collection('transfers', 'activities').find({
         '$and': [
             {'$or': [
                 {'sender': user.id},
@@ -30,7 +34,8 @@ def get_activities(request: Request, user: BikeOwner = Depends(authenticated_req
             ]},
             {'$or': [
                 {'state': BikeTransferState.ACCEPTED},
-                {'state': BikeTransferState.DECLINED}
+                {'state': BikeTransferState.DECLINED},
+                {'state': BikeTransferState.EXPIRED}
             ]}
         ]
     }).sort('closed_at', pymongo.DESCENDING)]
@@ -42,3 +47,12 @@ def get_activities(request: Request, user: BikeOwner = Depends(authenticated_req
         'completed_transfers': completed_requests,
         'discoveries': discoveries
     }
+
+
+@router.get('/count', summary="Get the number of pending activities for a user", status_code=status.HTTP_200_OK)
+def get_activity_count(user: BikeOwner = Depends(authenticated_request)):
+    counts = counters.get_counts(user.id)
+    return {
+        'alerts': counts['pending_outgoing'] + counts['pending_incoming'] + counts['discoveries'],
+        **counts
+    }
@@ -38,20 +38,27 @@ def valid_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     
     try:
-        jwt.decode(token, key=config['JWT_SECRET'])
-        return token
+        claims = jwt.decode(token, key=config['JWT_SECRET'])
     except JOSEError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=str(e))
 
+    # Refresh tokens are only meant for /auth/refresh
+    if claims.get('type') == 'refresh':
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh tokens cannot be used as access tokens")
+
+    return token
+
 def authenticated_request(request: Request, token = Depends(valid_token)) -> BikeOwner:
     """
     Authenticates the request by verifying the incoming jwt token and
     returns the user of the token
     """
     token_claims = jwt.decode(token, key=config['JWT_SECRET'])
-    user = request.app.collections['bike_owners'].find_one({'_id': uuid.UUID(token_claims['sub']) })
+    user = request.app.collections['bike_owners'].find_one({'_id': uuid.UUID(token_claims['sub']) }, projection={'devices': 0})
     return BikeOwner(**user)
     
 def phone_number_not_registered(request: Request, phone_number: str = Depends(sanitize_phone_number)):
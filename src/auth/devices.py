@@ -0,0 +1,68 @@
+import datetime
+import uuid
+
+from src.database import MongoDatabase
+from src.settings import config
+from src.auth.models import DeviceStatus, KnownDevice
+
+
+class DeviceStore:
+    """
+    Trusted and blacklisted devices, stored one document per owner and ip in
+    the 'devices' collection. Lookups go through the unique (owner_id, ip_address)
+    index and writes are single upserts, so the owner document is never touched.
+    """
+
+    COLLECTION_NAME = 'devices'
+
+    TRUSTED_TTL = datetime.timedelta(days=int(config.get('DEVICE_TRUST_DAYS', 180)))
+    BLACKLISTED_TTL = datetime.timedelta(days=int(config.get('DEVICE_BLACKLIST_DAYS', 365)))
+    TOUCH_INTERVAL = datetime.timedelta(days=1)
+
+    def _collection(self):
+        return MongoDatabase().collections[self.COLLECTION_NAME]
+
+    def find(self, owner_id: uuid.UUID, ip_address: str) -> KnownDevice | None:
+        doc = self._collection().find_one({
+            'owner_id': owner_id,
+            'ip_address': ip_address,
+            'expires_at': {'$gt': datetime.datetime.now(datetime.timezone.utc)}
+        })
+        return KnownDevice(**doc) if doc else None
+
+    def _upsert(self, owner_id: uuid.UUID, ip_address: str, status: DeviceStatus, ttl: datetime.timedelta, name: str | None = None):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        device_id = uuid.uuid4()
+
+        update = {'status': status, 'last_seen_at': now, 'expires_at': now + ttl}
+        if name is not None:
+            update['name'] = name
+
+        self._collection().update_one(
+            {'owner_id': owner_id, 'ip_address': ip_address},
+            {
+                '$set': update,
+                '$setOnInsert': {'_id': device_id, 'id': device_id, 'created_at': now}
+            },
+            upsert=True
+        )
+
+    def trust(self, owner_id: uuid.UUID, ip_address: str, name: str | None = None):
+        self._upsert(owner_id, ip_address, DeviceStatus.TRUSTED, self.TRUSTED_TTL, name)
+
+    def blacklist(self, owner_id: uuid.UUID, ip_address: str):
+        self._upsert(owner_id, ip_address, DeviceStatus.BLACKLISTED, self.BLACKLISTED_TTL)
+
+    def touch(self, device: KnownDevice):
+        """ Pushes the expiry of a trusted device forward. Writes at most once per TOUCH_INTERVAL """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if device.status != DeviceStatus.TRUSTED or now - device.last_seen_at < self.TOUCH_INTERVAL:
+            return
+
+        self._collection().update_one(
+            {'_id': device.id},
+            {'$set': {'last_seen_at': now, 'expires_at': now + self.TRUSTED_TTL}}
+        )
+
+
+device_store = DeviceStore()
@@ -0,0 +1,122 @@
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+from fastapi import HTTPException, status
+
+from src.metrics.instruments import password_hashing_rejected_total
+from src.settings import config
+
+
+def _hash(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _verify(password: bytes, hashed_password: bytes) -> bool:
+    return bcrypt.checkpw(password=password, hashed_password=hashed_password)
+
+
+def _started() -> bool:
+    return True
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing and verification on a dedicated executor so that
+    login bursts never stall the event loop. Sync routes wait for the result.
+
+    The number of executor workers caps how many hashes run at once. Jobs
+    beyond that wait in the executor queue, and once the queue is deeper
+    than `max_queue` new jobs are rejected with a 503 instead of piling up.
+    """
+
+    def __init__(self, kind: str = 'thread', workers: int = 4, max_queue: int = 64, rounds: int = 12):
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    @property
+    def executor(self) -> Executor:
+        # Created lazily so a process pool is never forked before the app workers are
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == 'process':
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+        return self._executor
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self.queue_depth >= self.max_queue:
+                self._rejected += 1
+                password_hashing_rejected_total.inc()
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Too many concurrent password operations. Please try again shortly",
+                                    headers={'Retry-After': '1'})
+            self._pending += 1
+
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, _: Future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    @property
+    def queue_depth(self) -> int:
+        """ Number of jobs waiting for a free worker """
+        return max(0, self._pending - self.workers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'in_flight': min(self._pending, self.workers),
+                'queue_depth': self.queue_depth,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+    def needs_rehash(self, hashed_password: bytes) -> bool:
+        """ Checks whether a stored hash was made with a different cost than the configured one """
+        try:
+            cost = int(hashed_password.split(b'$')[2])
+        except (IndexError, ValueError):
+            return True
+        return cost != self.rounds
+
+    def hash_sync(self, password: str) -> bytes:
+        """ Blocks the calling thread. Goes through the executor to respect the cap """
+        return self._submit(_hash, password.encode(encoding="utf-8"), self.rounds).result()
+
+    def verify_sync(self, password: str, hashed_password: bytes) -> bool:
+        return self._submit(_verify, password.encode(encoding="utf-8"), hashed_password).result()
+
+    def warm_up(self):
+        """ Starts every executor worker, which for a process pool means spawning the processes """
+        for future in [self.executor.submit(_started) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    kind=config.get('PASSWORD_HASHING_EXECUTOR', 'thread'),
+    workers=int(config.get('PASSWORD_HASHING_WORKERS', 4)),
+    max_queue=int(config.get('PASSWORD_HASHING_MAX_QUEUE', 64)),
+    rounds=int(config.get('BCRYPT_ROUNDS', 12)),
+)
@@ -0,0 +1,74 @@
+"""
+    Auth migrations
+
+    Moves the device lists that used to be embedded in every bike owner
+    document into the 'devices' collection, and removes them from the
+    owner documents afterwards. Safe to run more than once.
+
+    Usage:
+        python -m src.auth.migrations
+"""
+
+import datetime
+import uuid
+
+from pymongo import UpdateOne
+
+from src.database import MongoDatabase
+from src.auth.devices import DeviceStore
+from src.auth.models import DeviceStatus
+
+
+def migrate_embedded_devices(batch_size: int = 500) -> int:
+    db = MongoDatabase()
+    owners = db.collections['bike_owners']
+    devices = db.collections[DeviceStore.COLLECTION_NAME]
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    migrated = 0
+    operations = []
+    owner_ids = []
+
+    def flush():
+        if operations:
+            devices.bulk_write(operations, ordered=False)
+        if owner_ids:
+            owners.update_many({'_id': {'$in': owner_ids}}, {'$unset': {'devices': ''}})
+        operations.clear()
+        owner_ids.clear()
+
+    cursor = owners.find({'devices': {'$exists': True}}, projection={'devices': 1}, batch_size=batch_size)
+    for owner in cursor:
+        lists = [
+            (DeviceStatus.TRUSTED, owner['devices'].get('white_list', []), DeviceStore.TRUSTED_TTL),
+            (DeviceStatus.BLACKLISTED, owner['devices'].get('black_list', []), DeviceStore.BLACKLISTED_TTL),
+        ]
+        for status, device_list, ttl in lists:
+            # Duplicates collapse into a single document through the upsert
+            for device in device_list:
+                device_id = uuid.uuid4()
+                operations.append(UpdateOne(
+                    {'owner_id': owner['_id'], 'ip_address': device['ip_address']},
+                    {
+                        '$set': {'status': status, 'name': device.get('name'), 'last_seen_at': now, 'expires_at': now + ttl},
+                        '$setOnInsert': {'_id': device_id, 'id': device_id, 'created_at': now}
+                    },
+                    upsert=True
+                ))
+
+        owner_ids.append(owner['_id'])
+        migrated += 1
+
+        if len(owner_ids) >= batch_size:
+            flush()
+
+    flush()
+    return migrated
+
+
+if __name__ == '__main__':
+    db = MongoDatabase()
+    db.connect()
+    db.ensure_indexes()
+    print(f"Migrated devices of {migrate_embedded_devices()} bike owners")
+    db.disconnect()
@@ -1,55 +1,42 @@
 import datetime
-import secrets
+from enum import Enum
 from typing import Any
 import uuid
-from pydantic import BaseModel, Field, PrivateAttr
+from pydantic import Field, PrivateAttr
 
 from src.models import Entity
 
-def generate_otp():
-    """ Generates a string of digits of given length"""
-    DIGIT_LENGTH = 6
-    
-    nums = range(0, 9)
-    result = ""
-    for _ in range(DIGIT_LENGTH):
-        result += str(secrets.choice(nums))
-    return result
-
-
-class AccessSession(Entity):
-
-    _COLLECTION_NAME = PrivateAttr(default='access_sessions')
-
-    ip_address: str
-    phone_number: str       # Phone number of owner trying to access
-    login_attempts: int = 0
-    otp: str = Field(default_factory=generate_otp)
-    cooldown_expires_at: datetime.datetime = Field(default_factory= lambda : datetime.datetime.now(datetime.timezone.utc))
-    sms_cooldown_expires_at: datetime.datetime = Field(default_factory= lambda : datetime.datetime.now(datetime.timezone.utc))
-    #last_login_attempt_at: datetime
-
-
-class Device(BaseModel):
-    ip_address : str
-    name       : str | None = None
-
-
-class DeviceList(BaseModel):
-    white_list: list[Device] = []
-    black_list: list[Device] = []
-    
-    def is_blacklisted(self, ip_addr: str):
-        for device in self.black_list: 
-            if device.ip_address == ip_addr:
-                return True
-        return False
-    
-    def is_known(self, ip_addr: str):
-        for device in self.white_list:
-            if device.ip_address == ip_addr:
-                return True
-        return False
-    
 
+class DeviceStatus(str, Enum):
+    TRUSTED = "trusted",
+    BLACKLISTED = "blacklisted"
 
+
+class KnownDevice(Entity):
+    """ A device an owner has either trusted or been blacklisted from. Unique per owner and ip """
+
+    _COLLECTION_NAME = PrivateAttr(default='devices')
+
+    owner_id     : uuid.UUID
+    ip_address   : str
+    name         : str | None = None
+    status       : DeviceStatus
+    created_at   : datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc))
+    last_seen_at : datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc))
+    expires_at   : datetime.datetime     # Stale devices are removed by a TTL index on this field
+
+
+class RefreshTokenFamily(Entity):
+    """
+    Every login starts a family of refresh tokens. Only the newest token of a family
+    can be exchanged, and presenting an older one revokes the whole family
+    """
+
+    _COLLECTION_NAME = PrivateAttr(default='refresh_token_families')
+
+    owner_id         : uuid.UUID
+    current_token_id : uuid.UUID = Field(default_factory=uuid.uuid4)
+    revoked          : bool = False
+    created_at       : datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc))
+    last_used_at     : datetime.datetime | None = None
+    expires_at       : datetime.datetime     # Removed by a TTL index once the last issued token has expired
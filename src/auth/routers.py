@@ -1,9 +1,9 @@
 import datetime
 import uuid
-import bcrypt
 import logging
 from fastapi import APIRouter, Body, HTTPException, Depends, Request, status
 from fastapi_jwt_auth import AuthJWT
+from fastapi_jwt_auth.exceptions import AuthJWTException
 from pydantic import BaseModel
 
 from src.settings import config
@@ -11,9 +11,16 @@ from src.owners.models import BikeOwner
 from src.notifications.sms import send_sms
 from src.auth.dependencies import Verify2FASession, strong_password, phone_number_not_registered
 from src.dependencies import sanitize_phone_number
-from src.auth.models import AccessSession, Device
+from src.auth.models import DeviceStatus
+from src.auth.devices import device_store
+from src.auth.tokens import REFRESH_TOKEN_EXPIRES, issue_tokens, revoke_token_families, rotate_tokens
 from src.auth.responses import AuthSuccessResponse, DeviceBlacklisted, DeviceVerificationResponse, InvalidCredentialsResponse, DeviceVerifyCooldownResponse, AuthCooldownResponse
 from src.auth.sessions import BikeOwnerRegistrationSession, ResetPasswordSession, TrustDeviceSession
+from src.auth.hashing import password_hasher
+from src.ratelimit.dependencies import RateLimit, enforce
+from src.ratelimit.limiter import limiter
+from src.ratelimit.policies import POLICIES
+from src.metrics.instruments import rate_limit_rejections_total
 
 logger = logging.getLogger(__name__)
 
@@ -26,13 +33,14 @@ class Settings(BaseModel):
     authjwt_secret_key = config['JWT_SECRET']
     authjwt_access_token_expires: datetime.timedelta = datetime.timedelta(
         minutes=int(config['JWT_EXPIARY_TIME_MINS']))
+    authjwt_refresh_token_expires: datetime.timedelta = REFRESH_TOKEN_EXPIRES
 
 @AuthJWT.load_config
 def get_config():
     return Settings()
 
 
-@router.post('/token', summary="Authenticate to get an access token", responses={
+@router.post('/token', summary="Authenticate to get an access token", dependencies=[Depends(RateLimit('login'))], responses={
     '200': {'model': AuthSuccessResponse, 'description': "Successfull authentication"},
     '307': {'model': DeviceVerificationResponse, 'description': "Credentials were valid, but the device is unknown and needs to be verified"},
     '401': {'model': InvalidCredentialsResponse, 'description': "Invalid phonenumber or password"},
@@ -42,26 +50,26 @@ def get_config():
     '429': {'model': AuthCooldownResponse, 'description': "Cooldown because of too many failed attempts"}
 })
 
-async def authenticate(request: Request, phone_number: str = Body(), password: str = Body(), Authorize: AuthJWT = Depends()):
+def authenticate(request: Request, phone_number: str = Body(), password: str = Body(), Authorize: AuthJWT = Depends()):
 
     req_ip_address = request.client.host
 
-    MAX_ATTEMPTS_BEFORE_COOLDOWN = 3
-    MAX_ATTEMPTS_BEFORE_BLACKLIST = 7
-
-    COOLDOWN_DURATIONS = {
-        # Should start at MAX_ATTEMPTS_BEFORE_COOLDOWN
-        3: datetime.timedelta(seconds=15),
-        4: datetime.timedelta(seconds=30),
-        5: datetime.timedelta(minutes=1),
-        6: datetime.timedelta(minutes=1),
-        # Should end one before MAX_ATTEMPTS_BEFORE_BLACKLIST
-        7: datetime.timedelta(minutes=1),
-    }
+    # Failed attempts are tracked per phone number and device
+    attempt_key = f"{phone_number}:{req_ip_address}"
+
+    # Check if the device is on cooldown. This is decided by the rate limiter
+    # alone, so requests on cooldown never reach the database
+    cooldown = limiter.peek(POLICIES['login-cooldown'], attempt_key)
+    if not cooldown.allowed:
+        rate_limit_rejections_total.inc(policy='login-cooldown')
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail={
+            "msg": "Too many failed login attempts. Please wait before trying again.",
+            "cooldown_expires_at": str(cooldown.reset_at)
+        }, headers={'Retry-After': str(cooldown.retry_after)})
 
     # Verify bike owner exists
     owner_doc = request.app.collections['bike_owners'].find_one(
-        {'phone_number': phone_number})
+        {'phone_number': phone_number}, projection={'devices': 0})
     if not owner_doc:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike owner not found")
@@ -69,109 +77,75 @@ async def authenticate(request: Request, phone_number: str = Body(), password: s
     owner = BikeOwner(**owner_doc)
 
     # Check that the requester is not blacklisted
-    if owner.devices.is_blacklisted(req_ip_address):
+    device = device_store.find(owner.id, req_ip_address)
+    known_device = device is not None and device.status == DeviceStatus.TRUSTED
+    if device is not None and device.status == DeviceStatus.BLACKLISTED:
         raise HTTPException(status_code=status.HTTP_423_LOCKED, detail={
                             "Blacklisted ip-address: {req_ip_address}"})
 
-    # Start access session or use current access session
-    current_ac_session = None
-    ac_session_doc = request.app.collections['access_sessions'].find_one({
-        'phone_number': phone_number,
-        'ip_address': req_ip_address
-    })
-
-    if not ac_session_doc:
-        new_ac_session = AccessSession(
-            ip_address=req_ip_address, phone_number=phone_number)
-        new_ac_session.save()
-        current_ac_session = new_ac_session
-    else:
-        current_ac_session = AccessSession(**ac_session_doc)
-
-    # Check if session cooldown is expired
-    on_cooldown = current_ac_session.cooldown_expires_at > datetime.datetime.now(datetime.timezone.utc)
-    if on_cooldown:
-        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail={
-            "msg": "Too many failed login attempts. Please wait before trying again.",
-            "cooldown_expires_at": str(current_ac_session.cooldown_expires_at)
-        })
-
-    # Verify password
-    valid_password = bcrypt.checkpw(
-        password=password.encode(encoding="utf-8"),
-        hashed_password=owner_doc['hash']
-    )
+    # Verify password. Runs on the hashing executor, which caps how many hashes run at once
+    valid_password = password_hasher.verify_sync(password, owner_doc['hash'])
 
     if not valid_password:
 
-        # Add one attempt to the current access session
-        current_ac_session.login_attempts += 1
+        # Count the failed attempt towards both the cooldown and the blacklist
+        cooldown = limiter.hit(POLICIES['login-cooldown'], attempt_key)
+        attempts = limiter.hit(POLICIES['login-blacklist'], attempt_key)
 
-        # Checks and adds cooldown penalty if necessary
-        if current_ac_session.login_attempts >= MAX_ATTEMPTS_BEFORE_COOLDOWN and current_ac_session.login_attempts < MAX_ATTEMPTS_BEFORE_BLACKLIST:
-            current_ac_session.cooldown_expires_at = datetime.datetime.now(datetime.timezone.utc) + COOLDOWN_DURATIONS[current_ac_session.login_attempts]
-            current_ac_session.save()
-
-            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail={
-                "msg": "Too many failed login attempts. Please wait before trying again.",
-                "cooldown_expires_at": str(current_ac_session.cooldown_expires_at)
-            })
+        logger.info(
+            f"[{datetime.datetime.now(datetime.timezone.utc)}] Failed login attempt from ip: {req_ip_address}")
 
         # Check if device should be blacklisted
-        if current_ac_session.login_attempts == MAX_ATTEMPTS_BEFORE_BLACKLIST:
+        if not attempts.allowed or attempts.remaining == 0:
 
-            if owner.devices.is_known(req_ip_address):
+            if known_device:
                 # User have gone above max attempts but is on the whitelist.
                 # We don't wanna permanently block them out of their account so
-                # we just give them an extra try and add cd.
-                current_ac_session.cooldown_expires_at = datetime.datetime.utcnow(
-                ) + COOLDOWN_DURATIONS[current_ac_session.login_attempts]
-                current_ac_session.login_attempts -= 1
-                current_ac_session.save()
-
-                logger.info(
-                    f"[{datetime.datetime.now(datetime.timezone.utc)}] Failed login attempt from ip: {req_ip_address}")
+                # we just give them a cooldown until the attempts slide out of the window.
                 raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail={
                     "msg": "Too many failed login attempts. Please wait before trying again.",
-                    "cooldown_expires_at": str(current_ac_session.cooldown_expires_at)
-                })
+                    "cooldown_expires_at": str(attempts.reset_at)
+                }, headers={'Retry-After': str(max(attempts.retry_after, 1))})
             else:
-                owner.devices.black_list.append(
-                    Device(ip_address=req_ip_address))
+                device_store.blacklist(owner.id, req_ip_address)
 
-                logger.info(
-                    f"[{datetime.datetime.now(datetime.timezone.utc)}] Failed login attempt from ip: {req_ip_address}")
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail={
                     "msg": "Invalid credentials. Too many attempts, your device has been blacklisted",
                     "attempts_left": 0
                 })
 
-        # Save modifications
-        current_ac_session.save()
+        # Checks and adds cooldown penalty if necessary
+        if cooldown.remaining == 0:
+            cooldown = limiter.peek(POLICIES['login-cooldown'], attempt_key)
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail={
+                "msg": "Too many failed login attempts. Please wait before trying again.",
+                "cooldown_expires_at": str(cooldown.reset_at)
+            }, headers={'Retry-After': str(cooldown.retry_after)})
 
-        logger.info(
-            f"[{datetime.datetime.now(datetime.timezone.utc)}] Failed login attempt from ip: {req_ip_address}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail={
             "msg": "Invalid credentials",
-            "attempts_left": MAX_ATTEMPTS_BEFORE_BLACKLIST - current_ac_session.login_attempts
+            "attempts_left": attempts.remaining
         })
 
     # Successful login attempt, reset number of login attempts
-    current_ac_session.login_attempts = 0
-    current_ac_session.save()
+    limiter.reset(POLICIES['login-cooldown'], attempt_key)
+    limiter.reset(POLICIES['login-blacklist'], attempt_key)
 
-    # Check if the device is already known
-    if not owner.devices.is_known(req_ip_address):
+    # Upgrade the stored hash if the configured bcrypt cost has changed since it was made
+    if password_hasher.needs_rehash(owner_doc['hash']):
+        request.app.collections['bike_owners'].update_one(
+            {'_id': owner.id}, {'$set': {'hash': password_hasher.hash_sync(password)}})
 
-        SMS_COOLDOWN = datetime.timedelta(minutes=2)
+    # Check if the device is already known
+    if not known_device:
 
         # Check if user is still on cooldown
-        sms_on_cooldown = current_ac_session.sms_cooldown_expires_at > datetime.datetime.now(datetime.timezone.utc)
-        if sms_on_cooldown:
+        sms_cooldown = limiter.hit(POLICIES['unknown-device-sms'], attempt_key)
+        if not sms_cooldown.allowed:
             raise HTTPException(status_code=status.HTTP_425_TOO_EARLY, detail={
                 "msg": "There's recently been attempted an login from your device",
-                "cooldown_expires_at": str(current_ac_session.sms_cooldown_expires_at)
-            })
+                "cooldown_expires_at": str(sms_cooldown.reset_at)
+            }, headers={'Retry-After': str(sms_cooldown.retry_after)})
         
         session = TrustDeviceSession(
             name='trust-device', owner_id=owner.id, ip_address=req_ip_address)
@@ -182,20 +156,29 @@ async def authenticate(request: Request, phone_number: str = Body(), password: s
             to=phone_number
         )
 
-        # Sets a cooldown timer for sending an SMS to the user
-        current_ac_session.sms_cooldown_expires_at = datetime.datetime.now(datetime.timezone.utc) + SMS_COOLDOWN
-        current_ac_session.save()
-
         raise HTTPException(status_code=status.HTTP_307_TEMPORARY_REDIRECT, detail={
             "msg": "Password attempt from unknown device. Please verify device",
             "session_id": str(session.id)
         })
 
     # Device is whitelisted and password is correct
-    return {
-        "access_token": Authorize.create_access_token(subject=str(owner_doc['_id'])),
-        "refresh_token": Authorize.create_refresh_token(subject=str(owner_doc['_id']))
-    }
+    device_store.touch(device)
+
+    return issue_tokens(Authorize, owner.id)
+
+
+@router.post('/refresh', summary="Exchange a refresh token for a new access and refresh token", responses={
+    '200': {'model': AuthSuccessResponse, 'description': "Successfull refresh. The used refresh token is no longer valid"},
+    '401': {'description': "Invalid, expired or already used refresh token"},
+})
+def refresh_tokens(Authorize: AuthJWT = Depends()):
+    # Expects the refresh token as a bearer token in the Authorization header
+    try:
+        Authorize.jwt_refresh_token_required()
+    except AuthJWTException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+    return rotate_tokens(Authorize, Authorize.get_raw_jwt())
 
 
 @router.put('/trust-device', status_code=200)
@@ -203,13 +186,7 @@ def trust_device(request: Request, session=Depends(Verify2FASession('trust-devic
     session = TrustDeviceSession(**session)
 
     # Add the device to the owners whitelist
-    owner_doc = request.app.collections['bike_owners'].find_one(
-        {'_id': session.owner_id})
-    owner = BikeOwner(**owner_doc)
-
-    owner.devices.white_list.append(
-        Device(name=device_name, ip_address=session.ip_address))
-    owner.save()
+    device_store.trust(session.owner_id, session.ip_address, name=device_name)
 
 
 @router.post('/register/me', summary="Register a new bike owner")
@@ -217,31 +194,13 @@ def register_bike_owner(request: Request, phone_number: str = Depends(phone_numb
 
     # 1. Check that phone number does not already exists
     # 1.25 Validate password against OWASP standards
-    # 1.5 Hash and salt password
-    hashed_password = bcrypt.hashpw(
-        password.encode(encoding="utf-8"), bcrypt.gensalt())
-
-    # 1.75 Check whether a session for phone number and ip already exists
+    # 1.5 Check that the ip has not recently started a registration to prevent SMS spam
     request_ip = request.client.host
-    print(request.client)
-    print(request_ip)
-    # Find the last entry
-    existing_session = request.app.collections["2fa_sessions"].find_one({'request_ip_address': request_ip, 'name': 'bikeowner-registration'}, sort=[('$natural',-1)])
-    print(existing_session)
-    # print(now)
-
-    # If a session is found, check time since creation to prevent SMS spam to phone number
-    # If 60 seconds have passed allow creation of new registration session
-    if existing_session:
-        current_session = BikeOwnerRegistrationSession(**existing_session)
-        time_delta = datetime.datetime.now(datetime.timezone.utc) - current_session.created_at
-        if (time_delta.seconds < 300):
-            raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail={
-                "msg": f"You already have an active registration session. Please wait {300 - time_delta.seconds} seconds before trying again",
-                "cooldown_expires_at": str(current_session.expires_at)
-                })
-        else:
-            print(f"td seconds is {time_delta.seconds}, cooldown is over. Permission granted")
+    enforce('register-owner', request_ip, status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            msg="You already have an active registration session. Please wait before trying again")
+
+    # 1.75 Hash and salt password
+    hashed_password = password_hasher.hash_sync(password)
 
     # 2. Create and save new BikeOwnerSession object
     session = BikeOwnerRegistrationSession(
@@ -268,22 +227,16 @@ def verify_bikeowner_registration(request: Request, session=Depends(Verify2FASes
     bike_owner = BikeOwner(
         phone_number=session.phone_number, hash=session.hash)
     
-    # Add owner's current ip to whitelist
-    req_ip_address = request.client.host
-    device = Device(ip_address=req_ip_address, name="default")
-    bike_owner.devices.white_list.append(device)
-
     bike_owner.save()
 
+    # Add owner's current ip to whitelist
+    device_store.trust(bike_owner.id, request.client.host, name="default")
+
     # Maybe remove the session as the registration was successful? Implemented
     request.app.collections['2fa_sessions'].delete_one({'_id': session.id})
     
 
-    Authorize = AuthJWT()
-    return {
-        "access_token": Authorize.create_access_token(subject=str(bike_owner.id)),
-        "refresh_token": Authorize.create_refresh_token(subject=str(bike_owner.id))
-    }
+    return issue_tokens(AuthJWT(), bike_owner.id)
 
 
 @router.put('/reset-password/request', summary="Request a password reset in case of lost or compromised account")
@@ -296,16 +249,8 @@ def request_password_reset(request: Request, phone_number: str = Depends(sanitiz
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Bike owner with phonenumber '{phone_number}' not found")
     
-    existing_session = request.app.collections["2fa_sessions"].find_one({'phone_number': phone_number, 'name': 'password-reset'}, sort=[('$natural',-1)])
-
-    if existing_session:
-        current_session = ResetPasswordSession(**existing_session)
-        sms_on_cooldown = current_session.expires_at > datetime.datetime.now(datetime.timezone.utc)
-        if sms_on_cooldown:
-            raise HTTPException(status_code=status.HTTP_425_TOO_EARLY, detail={
-                "msg": "There's recently been requested a reset password attempt",
-                "cooldown_expires_at": str(current_session.expires_at)
-            })
+    enforce('password-reset', phone_number, status_code=status.HTTP_425_TOO_EARLY,
+            msg="There's recently been requested a reset password attempt")
 
     # Start a new password reset session with the owner
     current_rp_session = ResetPasswordSession(
@@ -352,10 +297,12 @@ def confirm_password_reset(request: Request, session_id: uuid.UUID = Body(), pas
         {'phone_number': session.phone_number})
 
     owner = BikeOwner(**owner_doc)
-    owner.hash = bcrypt.hashpw(password.encode(
-        encoding="utf-8"), bcrypt.gensalt())
+    owner.hash = password_hasher.hash_sync(password)
     owner.save()
 
+    # Log out every device, as the old password might have been compromised
+    revoke_token_families(owner.id)
+
     send_sms(msg="Din adgangskode er blevet nulstillet",
              to=session.phone_number)
 
@@ -23,7 +23,8 @@ class Session2FA(Entity):
     
     name: str
     otp:  str = Field(default_factory=generate_otp)     # It might be a good idea to hash this. Although there is an in-build security in the expiration time
-    expires_at : datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5))
+    created_at: datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc))
+    expires_at : datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=5))    # Removed by a TTL index some time after expiry
 
 
 class TrustDeviceSession(Session2FA):
@@ -35,21 +36,9 @@ class BikeOwnerRegistrationSession(Session2FA):
     hash: bytes
     phone_number: str
     request_ip_address: str
-    created_at: datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc))
     
 
 class ResetPasswordSession(Session2FA):    
     phone_number: str           # Phone number of account trying to reset password
     verified : bool = False     # Only when this flag is set to true allows for a password change
 
-
-class AccessSession(Entity):
-
-    _COLLECTION_NAME = PrivateAttr(default='access_sessions')
-
-    ip_address: str
-    phone_number: str       # Phone number of owner trying to access
-    login_attempts: int = 0
-    otp: str = Field(default_factory=generate_otp)
-    cooldown_expires_at: datetime.datetime = Field(default_factory=lambda : datetime.datetime.now(datetime.timezone.utc))
-    #last_login_attempt_at: datetime
\ No newline at end of file
@@ -0,0 +1,71 @@
+import datetime
+import uuid
+
+from fastapi import HTTPException, status
+from fastapi_jwt_auth import AuthJWT
+
+from src.database import MongoDatabase
+from src.settings import config
+from src.auth.models import RefreshTokenFamily
+
+
+REFRESH_TOKEN_EXPIRES = datetime.timedelta(days=int(config.get('JWT_REFRESH_EXPIARY_TIME_DAYS', 30)))
+
+
+def _token_pair(Authorize: AuthJWT, owner_id: uuid.UUID, family_id: uuid.UUID, token_id: uuid.UUID) -> dict:
+    return {
+        "access_token": Authorize.create_access_token(subject=str(owner_id)),
+        "refresh_token": Authorize.create_refresh_token(subject=str(owner_id), user_claims={
+            'fam': str(family_id),
+            'rti': str(token_id)
+        })
+    }
+
+
+def issue_tokens(Authorize: AuthJWT, owner_id: uuid.UUID) -> dict:
+    """ Starts a new refresh token family for the owner and returns an access and refresh token """
+    family = RefreshTokenFamily(
+        owner_id=owner_id,
+        expires_at=datetime.datetime.now(datetime.timezone.utc) + REFRESH_TOKEN_EXPIRES
+    ).insert()
+
+    return _token_pair(Authorize, owner_id, family.id, family.current_token_id)
+
+
+def rotate_tokens(Authorize: AuthJWT, claims: dict) -> dict:
+    """
+    Exchanges the refresh token with the given claims for a new token pair.
+
+    The family is moved to the new token in a single conditional update. If the
+    token is not the current one of its family it has been used before, which means
+    it has leaked, so the whole family is revoked and the owner has to log in again.
+    """
+    try:
+        owner_id = uuid.UUID(claims['sub'])
+        family_id = uuid.UUID(claims['fam'])
+        token_id = uuid.UUID(claims['rti'])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token is not valid. Please log in again")
+
+    families = MongoDatabase().collections['refresh_token_families']
+    now = datetime.datetime.now(datetime.timezone.utc)
+    new_token_id = uuid.uuid4()
+
+    family = families.find_one_and_update(
+        {'_id': family_id, 'owner_id': owner_id, 'current_token_id': token_id, 'revoked': False},
+        {'$set': {'current_token_id': new_token_id, 'last_used_at': now, 'expires_at': now + REFRESH_TOKEN_EXPIRES}},
+        projection={'_id': 1}
+    )
+
+    if not family:
+        # Either the family is gone or revoked, or an old token of the family was replayed
+        families.update_one({'_id': family_id, 'revoked': False}, {'$set': {'revoked': True}})
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token is no longer valid. Please log in again")
+
+    return _token_pair(Authorize, owner_id, family_id, new_token_id)
+
+
+def revoke_token_families(owner_id: uuid.UUID):
+    """ Revokes every refresh token family of an owner, logging them out on all devices """
+    MongoDatabase().collections['refresh_token_families'].update_many(
+        {'owner_id': owner_id, 'revoked': False}, {'$set': {'revoked': True}})
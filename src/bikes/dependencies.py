@@ -1,6 +1,19 @@
 import re as regex
 from fastapi import Form, HTTPException, Request, status
 
+# Compiled once and shared by the single and the bulk registration
+FRAME_NUMBER_PATTERN = regex.compile("^[a-zA-Z]{1,4}[0-9]+[a-zA-Z]$")
+DANISH_PHONE_NUMBER_PATTERN = regex.compile('^(\+45)?[0-9]{8}')
+
+
+def is_valid_frame_number(frame_number: str) -> bool:
+    return FRAME_NUMBER_PATTERN.search(frame_number) is not None
+
+
+def is_valid_danish_phone_number(phone_number: str) -> bool:
+    return DANISH_PHONE_NUMBER_PATTERN.search(phone_number.replace(' ', '')) is not None
+
+
 def frame_number_not_registered(request: Request, frame_number: str = Form(...)):
     """Checks that the frame number is not already in the database"""
     bike = request.app.collections['bikes'].find_one({'frame_number': frame_number.lower()})
@@ -18,15 +31,12 @@ def valid_frame_number(frame_number: str = Form(...)):
 
     @See: https://da.wikipedia.org/wiki/Det_danske_stelnummersystem_for_cykler for more info
     """
-    valid = regex.search("^[a-zA-Z]{1,4}[0-9]+[a-zA-Z]$", frame_number)
-    if valid:
+    if is_valid_frame_number(frame_number):
         return frame_number
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid frame number. See https://da.wikipedia.org/wiki/Det_danske_stelnummersystem_for_cykler for valid frame numbers")
 
 def valid_danish_phone_number(phone_number: str = Form(...)):
-    trimmed = phone_number.replace(' ', '')
-    valid = regex.search('^(\+45)?[0-9]{8}', trimmed)
-    if not valid:
+    if not is_valid_danish_phone_number(phone_number):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid phonenumber. Currently only danish phonenumbers are valid")
         
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+    Ownership event log
+
+    Every claim, accepted transfer and stolen or found report appends an event
+    to 'ownership_events'. Events are only ever inserted, never updated, so the
+    log is the bike's ownership history as it happened. A bike's timeline is a
+    single range of the (bike_id, ts, _id) index.
+"""
+
+import datetime
+import uuid
+from enum import Enum
+
+from pydantic import Field, PrivateAttr
+
+from src.database import MongoDatabase
+from src.models import Entity
+
+
+EVENTS_COLLECTION_NAME = 'ownership_events'
+
+
+class OwnershipEventKind(str, Enum):
+    CLAIMED = "claimed",
+    TRANSFERRED = "transferred",
+    REPORTED_STOLEN = "reported_stolen",
+    REPORTED_FOUND = "reported_found"
+
+
+class OwnershipEvent(Entity):
+    _COLLECTION_NAME = PrivateAttr(default=EVENTS_COLLECTION_NAME)
+
+    bike_id: uuid.UUID
+    kind: OwnershipEventKind
+    ts: datetime.datetime = Field(default_factory= lambda : datetime.datetime.now(datetime.timezone.utc))
+    owner_id: uuid.UUID                         # Owner after the event
+    previous_owner_id: uuid.UUID | None = None  # Set on transfers
+    transfer_id: uuid.UUID | None = None
+
+
+def append(events: list[OwnershipEvent]):
+    """ Appends the events in a single round trip """
+    if not events:
+        return
+
+    # Same document shape as Entity.insert produces
+    MongoDatabase().collections[EVENTS_COLLECTION_NAME].insert_many(
+        [{'_id': event.id, **event.dict()} for event in events], ordered=False)
+
+
+def timeline(bike_id: uuid.UUID, after: datetime.datetime | None = None, after_id: uuid.UUID | None = None,
+             limit: int = 100) -> list[OwnershipEvent]:
+    """
+    The bike's events after a point in time, oldest first. Served by the (bike_id, ts, _id) index
+
+    Events can share a ts, so a page continues from the ts and id of the last event of the previous
+    page. Without after_id every event at the ts is left out
+    """
+    filter = {'bike_id': bike_id}
+    if after is not None and after_id is not None:
+        filter['$or'] = [{'ts': {'$gt': after}}, {'ts': after, '_id': {'$gt': after_id}}]
+    elif after is not None:
+        filter['ts'] = {'$gt': after}
+
+    return [OwnershipEvent(**event) for event in MongoDatabase().collections[EVENTS_COLLECTION_NAME].find(
+        filter, sort=[('ts', 1), ('_id', 1)], limit=limit)]
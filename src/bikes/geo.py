@@ -0,0 +1,53 @@
+"""
+    Location based lookups of stolen bikes and discoveries
+
+    Both use $geoNear on a 2dsphere index, so results come sorted by distance
+    straight from the index and only `limit` documents are read.
+"""
+
+from pymongo.database import Database
+
+from src.bikes.models import GeoPoint
+from src.settings import config
+
+
+NEARBY_DEFAULT_DISTANCE_METERS = int(config.get('NEARBY_DEFAULT_DISTANCE_METERS', 2_000))
+NEARBY_MAX_DISTANCE_METERS = int(config.get('NEARBY_MAX_DISTANCE_METERS', 50_000))
+NEARBY_MAX_RESULTS = int(config.get('NEARBY_MAX_RESULTS', 100))
+
+# Never expose the receipt, the claim token or the owner of somebody else's bike
+STOLEN_BIKE_PROJECTION = {
+    'frame_number': 1, 'brand': 1, 'kind': 1, 'color': 1, 'gender': 1, 'is_electric': 1,
+    'image': 1, 'stolen_date': 1, 'stolen_location': 1, 'distance': 1,
+}
+
+DISCOVERY_PROJECTION = {
+    'frame_number': 1, 'address': 1, 'comment': 1, 'image': 1, 'created_at': 1, 'location': 1, 'distance': 1,
+}
+
+
+def _near(collection, key: str, point: GeoPoint, max_distance: int, limit: int, query: dict, projection: dict) -> list[dict]:
+    return list(collection.aggregate([
+        {'$geoNear': {
+            'near': point.dict(),
+            'key': key,
+            'distanceField': 'distance',    # Meters
+            'maxDistance': max_distance,
+            'spherical': True,
+            'query': query,
+        }},
+        {'$limit': limit},
+        {'$project': projection},
+    ]))
+
+
+def stolen_bikes_near(collections: Database, point: GeoPoint, max_distance: int, limit: int) -> list[dict]:
+    """ Bikes that are currently reported stolen, closest first """
+    return _near(collections['bikes'], 'stolen_location', point, max_distance, limit,
+                 query={'reported_stolen': True}, projection=STOLEN_BIKE_PROJECTION)
+
+
+def discoveries_near(collections: Database, point: GeoPoint, max_distance: int, limit: int) -> list[dict]:
+    """ Found bike reports, closest first """
+    return _near(collections['discoveries'], 'location', point, max_distance, limit,
+                 query={}, projection=DISCOVERY_PROJECTION)
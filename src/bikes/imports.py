@@ -0,0 +1,160 @@
+"""
+    Bulk registration of bikes, ex. by a shop registering the bikes it has sold
+
+    The whole batch is validated up front, checked for already registered
+    frame numbers with a single query and inserted in chunks. The claim codes
+    are returned as SMS messages for the caller to send in one batch.
+"""
+
+import csv
+import io
+import json
+
+from fastapi import HTTPException, UploadFile, status
+from pydantic import BaseModel, ValidationError
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from src.bikes.dependencies import is_valid_danish_phone_number, is_valid_frame_number
+from src.bikes.models import Bike, BikeColor, BikeGender, BikeKind
+from src.bikes.responses import BikeImportReport, BikeImportResult, BikeImportStatus
+from src.settings import config
+
+
+IMPORT_MAX_ROWS = int(config.get('BIKE_IMPORT_MAX_ROWS', 1000))
+IMPORT_CHUNK_SIZE = int(config.get('BIKE_IMPORT_CHUNK_SIZE', 250))
+IMPORT_MAX_BYTES = int(config.get('BIKE_IMPORT_MAX_BYTES', 1_000_000))
+
+
+class BikeImportRow(BaseModel):
+    """ The same fields as a single registration, except for the files """
+    phone_number: str
+    frame_number: str
+    gender: BikeGender
+    is_electric: bool
+    kind: BikeKind
+    brand: str
+    color: BikeColor
+
+
+def read_rows(file: UploadFile) -> list[dict]:
+    """ Reads a CSV file with a header row, or a JSON list of objects. Stops reading past the size and row limits """
+    content = file.file.read(IMPORT_MAX_BYTES + 1)
+    if len(content) > IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"Imports can be at most {IMPORT_MAX_BYTES // 1000}KB")
+
+    too_many_rows = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                  detail=f"At most {IMPORT_MAX_ROWS} bikes can be imported at a time")
+    is_json = file.content_type == 'application/json' or (file.filename or '').lower().endswith('.json')
+    try:
+        if is_json:
+            rows = json.loads(content)
+            if not isinstance(rows, list):
+                raise ValueError("Expected a list of bikes")
+            if len(rows) > IMPORT_MAX_ROWS:
+                raise too_many_rows
+        else:
+            rows = []
+            for row in csv.DictReader(io.StringIO(content.decode('utf-8-sig'))):
+                if len(rows) == IMPORT_MAX_ROWS:
+                    raise too_many_rows
+                rows.append(row)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Could not read '{file.filename}': {e}")
+    return rows
+
+
+def _validate(index: int, raw: dict) -> BikeImportRow | BikeImportResult:
+    # Only echoed back when it can be, the row is invalid either way otherwise
+    frame_number = raw.get('frame_number') if isinstance(raw, dict) else None
+    if not isinstance(frame_number, str):
+        frame_number = None
+
+    def invalid(detail: str) -> BikeImportResult:
+        return BikeImportResult(row=index, frame_number=frame_number, status=BikeImportStatus.INVALID, detail=detail)
+
+    if not isinstance(raw, dict):
+        return invalid("Expected an object")
+    try:
+        row = BikeImportRow(**raw)
+    except ValidationError as e:
+        return invalid('; '.join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+
+    if not is_valid_frame_number(row.frame_number):
+        return invalid("Invalid frame number. See https://da.wikipedia.org/wiki/Det_danske_stelnummersystem_for_cykler for valid frame numbers")
+    if not is_valid_danish_phone_number(row.phone_number):
+        return invalid("Invalid phonenumber. Currently only danish phonenumbers are valid")
+
+    # Stored the same way as single registrations
+    row.frame_number = row.frame_number.lower()
+    row.phone_number = row.phone_number.replace(' ', '')
+    return row
+
+
+def import_bikes(collections: Database, raw_rows: list[dict]) -> tuple[BikeImportReport, list[tuple[str, str]]]:
+    """
+    Registers the valid rows that are not already registered
+
+    :returns the per row report and the (msg, to) SMS messages with the claim codes
+    """
+    results: dict[int, BikeImportResult] = {}
+    valid: dict[int, BikeImportRow] = {}
+    seen: set[str] = set()
+
+    for index, raw in enumerate(raw_rows, start=1):
+        row = _validate(index, raw)
+        if isinstance(row, BikeImportResult):
+            results[index] = row
+        elif row.frame_number in seen:
+            results[index] = BikeImportResult(row=index, frame_number=row.frame_number, status=BikeImportStatus.DUPLICATE,
+                                              detail="Frame number appears more than once in the import")
+        else:
+            seen.add(row.frame_number)
+            valid[index] = row
+
+    # One query for every frame number in the batch
+    registered = {doc['frame_number'] for doc in collections['bikes'].find(
+        {'frame_number': {'$in': list(seen)}}, projection={'_id': 0, 'frame_number': 1})}
+
+    bikes: list[tuple[int, BikeImportRow, Bike]] = []
+    for index, row in valid.items():
+        if row.frame_number in registered:
+            results[index] = BikeImportResult(row=index, frame_number=row.frame_number, status=BikeImportStatus.DUPLICATE,
+                                              detail=f"Bike with frame number '{row.frame_number}' is already registered")
+            continue
+        bike = Bike(frame_number=row.frame_number, gender=row.gender, is_electric=row.is_electric,
+                    kind=row.kind, brand=row.brand, color=row.color)
+        bikes.append((index, row, bike))
+
+    messages = []
+    for start in range(0, len(bikes), IMPORT_CHUNK_SIZE):
+        chunk = bikes[start:start + IMPORT_CHUNK_SIZE]
+
+        # Same document shape as Entity.insert. Unordered so one bad document doesn't stop the rest
+        failed: dict[int, str] = {}
+        try:
+            collections['bikes'].insert_many([{'_id': bike.id, **bike.dict()} for _, _, bike in chunk], ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+        except PyMongoError as e:
+            # Unknown which inserts made it. The ones that did still need their claim codes sent
+            try:
+                inserted = {doc['_id'] for doc in collections['bikes'].find(
+                    {'_id': {'$in': [bike.id for _, _, bike in chunk]}}, projection={'_id': 1})}
+            except PyMongoError:
+                inserted = set()
+            failed = {position: f"Could not save the bike: {e}" for position, (_, _, bike) in enumerate(chunk) if bike.id not in inserted}
+
+        for position, (index, row, bike) in enumerate(chunk):
+            if position in failed:
+                results[index] = BikeImportResult(row=index, frame_number=row.frame_number, status=BikeImportStatus.FAILED,
+                                                  detail=failed[position])
+                continue
+            results[index] = BikeImportResult(row=index, frame_number=row.frame_number, status=BikeImportStatus.CREATED, bike_id=bike.id)
+            messages.append(("Tak for at have registreret din cykel !\nBrug den efterfølgende kode til at indløse din cykel i appen", row.phone_number))
+            messages.append((str(bike.claim_token), row.phone_number))
+
+    ordered = [results[index] for index in sorted(results)]
+    created = sum(result.status == BikeImportStatus.CREATED for result in ordered)
+    return BikeImportReport(created=created, failed=len(ordered) - created, results=ordered), messages
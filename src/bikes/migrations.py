@@ -0,0 +1,77 @@
+"""
+    Bike migrations
+
+    Backfills the ownership event log of bikes claimed before the log was
+    introduced, from their claim date, their accepted transfers and, when they
+    are reported stolen, their stolen date. Earlier stolen and found reports
+    were not kept anywhere and cannot be recovered. Bikes that already have
+    events are skipped, so it is safe to run more than once.
+
+    Usage:
+        python -m src.bikes.migrations
+"""
+
+from src.bikes.events import EVENTS_COLLECTION_NAME, OwnershipEvent, OwnershipEventKind, append
+from src.database import MongoDatabase
+from src.transfers.models import BikeTransferState
+
+
+def backfill_ownership_events(batch_size: int = 500) -> int:
+    db = MongoDatabase()
+    backfilled = 0
+
+    def flush(batch: list[dict]):
+        bike_ids = [bike['_id'] for bike in batch]
+        logged = set(db.collections[EVENTS_COLLECTION_NAME].distinct('bike_id', {'bike_id': {'$in': bike_ids}}))
+
+        transfers = {}
+        for transfer in db.collections['transfers'].find(
+                {'bike_id': {'$in': bike_ids}, 'state': BikeTransferState.ACCEPTED},
+                projection={'bike_id': 1, 'sender': 1, 'receiver': 1, 'closed_at': 1, 'created_at': 1}):
+            transfers.setdefault(transfer['bike_id'], []).append(transfer)
+
+        backfill = []
+        for bike in batch:
+            if bike['_id'] in logged:
+                continue
+
+            handovers = sorted(transfers.get(bike['_id'], []), key=lambda transfer: transfer.get('closed_at') or transfer['created_at'])
+
+            # The first sender claimed the bike, unless nobody has transferred it yet
+            claimed_by = handovers[0]['sender'] if handovers else bike['owner']
+            backfill.append(OwnershipEvent(bike_id=bike['_id'], kind=OwnershipEventKind.CLAIMED, ts=bike['claimed_date'], owner_id=claimed_by))
+
+            for transfer in handovers:
+                backfill.append(OwnershipEvent(
+                    bike_id=bike['_id'], kind=OwnershipEventKind.TRANSFERRED, ts=transfer.get('closed_at') or transfer['created_at'],
+                    owner_id=transfer['receiver'], previous_owner_id=transfer['sender'], transfer_id=transfer['_id']
+                ))
+
+            if bike.get('reported_stolen') and bike.get('stolen_date'):
+                backfill.append(OwnershipEvent(bike_id=bike['_id'], kind=OwnershipEventKind.REPORTED_STOLEN, ts=bike['stolen_date'], owner_id=bike['owner']))
+
+        append(backfill)
+        return len(backfill)
+
+    batch = []
+    cursor = db.collections['bikes'].find(
+        {'owner': {'$ne': None}, 'claimed_date': {'$ne': None}},
+        projection={'owner': 1, 'claimed_date': 1, 'reported_stolen': 1, 'stolen_date': 1},
+        batch_size=batch_size
+    )
+    for bike in cursor:
+        batch.append(bike)
+        if len(batch) >= batch_size:
+            backfilled += flush(batch)
+            batch = []
+    if batch:
+        backfilled += flush(batch)
+
+    return backfilled
+
+
+if __name__ == '__main__':
+    db = MongoDatabase()
+    db.connect()
+    print(f"Backfilled {backfill_ownership_events()} ownership events")
+    db.disconnect()
@@ -1,7 +1,8 @@
 import datetime
 import uuid
 from enum import Enum
-from pydantic import Field, PrivateAttr
+from typing import Literal
+from pydantic import BaseModel, Field, PrivateAttr, validator
 
 from src.models import Entity
 from src.storage.models import S3File
@@ -45,6 +46,26 @@ class BikeState(str, Enum):
     IN_TRANSFER = "in_transfer",
 
 
+class GeoPoint(BaseModel):
+    """ A GeoJSON point. Note that GeoJSON puts the longitude first """
+    type: Literal['Point'] = 'Point'
+    coordinates: tuple[float, float]    # (longitude, latitude)
+
+    @classmethod
+    def from_lat_lng(cls, latitude: float | None, longitude: float | None) -> 'GeoPoint | None':
+        """ Returns None unless both are given """
+        if latitude is None or longitude is None:
+            return None
+        return cls(coordinates=(longitude, latitude))
+
+    @validator('coordinates')
+    def valid_coordinates(cls, coordinates):
+        longitude, latitude = coordinates
+        if not -180 <= longitude <= 180 or not -90 <= latitude <= 90:
+            raise ValueError("Longitude must be within -180..180 and latitude within -90..90")
+        return coordinates
+
+
 class FoundBikeReport(Entity):
 
     _COLLECTION_NAME = PrivateAttr(default='discoveries')
@@ -55,6 +76,7 @@ class FoundBikeReport(Entity):
     image: S3File | None = S3File.field(path='location-images', allowed_content_types=[
                                         'image/png', 'image/jpeg', 'image/jpg'], max_size=10_000_000)
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    location: GeoPoint | None = None    # Where the bike was found, if the reporter shared it
 
 
 class Bike(Entity):
@@ -76,9 +98,11 @@ class Bike(Entity):
     claim_token: uuid.UUID = Field(default_factory=uuid.uuid4)
     claimed_date: datetime.datetime | None
     stolen_date: datetime.datetime | None
+    stolen_location: GeoPoint | None = None     # Where the bike was stolen, if the owner shared it
     created_at: datetime.datetime = Field(default_factory= lambda : datetime.datetime.now(datetime.timezone.utc))
     # Figure out how to handle these states
     state: BikeState = BikeState.TRANSFERABLE
+    pending_transfer: uuid.UUID | None = None   # Id of the transfer while the bike is in transfer
 
 # ___ Changelog ___
 # TODO: Add testing framework
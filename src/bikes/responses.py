@@ -0,0 +1,24 @@
+import uuid
+from enum import Enum
+from pydantic import BaseModel
+
+
+class BikeImportStatus(str, Enum):
+    CREATED = "created",
+    INVALID = "invalid",
+    DUPLICATE = "duplicate",
+    FAILED = "failed"
+
+
+class BikeImportResult(BaseModel):
+    row          : int                   # 1 based, not counting a CSV header
+    frame_number : str | None
+    status       : BikeImportStatus
+    bike_id      : uuid.UUID | None = None
+    detail       : str | None = None     # Reason the row was not imported
+
+
+class BikeImportReport(BaseModel):
+    created : int
+    failed  : int
+    results : list[BikeImportResult]
@@ -1,12 +1,22 @@
 import datetime
 import uuid
-from fastapi import APIRouter, Depends, Form, Path, Request, Response, HTTPException, UploadFile, File, status
+from collections import defaultdict
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, Form, Path, Query, Request, Response, HTTPException, UploadFile, File, status
 from src.auth.dependencies import authenticated_request
-from src.notifications.sms import send_sms
+from src.notifications.sms import send_sms, send_sms_batch
 from src.storage.aws import save_file
 from src.bikes.dependencies import *
-from src.bikes.models import Bike, BikeColor, BikeGender, BikeKind, BikeState, FoundBikeReport
+from src.bikes import events
+from src.bikes.geo import NEARBY_DEFAULT_DISTANCE_METERS, NEARBY_MAX_DISTANCE_METERS, NEARBY_MAX_RESULTS, discoveries_near, stolen_bikes_near
+from src.bikes.imports import import_bikes, read_rows
+from src.bikes.models import Bike, BikeColor, BikeGender, BikeKind, BikeState, FoundBikeReport, GeoPoint
+from src.bikes.responses import BikeImportReport
+from src.database import MongoDatabase
 from src.owners.models import BikeOwner
+from src.ratelimit.dependencies import RateLimit
+from src.activities import counters
+from src.sync import changes
+from src.transfers.utils import refresh_bike_snapshot
 
 
 router = APIRouter(
@@ -20,7 +30,7 @@ router = APIRouter(
     description="Retrieve a list of owned bikes"
 )
 def get_my_bikes(request: Request, user: BikeOwner = Depends(authenticated_request)) -> list[Bike]:
-    bikes = list(request.app.collections["bikes"].find(
+    bikes = list(MongoDatabase().read_collection("bikes", 'my-bikes').find(
         {
             'owner': user.id
         }
@@ -47,12 +57,10 @@ def get_my_bikes(request: Request, user: BikeOwner = Depends(authenticated_reque
     status_code=status.HTTP_200_OK
 )
 def get_bike_by_frame_number(request: Request, frame_number: str, user: BikeOwner = Depends(authenticated_request)) -> Bike:
-    bike_in_db = request.app.collections["bikes"].find_one(
-        {"frame_number": frame_number.lower()})
-    if bike_in_db is None:
+    bike = Bike.find_one({"frame_number": frame_number.lower()}, read_policy='stolen-lookup')
+    if bike is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail=f"Cykel med stelnummer {frame_number} ikke fundet i vores system")
-    bike = Bike(**bike_in_db)
 
     if bike.reported_stolen:
         return bike
@@ -60,6 +68,68 @@ def get_bike_by_frame_number(request: Request, frame_number: str, user: BikeOwne
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
 
 
+@router.get(
+    '/stolen/nearby',
+    description="Bikes reported stolen near a location, closest first. Distances are in meters",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(authenticated_request)]
+)
+def get_stolen_bikes_nearby(
+    request: Request,
+    latitude: float = Query(ge=-90, le=90),
+    longitude: float = Query(ge=-180, le=180),
+    max_distance: int = Query(default=NEARBY_DEFAULT_DISTANCE_METERS, gt=0, le=NEARBY_MAX_DISTANCE_METERS),
+    limit: int = Query(default=20, gt=0, le=NEARBY_MAX_RESULTS)
+) -> list[dict]:
+    return stolen_bikes_near(request.app.collections, GeoPoint.from_lat_lng(latitude, longitude), max_distance, limit)
+
+
+@router.get(
+    '/{id}/discoveries/nearby',
+    description="Found bike reports near where one of your bikes was stolen, closest first. Distances are in meters",
+    status_code=status.HTTP_200_OK
+)
+def get_discoveries_near_theft(
+    id: uuid.UUID,
+    request: Request,
+    user: BikeOwner = Depends(authenticated_request),
+    max_distance: int = Query(default=NEARBY_DEFAULT_DISTANCE_METERS, gt=0, le=NEARBY_MAX_DISTANCE_METERS),
+    limit: int = Query(default=20, gt=0, le=NEARBY_MAX_RESULTS)
+) -> list[dict]:
+    bike_in_db = request.app.collections["bikes"].find_one(
+        {"_id": id, "owner": user.id}, projection={'reported_stolen': 1, 'stolen_location': 1})
+    if not bike_in_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike with ID {id} not found")
+    if not bike_in_db.get('reported_stolen') or not bike_in_db.get('stolen_location'):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bike is not reported stolen with a location")
+
+    return discoveries_near(request.app.collections, GeoPoint(**bike_in_db['stolen_location']), max_distance, limit)
+
+
+@router.get(
+    '/{id}/timeline',
+    description="Ownership history of a bike, oldest first. Available to its current and former owners. Page with the ts and id of the last event",
+    status_code=status.HTTP_200_OK
+)
+def get_bike_timeline(
+    id: uuid.UUID,
+    request: Request,
+    user: BikeOwner = Depends(authenticated_request),
+    after: datetime.datetime | None = None,
+    after_id: uuid.UUID | None = None,
+    limit: int = Query(default=100, gt=0, le=500)
+) -> list[events.OwnershipEvent]:
+    bike_in_db = request.app.collections["bikes"].find_one({"_id": id}, projection={'owner': 1})
+    if not bike_in_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike with ID {id} not found")
+
+    if bike_in_db.get('owner') != user.id and not request.app.collections[events.EVENTS_COLLECTION_NAME].find_one(
+            {'bike_id': id, '$or': [{'owner_id': user.id}, {'previous_owner_id': user.id}]}, projection={'_id': 1}):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"User has never owned the bike")
+
+    return events.timeline(id, after, after_id, limit)
+
+
 @router.post(
     '/discoveries',
     description="Report a found bike",
@@ -72,6 +142,8 @@ def found_bike_report(
     address: str = Form(...),
     comment: str = Form(default=None),
     image: UploadFile = File(default=None),
+    latitude: float = Form(default=None, ge=-90, le=90),
+    longitude: float = Form(default=None, ge=-180, le=180),
 
 ) -> FoundBikeReport:
 
@@ -81,10 +153,15 @@ def found_bike_report(
         address=address,
         comment=comment,
         frame_number=frame_number.lower(),
+        location=GeoPoint.from_lat_lng(latitude, longitude),
     )
     bikeIncident.image.upload_and_set(image)
+    bikeIncident = bikeIncident.save()
+
+    counters.increment(bike_owner, discoveries=1)
+    changes.record([changes.Change(bike_owner, changes.ChangeKind.DISCOVERY, bikeIncident.id)])
 
-    return bikeIncident.save()
+    return bikeIncident
 
 
 @router.post(
@@ -92,7 +169,7 @@ def found_bike_report(
     description="Register a new bike",
     status_code=status.HTTP_201_CREATED,
     dependencies=[Depends(frame_number_not_registered), Depends(
-        valid_danish_phone_number), Depends(valid_frame_number)]
+        valid_danish_phone_number), Depends(valid_frame_number), Depends(RateLimit('register-bike'))]
 )
 def register_bike(
     phone_number: str = Form(...),
@@ -125,6 +202,20 @@ def register_bike(
 
     return bike.save()
 
+@router.post(
+    '/import',
+    description="Register many bikes at once from a CSV file with a header row or a JSON list. Images and receipts are not supported",
+    status_code=status.HTTP_200_OK,
+    dependencies=[Depends(authenticated_request), Depends(RateLimit('import-bikes'))]
+)
+def import_bikes_batch(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...)) -> BikeImportReport:
+    report, messages = import_bikes(request.app.collections, read_rows(file))
+
+    # The claim codes are sent after the response so the shop doesn't wait for hundreds of SMS'es
+    background_tasks.add_task(send_sms_batch, messages)
+
+    return report
+
 @router.post("/claim/{claim_token}", description="Claim a new bike")
 def claim_bike(request: Request, claim_token: uuid.UUID, user: BikeOwner = Depends(authenticated_request)) -> Bike:
     bike_in_db = request.app.collections["bikes"].find_one(
@@ -148,6 +239,9 @@ def claim_bike(request: Request, claim_token: uuid.UUID, user: BikeOwner = Depen
     bike.claimed_date = datetime.datetime.now(datetime.timezone.utc)
     bike.save()
 
+    changes.record([changes.Change(user.id, changes.ChangeKind.BIKE, bike.id)])
+    events.append([events.OwnershipEvent(bike_id=bike.id, kind=events.OwnershipEventKind.CLAIMED, ts=bike.claimed_date, owner_id=user.id)])
+
     return bike
 
 
@@ -159,7 +253,9 @@ def claim_bike(request: Request, claim_token: uuid.UUID, user: BikeOwner = Depen
 def report_bike_stolen(
     id: uuid.UUID,
     request: Request,
-    user: BikeOwner = Depends(authenticated_request)
+    user: BikeOwner = Depends(authenticated_request),
+    latitude: float | None = Body(default=None, ge=-90, le=90),     # Where the bike was stolen. Optional
+    longitude: float | None = Body(default=None, ge=-180, le=180)
 ):
 
     bike_in_db = request.app.collections["bikes"].find_one({"_id": id})
@@ -172,8 +268,43 @@ def report_bike_stolen(
     # If correct owner, flip bike's stolen attribute
     bike.reported_stolen = not bike.reported_stolen
 
+    if bike.reported_stolen:
+        bike.stolen_date = datetime.datetime.now(datetime.timezone.utc)
+        bike.stolen_location = GeoPoint.from_lat_lng(latitude, longitude)
+    else:
+        # Leaves the stolen bikes index
+        bike.stolen_date = None
+        bike.stolen_location = None
+
+    bike_changes = [changes.Change(user.id, changes.ChangeKind.BIKE, bike.id)]
+
     # If reported found, remove any existing discoveries pertaining to this bike
     if not bike.reported_stolen:
-        request.app.collections["discoveries"].delete_many({"frame_number": bike.frame_number})
+        # Read first so the owners' apps can be told which discoveries are gone
+        discoveries = list(request.app.collections["discoveries"].find({"frame_number": bike.frame_number}, projection={'bike_owner': 1}))
+        if discoveries:
+            # Discoveries are counted for the owner they were reported to, who may be an earlier owner of the bike
+            by_owner = defaultdict(list)
+            for discovery in discoveries:
+                by_owner[discovery['bike_owner']].append(discovery['_id'])
+
+            deltas = {}
+            for owner_id, discovery_ids in by_owner.items():
+                deleted = request.app.collections["discoveries"].delete_many({"_id": {"$in": discovery_ids}})
+                if deleted.deleted_count:
+                    deltas[owner_id] = {'discoveries': -deleted.deleted_count}
+            counters.increment_many(deltas)
+
+            bike_changes += [changes.Change(discovery['bike_owner'], changes.ChangeKind.DISCOVERY, discovery['_id'], deleted=True)
+                             for discovery in discoveries]
 
     bike.save()
+    changes.record(bike_changes)
+    events.append([events.OwnershipEvent(
+        bike_id=bike.id,
+        kind=events.OwnershipEventKind.REPORTED_STOLEN if bike.reported_stolen else events.OwnershipEventKind.REPORTED_FOUND,
+        owner_id=user.id
+    )])
+
+    # A receiver of a pending transfer should see that the bike has been reported stolen
+    refresh_bike_snapshot(bike)
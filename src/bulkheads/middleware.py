@@ -0,0 +1,87 @@
+import time
+
+import anyio
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src.bulkheads.policies import BULKHEAD_MAX_WAIT_SECONDS, BULKHEAD_RETRY_AFTER_SECONDS, POLICIES, UNLIMITED_PATHS, BulkheadPolicy
+from src.metrics.instruments import bulkhead_in_flight, bulkhead_queue_depth, bulkhead_queue_seconds, bulkhead_rejections_total
+
+
+class Bulkhead:
+
+    def __init__(self, policy: BulkheadPolicy):
+        self.policy = policy
+        self.queued = 0
+        self._limiter: anyio.CapacityLimiter | None = None
+
+    @property
+    def limiter(self) -> anyio.CapacityLimiter:
+        # Can only be created within the event loop
+        if self._limiter is None:
+            self._limiter = anyio.CapacityLimiter(self.policy.concurrency)
+        return self._limiter
+
+
+class BulkheadMiddleware:
+    """
+    Caps the number of requests running at once per route group, see src/bulkheads/policies.py.
+
+    Requests beyond a group's concurrency wait for a free slot. Once max_queue
+    requests are waiting, or a request has waited BULKHEAD_MAX_WAIT_SECONDS, it
+    is turned away with a 503 and a Retry-After header rather than tying up a
+    connection the client would likely give up on anyway.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.bulkheads = [Bulkhead(policy) for policy in POLICIES]
+
+    def _bulkhead(self, scope: Scope) -> Bulkhead | None:
+        if scope['method'] == 'OPTIONS' or UNLIMITED_PATHS.match(scope['path']):
+            return None
+        return next((bulkhead for bulkhead in self.bulkheads if bulkhead.policy.matches(scope['method'], scope['path'])), None)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        bulkhead = self._bulkhead(scope)
+        if bulkhead is None:
+            return await self.app(scope, receive, send)
+
+        group = bulkhead.policy.name
+        limiter = bulkhead.limiter
+        if limiter.available_tokens == 0 and bulkhead.queued >= bulkhead.policy.max_queue:
+            bulkhead_rejections_total.inc(group=group, reason='queue-full')
+            return await self._shed(scope, receive, send)
+
+        borrower = object()
+        started = time.perf_counter()
+        bulkhead.queued += 1
+        bulkhead_queue_depth.inc(group=group)
+        try:
+            with anyio.move_on_after(BULKHEAD_MAX_WAIT_SECONDS):
+                await limiter.acquire_on_behalf_of(borrower)
+        finally:
+            bulkhead.queued -= 1
+            bulkhead_queue_depth.dec(group=group)
+
+        waited = time.perf_counter() - started
+        bulkhead_queue_seconds.observe(waited, group=group)
+        if borrower not in limiter.statistics().borrowers:
+            bulkhead_rejections_total.inc(group=group, reason='timeout')
+            return await self._shed(scope, receive, send)
+
+        bulkhead_in_flight.inc(group=group)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release_on_behalf_of(borrower)
+            bulkhead_in_flight.dec(group=group)
+
+    @staticmethod
+    async def _shed(scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse({'detail': "Too many concurrent requests. Please try again shortly"},
+                                status_code=503, headers={'Retry-After': str(BULKHEAD_RETRY_AFTER_SECONDS)})
+        await response(scope, receive, send)
@@ -0,0 +1,79 @@
+"""
+    Bulkhead policies
+
+    Every request runs in one of the route groups below, and each group can only
+    run so many requests at once. A slow dependency, ex. the SMS gateway or S3,
+    then only holds up its own group instead of every worker thread.
+
+    A group is overridden from the environment with a setting named after it,
+    e.g. BULKHEAD_UPLOADS="4/8" lets 4 uploads run with 8 more waiting.
+"""
+
+import re as regex
+
+from pydantic import BaseModel
+
+from src.settings import config
+
+
+# Threads running sync routes and dependencies. AnyIO's default is 40
+THREADPOOL_SIZE = int(config.get('THREADPOOL_SIZE', 40))
+
+# How long a request may wait for its group before it is turned away
+BULKHEAD_MAX_WAIT_SECONDS = float(config.get('BULKHEAD_MAX_WAIT_SECONDS', 5))
+BULKHEAD_RETRY_AFTER_SECONDS = int(config.get('BULKHEAD_RETRY_AFTER_SECONDS', 1))
+
+# Threads left for everything outside the groups: the idempotency store, background jobs and sync dependencies
+BULKHEAD_RESERVED_THREADS = int(config.get('BULKHEAD_RESERVED_THREADS', max(2, THREADPOOL_SIZE // 10)))
+
+# Not held to a group. Probes and metrics are async so they answer even when every thread is busy
+UNLIMITED_PATHS = regex.compile('^/(health|internal)/')
+
+
+class BulkheadPolicy(BaseModel):
+    name: str
+    concurrency: int                # Requests of the group running at once
+    max_queue: int                  # Requests waiting for a free slot before new ones are turned away
+    methods: set[str] | None = None # Any method when not set
+    path: str = '.*'                # Regex matched against the request path
+
+    def matches(self, method: str, path: str) -> bool:
+        return (self.methods is None or method in self.methods) and regex.match(self.path, path) is not None
+
+
+def _share(fraction: float) -> int:
+    return max(1, int(THREADPOOL_SIZE * fraction))
+
+
+# Matched in order. Each group gets a share of THREADPOOL_SIZE, together 0.9 so BULKHEAD_RESERVED_THREADS are left over
+DEFAULT_POLICIES = [
+    # Logins, registrations and password resets. Hashing has its own executor, see src/auth/hashing.py
+    BulkheadPolicy(name='auth', concurrency=_share(0.2), max_queue=4 * _share(0.2), path='^/auth/'),
+    # Requests that upload to S3 or send SMS'es
+    BulkheadPolicy(name='uploads', concurrency=_share(0.1), max_queue=2 * _share(0.1), methods={'POST'}, path='^/bikes(/discoveries|/import)?$'),
+    # Streams a whole account, holding a thread for as long as it takes
+    BulkheadPolicy(name='exports', concurrency=_share(0.05), max_queue=2 * _share(0.05), methods={'GET'}, path='^/owners/me/export$'),
+    BulkheadPolicy(name='reads', concurrency=_share(0.35), max_queue=4 * _share(0.35), methods={'GET', 'HEAD'}),
+    BulkheadPolicy(name='writes', concurrency=_share(0.2), max_queue=4 * _share(0.2)),
+]
+
+
+def _load_policies() -> list[BulkheadPolicy]:
+    policies = []
+    for policy in DEFAULT_POLICIES:
+        override = config.get(f"BULKHEAD_{policy.name.upper()}")
+        if override:
+            concurrency, max_queue = override.split('/')
+            policy = policy.copy(update={'concurrency': int(concurrency), 'max_queue': int(max_queue)})
+        policies.append(policy)
+
+    # Groups sharing threads would no longer be isolated from each other, or from the work outside them
+    total = sum(policy.concurrency for policy in policies)
+    if total + BULKHEAD_RESERVED_THREADS > THREADPOOL_SIZE:
+        raise ValueError(f"The bulkheads run up to {total} requests at once, which leaves fewer than BULKHEAD_RESERVED_THREADS="
+                         f"{BULKHEAD_RESERVED_THREADS} of THREADPOOL_SIZE={THREADPOOL_SIZE} threads. "
+                         f"Lower the BULKHEAD_<GROUP> overrides or raise THREADPOOL_SIZE")
+    return policies
+
+
+POLICIES = _load_policies()
@@ -1,8 +1,114 @@
 import certifi
-from pymongo import MongoClient
+from pymongo import ASCENDING, GEOSPHERE, IndexModel, MongoClient
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
 from typing import Collection
 
 from src.settings import config
+from src.metrics.mongo import CommandMetricsListener
+
+
+# How long expired sessions are kept around before mongo removes them. Gives a verified
+# password reset session time to be confirmed after the otp has expired
+SESSION_RETENTION_SECONDS = int(config.get('SESSION_RETENTION_SECONDS', 60 * 60))
+
+# How long deletions are kept in the sync change log. Clients that have not synced for longer have to reload
+SYNC_TOMBSTONE_RETENTION_SECONDS = int(config.get('SYNC_TOMBSTONE_RETENTION_DAYS', 30)) * 24 * 60 * 60
+
+# Connections every worker keeps open, so the first requests after a deploy don't pay for TLS handshakes
+MONGO_MIN_POOL_SIZE = int(config.get('MONGO_MIN_POOL_SIZE', 10))
+
+# Indexes that must exist for the application to perform. Created on startup
+INDEXES: dict[str, list[IndexModel]] = {
+    'rate_limits': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    '2fa_sessions': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=SESSION_RETENTION_SECONDS),
+    ],
+    # Login throttling no longer writes access sessions. This drains the ones left behind
+    'access_sessions': [
+        IndexModel([('cooldown_expires_at', ASCENDING)], expireAfterSeconds=SESSION_RETENTION_SECONDS),
+    ],
+    'refresh_token_families': [
+        IndexModel([('owner_id', ASCENDING)]),
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'bikes': [
+        # Lookups and duplicate checks by frame number, claims by claim token
+        IndexModel([('frame_number', ASCENDING)]),
+        IndexModel([('claim_token', ASCENDING)]),
+        IndexModel([('owner', ASCENDING)]),
+        # Stolen bikes near a location. Bikes without a location are left out of the index
+        IndexModel([('stolen_location', GEOSPHERE)]),
+    ],
+    'discoveries': [
+        IndexModel([('location', GEOSPHERE)]),
+    ],
+    'transfers': [
+        IndexModel([('state', ASCENDING), ('created_at', ASCENDING)]),
+        IndexModel([('bike_id', ASCENDING), ('state', ASCENDING)]),
+        # A user's transfers, ex. for activities and exports
+        IndexModel([('sender', ASCENDING), ('created_at', ASCENDING)]),
+        IndexModel([('receiver', ASCENDING), ('created_at', ASCENDING)]),
+    ],
+    # A bike's ownership timeline. See src/bikes/events.py
+    'ownership_events': [
+        IndexModel([('bike_id', ASCENDING), ('ts', ASCENDING), ('_id', ASCENDING)]),
+    ],
+    'sync_changes': [
+        IndexModel([('owner_id', ASCENDING), ('kind', ASCENDING), ('entity_id', ASCENDING)], unique=True),
+        IndexModel([('owner_id', ASCENDING), ('seq', ASCENDING)]),
+        # Tombstones are only kept for a while. See src/sync/changes.py
+        IndexModel([('changed_at', ASCENDING)], expireAfterSeconds=SYNC_TOMBSTONE_RETENTION_SECONDS,
+                   partialFilterExpression={'deleted': True}),
+    ],
+    # Responses of requests made with an Idempotency-Key. See src/idempotency/store.py
+    'idempotency_keys': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'devices': [
+        IndexModel([('owner_id', ASCENDING), ('ip_address', ASCENDING)], unique=True),
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+
+# Read preferences of the read only hot paths. Everything else, and in particular
+# every write path, reads from the primary. A policy is overridden with a setting
+# named after it, ex. READ_PREFERENCE_MY_BIKES=secondaryPreferred
+#
+# Reads from a secondary can lag behind the primary by up to READ_MAX_STALENESS_SECONDS
+# (90 at the least). A user who just claimed a bike could briefly miss it in their list,
+# which is why only the stolen lookup leaves the primary by default
+DEFAULT_READ_PREFERENCES = {
+    'primary': 'primary',
+    'stolen-lookup': 'secondaryPreferred',
+    'my-bikes': 'primary',
+    'activities': 'primary',
+}
+READ_MAX_STALENESS_SECONDS = int(config.get('READ_MAX_STALENESS_SECONDS', 90))
+
+_READ_MODES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+
+def _load_read_preferences() -> dict:
+    preferences = {}
+    for policy, default in DEFAULT_READ_PREFERENCES.items():
+        mode = config.get(f"READ_PREFERENCE_{policy.upper().replace('-', '_')}", default)
+        if mode not in _READ_MODES:
+            raise ValueError(f"Unknown read preference '{mode}' for '{policy}'. Use one of {list(_READ_MODES)}")
+        preferences[policy] = Primary() if mode == 'primary' else _READ_MODES[mode](max_staleness=READ_MAX_STALENESS_SECONDS)
+    return preferences
+
+
+READ_PREFERENCES = _load_read_preferences()
+
 
 class MongoDatabase:
 
@@ -14,8 +120,28 @@ class MongoDatabase:
 
         # Setting the client connection as a class variable makes all subsequent instanciations
         # of the MongoDatabase class able to see connection
-        __class__.connection = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where(), uuidRepresentation='standard', tz_aware=True)
+        # Atlas requires TLS. A local mongod, ex. for load tests, usually runs without it
+        tls_options = {'tlsCAFile': certifi.where()} if config.get('MONGO_TLS', 'YES') == 'YES' else {}
+        __class__.connection = MongoClient(config["ATLAS_URI"], uuidRepresentation='standard', tz_aware=True,
+                                           minPoolSize=MONGO_MIN_POOL_SIZE, event_listeners=[CommandMetricsListener()], **tls_options)
         __class__.collections = __class__.connection[config["DB_NAME"]]
+        __class__._read_collections = {}
+
+    def read_collection(self, name: str, policy: str) -> Collection:
+        """
+        Returns the collection with the read preference of the given policy, see READ_PREFERENCES.
+        Only use it for queries of routes that never write what they read
+        """
+        key = (name, policy)
+        if key not in __class__._read_collections:
+            __class__._read_collections[key] = __class__.collections[name].with_options(read_preference=READ_PREFERENCES[policy])
+        return __class__._read_collections[key]
+
+
+    def ensure_indexes(self):
+        """Creates the indexes listed in INDEXES. Existing indexes are left untouched"""
+        for collection_name, indexes in INDEXES.items():
+            __class__.collections[collection_name].create_indexes(indexes)
 
 
     def disconnect(self):
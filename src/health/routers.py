@@ -0,0 +1,24 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+
+from src.health.warmup import readiness
+
+
+router = APIRouter(
+    tags=['internal'],
+    prefix='/health'
+)
+
+
+@router.get('/live', include_in_schema=False)
+async def get_liveness():
+    """ The worker is up and serving requests """
+    return {'status': 'alive'}
+
+
+@router.get('/ready', include_in_schema=False)
+async def get_readiness():
+    """ The worker has warmed up and can take traffic. Load balancers should only route to ready workers """
+    if not readiness.ready.is_set():
+        return JSONResponse({'status': 'warming-up', 'warm_up': readiness.report}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {'status': 'ready', 'warm_up': readiness.report}
@@ -0,0 +1,97 @@
+"""
+    Worker warm-up
+
+    Opens the connections and starts the pools a worker needs, before it takes
+    traffic, so the first requests after a deploy are not the ones paying for
+    TLS handshakes, credential lookups and process spawning. The readiness
+    probe reports the worker ready once warm-up has finished.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src.auth.hashing import password_hasher
+from src.database import MONGO_MIN_POOL_SIZE, MongoDatabase
+from src.notifications import sms
+from src.settings import config
+from src.storage.aws import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_TIMEOUT_SECONDS = float(config.get('WARM_UP_TIMEOUT_SECONDS', 10))
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.report: dict[str, dict] = {}
+
+
+readiness = Readiness()
+
+
+def _warm_mongo_pool():
+    db = MongoDatabase()
+    db.connection.admin.command('ping')
+
+    # Concurrent pings each need a connection of their own, which fills the pool up to minPoolSize
+    pool_size = max(MONGO_MIN_POOL_SIZE, 1)
+    barrier = threading.Barrier(pool_size)
+
+    def ping():
+        barrier.wait(timeout=10)
+        db.connection.admin.command('ping')
+
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        for future in [executor.submit(ping) for _ in range(pool_size)]:
+            future.result()
+
+    # Connects to the members the read only hot paths read from and caches their collections
+    db.read_collection('bikes', 'stolen-lookup').find_one({'frame_number': ''}, projection={'_id': 1})
+
+
+def _warm_s3():
+    get_s3_client().head_bucket(Bucket=config['AWS_BUCKET_NAME'])
+
+
+WARM_UP_STEPS = {
+    'mongo': _warm_mongo_pool,
+    's3': _warm_s3,
+    'sms': sms.connect,
+    'password-hashing': password_hasher.warm_up,
+}
+
+
+def _run_step(name: str, step) -> dict:
+    started = time.perf_counter()
+    try:
+        step()
+        error = None
+    except Exception as e:
+        logger.warning(f"Warm-up of {name} failed: {e!r}")
+        error = repr(e)
+    return {'seconds': round(time.perf_counter() - started, 3), 'error': error}
+
+
+def warm_up():
+    """
+    Runs the warm-up steps side by side and marks the worker ready. A failing step
+    is logged and reported by the readiness probe, but does not keep the worker from
+    serving, the dependency is then connected on first use like before. Neither does
+    a step that takes longer than WARM_UP_TIMEOUT_SECONDS, it is left to finish in the background
+    """
+    executor = ThreadPoolExecutor(max_workers=len(WARM_UP_STEPS), thread_name_prefix='warm-up')
+    futures = {name: executor.submit(_run_step, name, step) for name, step in WARM_UP_STEPS.items()}
+    wait(futures.values(), timeout=WARM_UP_TIMEOUT_SECONDS)
+    executor.shutdown(wait=False)
+
+    for name, future in futures.items():
+        if future.done():
+            readiness.report[name] = future.result()
+        else:
+            logger.warning(f"Warm-up of {name} did not finish within {WARM_UP_TIMEOUT_SECONDS} seconds")
+            readiness.report[name] = {'seconds': WARM_UP_TIMEOUT_SECONDS, 'error': 'timed out'}
+
+    readiness.ready.set()
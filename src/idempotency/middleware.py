@@ -0,0 +1,171 @@
+import hashlib
+
+import anyio
+from fastapi_jwt_auth import AuthJWT
+from fastapi_jwt_auth.exceptions import AuthJWTException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.idempotency import store
+from src.settings import config
+
+
+IDEMPOTENT_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+MAX_KEY_LENGTH = 255
+
+# Larger responses are not stored. A retry of such a request runs again
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(config.get('IDEMPOTENCY_MAX_RESPONSE_BYTES', 1024 * 1024))
+
+# Not the outcome of running the request, so a retry should run it
+_UNSTORED_STATUS_CODES = {429}
+
+
+def _caller(scope: Scope, headers: Headers) -> str:
+    """
+    Keys are scoped per caller. By owner, so a retry after refreshing the access token
+    is still recognized, or else by ip address. Tokens that do not verify are scoped to
+    themselves, the request is rejected when it runs anyway
+    """
+    authorization = headers.get('authorization')
+    if authorization:
+        scheme, _, token = authorization.partition(' ')
+        if scheme.lower() == 'bearer' and token:
+            try:
+                subject = AuthJWT().get_raw_jwt(token).get('sub')
+            except (AuthJWTException, RuntimeError):
+                subject = None
+            if subject:
+                return f"owner:{subject}"
+        return 'token:' + hashlib.sha256(authorization.encode()).hexdigest()
+    client = scope.get('client')
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def _fingerprint(scope: Scope, headers: Headers, body: bytes) -> str:
+    digest = hashlib.sha256()
+    digest.update(scope['method'].encode())
+    digest.update(scope['path'].encode())
+    digest.update(scope.get('query_string', b''))
+
+    # Clients may pick a new multipart boundary when they retry, the parts are what matters
+    content_type = headers.get('content-type', '')
+    if content_type.startswith('multipart/'):
+        boundary = content_type.partition('boundary=')[2].split(';')[0].strip('"')
+        if boundary:
+            body = body.replace(boundary.encode('latin-1'), b'')
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyMiddleware:
+    """
+    Makes retries of side effecting requests safe.
+
+    A POST, PUT, PATCH or DELETE request carrying an 'Idempotency-Key' header
+    runs once. Its response is stored for IDEMPOTENCY_TTL_HOURS, and a retry
+    with the same key is answered with it, marked by 'Idempotent-Replayed: true',
+    without running the request again. No files are uploaded, no SMS'es are sent
+    and no documents are written or read besides the stored response.
+
+    A retry that arrives while the first request is still running gets a 409.
+    Reusing a key for a different request gets a 422. Server errors and rate
+    limited responses are not stored, so the request can be retried.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] not in IDEMPOTENT_METHODS:
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get('idempotency-key')
+        if idempotency_key is None:
+            return await self.app(scope, receive, send)
+
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            response = JSONResponse({'detail': f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}, status_code=400)
+            return await response(scope, receive, send)
+
+        # The whole body is needed for the fingerprint before the request runs
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body = b''.join(chunks)
+
+        key = f"{_caller(scope, headers)}:{idempotency_key}"
+        fingerprint = _fingerprint(scope, headers, body)
+        claim = await anyio.to_thread.run_sync(store.claim, key, fingerprint)
+
+        if not claim.claimed:
+            if claim.fingerprint != fingerprint:
+                response = JSONResponse({'detail': "Idempotency-Key was used for a different request"}, status_code=422)
+            elif claim.response is None:
+                response = JSONResponse({'detail': "A request with this Idempotency-Key is in progress"},
+                                        status_code=409, headers={'Retry-After': '1'})
+            else:
+                return await self._replay(claim.response, send)
+            return await response(scope, receive, send)
+
+        body_sent = False
+
+        async def receive_wrapper() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+
+        status_code = 500
+        response_headers = []
+        response_body = []
+        response_size = 0
+        finished = False
+
+        async def finish():
+            nonlocal finished
+            finished = True
+            if status_code >= 500 or status_code in _UNSTORED_STATUS_CODES or response_size > IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                await anyio.to_thread.run_sync(store.release, key)
+            else:
+                stored = store.StoredResponse(status=status_code, headers=list(response_headers), body=b''.join(response_body))
+                await anyio.to_thread.run_sync(store.complete, key, stored)
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, response_headers, response_size
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                response_headers = message.get('headers', [])
+            elif message['type'] == 'http.response.body':
+                response_size += len(message.get('body', b''))
+                if response_size <= IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                    response_body.append(message.get('body', b''))
+
+                # Stored before the client sees the response, and before any background tasks run
+                if not message.get('more_body', False):
+                    await finish()
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if not finished:
+                # Failed before a full response was sent
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(store.release, key)
+
+    @staticmethod
+    async def _replay(response: store.StoredResponse, send: Send):
+        await send({
+            'type': 'http.response.start',
+            'status': response.status,
+            'headers': response.headers + [(b'idempotent-replayed', b'true')],
+        })
+        await send({'type': 'http.response.body', 'body': response.body})
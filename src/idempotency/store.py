@@ -0,0 +1,103 @@
+"""
+    Idempotency key store
+
+    Keeps one document per idempotency key in 'idempotency_keys'. A request
+    claims its key before it runs and stores its response once it is done, so
+    a retry with the same key can be answered from the store. Keys expire after
+    IDEMPOTENCY_TTL_HOURS and are then removed by a TTL index.
+"""
+
+import datetime
+from enum import Enum
+from typing import NamedTuple
+
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+from src.database import MongoDatabase
+from src.settings import config
+
+
+COLLECTION_NAME = 'idempotency_keys'
+IDEMPOTENCY_TTL = datetime.timedelta(hours=int(config.get('IDEMPOTENCY_TTL_HOURS', 24)))
+
+# A claimed key whose request has not finished within this time is taken to be
+# abandoned, ex. by a worker that was killed, and can be claimed again
+IDEMPOTENCY_LOCK_TIMEOUT = datetime.timedelta(seconds=int(config.get('IDEMPOTENCY_LOCK_TIMEOUT_SECONDS', 60)))
+
+
+class KeyState(str, Enum):
+    IN_PROGRESS = "in_progress",
+    COMPLETED = "completed"
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+
+class Claim(NamedTuple):
+    claimed: bool                           # The key is ours and the request should run
+    fingerprint: str | None = None          # Of the request that holds the key, when not claimed
+    response: StoredResponse | None = None  # Set once that request has completed
+
+
+def claim(key: str, fingerprint: str) -> Claim:
+    """
+    Claims the key for a request with the given fingerprint. Either inserts the key,
+    takes over an expired or abandoned one, or returns the state of the existing one
+    """
+    collection = MongoDatabase().collections[COLLECTION_NAME]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        collection.update_one(
+            {'_id': key, '$or': [
+                {'expires_at': {'$lt': now}},
+                {'state': KeyState.IN_PROGRESS, 'locked_until': {'$lt': now}},
+            ]},
+            {'$set': {
+                'fingerprint': fingerprint,
+                'state': KeyState.IN_PROGRESS,
+                'locked_until': now + IDEMPOTENCY_LOCK_TIMEOUT,
+                'expires_at': now + IDEMPOTENCY_TTL,
+            }, '$unset': {'response': ''}},
+            upsert=True
+        )
+        return Claim(claimed=True)
+    except DuplicateKeyError:
+        pass
+
+    doc = collection.find_one({'_id': key})
+    if doc is None:
+        # Released in the meantime
+        return claim(key, fingerprint)
+
+    response = None
+    if doc['state'] == KeyState.COMPLETED:
+        stored = doc['response']
+        response = StoredResponse(
+            status=stored['status'],
+            headers=[(bytes(name), bytes(value)) for name, value in stored['headers']],
+            body=bytes(stored['body'])
+        )
+    return Claim(claimed=False, fingerprint=doc['fingerprint'], response=response)
+
+
+def complete(key: str, response: StoredResponse):
+    MongoDatabase().collections[COLLECTION_NAME].update_one(
+        {'_id': key, 'state': KeyState.IN_PROGRESS},
+        {'$set': {
+            'state': KeyState.COMPLETED,
+            'response': {
+                'status': response.status,
+                'headers': [[Binary(name), Binary(value)] for name, value in response.headers],
+                'body': Binary(response.body),
+            }
+        }}
+    )
+
+
+def release(key: str):
+    """ Gives up a claimed key, so the request can be retried """
+    MongoDatabase().collections[COLLECTION_NAME].delete_one({'_id': key, 'state': KeyState.IN_PROGRESS})
@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+import logging
+import os
+import random
+import socket
+from typing import Callable
+
+import anyio
+from pymongo.errors import DuplicateKeyError
+
+from src.database import MongoDatabase
+from src.settings import config
+
+logger = logging.getLogger(__name__)
+
+JOBS_ENABLED = config.get('JOBS_ENABLED', 'YES') != 'NO'
+
+
+def acquire_lease(name: str, duration: datetime.timedelta) -> bool:
+    """
+    Takes a lease on the named job in the 'job_leases' collection. Only one worker can
+    hold a lease at a time, which keeps several workers from running the same job at once
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        # Either takes over an expired lease or inserts a new one
+        MongoDatabase().collections['job_leases'].update_one(
+            {'_id': name, 'locked_until': {'$lt': now}},
+            {'$set': {'locked_until': now + duration, 'holder': f"{socket.gethostname()}:{os.getpid()}"}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lease exists and is still held by another worker
+        return False
+    return True
+
+
+class PeriodicJob:
+    """
+    Runs a blocking function every `interval` seconds on a worker thread, for as
+    long as the application runs. Errors are logged and the job keeps running.
+    """
+
+    def __init__(self, name: str, interval: int, fn: Callable[[], object], leased: bool = True):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.leased = leased
+        self._task: asyncio.Task | None = None
+
+    async def _loop(self):
+        # Spread the first run so that workers started together don't all race for the lease
+        await asyncio.sleep(random.uniform(0, min(self.interval, 30)))
+        while True:
+            try:
+                if not self.leased or await anyio.to_thread.run_sync(
+                        acquire_lease, self.name, datetime.timedelta(seconds=self.interval)):
+                    result = await anyio.to_thread.run_sync(self.fn)
+                    logger.info(f"[{datetime.datetime.now(datetime.timezone.utc)}] Job '{self.name}' finished: {result}")
+            except Exception:
+                logger.exception(f"Job '{self.name}' failed")
+
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name=f"job:{self.name}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -1,21 +1,80 @@
+import anyio
 from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
 from src.database import MongoDatabase
 from src.routers import main_router
+from src.auth.hashing import password_hasher
+from src.health.warmup import readiness, warm_up
+from src.jobs import JOBS_ENABLED, PeriodicJob
+from src.transfers.sweeper import SWEEP_INTERVAL_SECONDS, expire_pending_transfers
+from src.activities.counters import RECONCILE_INTERVAL_SECONDS, reconcile
+from src.storage.gc import STORAGE_GC_INTERVAL_SECONDS, collect_orphaned_uploads
+from src.metrics.middleware import MetricsMiddleware
+from src.profiling.middleware import ProfilingMiddleware
+from src.idempotency.middleware import IdempotencyMiddleware
+from src.bulkheads.middleware import BulkheadMiddleware
+from src.bulkheads.policies import THREADPOOL_SIZE
 
-from src.settings import app
+from src.settings import app, origin_regex, origins
+
+# Background jobs running inside every worker. Leases make sure only one worker runs a job at a time
+jobs = [
+    PeriodicJob('expire-pending-transfers', interval=SWEEP_INTERVAL_SECONDS, fn=expire_pending_transfers),
+    PeriodicJob('reconcile-activity-counters', interval=RECONCILE_INTERVAL_SECONDS, fn=reconcile),
+    PeriodicJob('collect-orphaned-uploads', interval=STORAGE_GC_INTERVAL_SECONDS, fn=collect_orphaned_uploads),
+]
+
+@app.on_event("startup")
+async def configure_threadpool():
+    # The limiter belongs to the event loop, so it can only be sized once the loop runs
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
 
 @app.on_event("startup")
 def startup_db_client():
     mongo_db = MongoDatabase()
     mongo_db.connect()
+    mongo_db.ensure_indexes()
 
     # By setting the client on the app its possible to get the connection
     # from any request inside routers
     app.mongodb_client = mongo_db.connection
     app.collections = mongo_db.collections
 
+    # Ready once the connections and pools are open
+    warm_up()
+
+@app.on_event("startup")
+async def start_background_jobs():
+    if JOBS_ENABLED:
+        for job in jobs:
+            job.start()
+
+@app.on_event("shutdown")
+def stop_taking_traffic():
+    readiness.ready.clear()
+
+@app.on_event("shutdown")
+async def stop_background_jobs():
+    for job in jobs:
+        job.stop()
+
 @app.on_event("shutdown")
 def shutdown_db_client():
     app.mongodb_client.close()
+    password_hasher.shutdown()
 
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(BulkheadMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+# Added last so it is the outermost, and the responses of the middlewares above carry CORS headers too
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_origin_regex=origin_regex,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After", "Idempotent-Replayed", "X-Profile-Id"],
+)
 app.include_router(main_router)
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+    The metrics recorded by the application. Kept in one place so that
+    the names and labels are easy to find when building dashboards.
+"""
+
+from src.metrics.registry import registry
+
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# HTTP
+http_requests_total = registry.counter(
+    'http_requests_total', "Handled HTTP requests", labels=('method', 'route', 'status'))
+http_request_duration_seconds = registry.histogram(
+    'http_request_duration_seconds', "Time spent handling HTTP requests", labels=('method', 'route'))
+http_requests_in_progress = registry.gauge(
+    'http_requests_in_progress', "HTTP requests currently being handled")
+
+# Worker threads running sync routes and dependencies
+threadpool_threads_total = registry.gauge(
+    'threadpool_threads_total', "Size of the worker thread pool")
+threadpool_threads_busy = registry.gauge(
+    'threadpool_threads_busy', "Worker threads currently in use")
+
+# MongoDB
+mongo_command_duration_seconds = registry.histogram(
+    'mongo_command_duration_seconds', "Time spent on MongoDB commands", labels=('command',), buckets=FAST_BUCKETS)
+mongo_command_failures_total = registry.counter(
+    'mongo_command_failures_total', "Failed MongoDB commands", labels=('command',))
+
+# External services
+s3_upload_duration_seconds = registry.histogram(
+    's3_upload_duration_seconds', "Time spent uploading files to S3")
+s3_upload_failures_total = registry.counter(
+    's3_upload_failures_total', "Failed uploads to S3")
+s3_orphans_deleted_total = registry.counter(
+    's3_orphans_deleted_total', "Uploads deleted from S3 because nothing referenced them")
+s3_orphan_bytes_reclaimed_total = registry.counter(
+    's3_orphan_bytes_reclaimed_total', "Bytes freed in S3 by deleting unreferenced uploads")
+sms_send_duration_seconds = registry.histogram(
+    'sms_send_duration_seconds', "Time spent sending SMS'es")
+sms_send_failures_total = registry.counter(
+    'sms_send_failures_total', "SMS'es the gateway did not accept")
+
+# Password hashing executor
+password_hashing_in_flight = registry.gauge(
+    'password_hashing_in_flight', "Password hashes currently being computed")
+password_hashing_queue_depth = registry.gauge(
+    'password_hashing_queue_depth', "Password hashes waiting for a free worker")
+password_hashing_rejected_total = registry.counter(
+    'password_hashing_rejected_total', "Password hashes rejected because the queue was full")
+
+# Bulkheads, see src/bulkheads/policies.py
+bulkhead_in_flight = registry.gauge(
+    'bulkhead_in_flight', "Requests running per route group", labels=('group',))
+bulkhead_queue_depth = registry.gauge(
+    'bulkhead_queue_depth', "Requests waiting for a free slot per route group", labels=('group',))
+bulkhead_queue_seconds = registry.histogram(
+    'bulkhead_queue_seconds', "Time requests waited for a free slot in their route group", labels=('group',), buckets=FAST_BUCKETS + (2.5, 5.0))
+bulkhead_rejections_total = registry.counter(
+    'bulkhead_rejections_total', "Requests turned away because their route group was full", labels=('group', 'reason'))
+
+# Rate limiting
+rate_limit_rejections_total = registry.counter(
+    'rate_limit_rejections_total', "Requests rejected by a rate limit policy", labels=('policy',))
@@ -0,0 +1,42 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.metrics.instruments import http_request_duration_seconds, http_requests_in_progress, http_requests_total
+
+
+class MetricsMiddleware:
+    """
+    Records the count and latency of every HTTP request per route.
+
+    Requests are labelled with the route template, ex. '/transfers/{transfer_id}/accept',
+    rather than the actual path, which keeps the number of label values bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        http_requests_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_progress.dec()
+
+            # The router sets the matched route on the scope
+            route = scope.get('route')
+            route = getattr(route, 'path', 'unmatched')
+            http_requests_total.inc(method=scope['method'], route=route, status=status_code)
+            http_request_duration_seconds.observe(time.perf_counter() - started, method=scope['method'], route=route)
@@ -0,0 +1,17 @@
+from pymongo import monitoring
+
+from src.metrics.instruments import mongo_command_duration_seconds, mongo_command_failures_total
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """ Records the duration of every command sent to MongoDB """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration_seconds.observe(event.duration_micros / 1_000_000, command=event.command_name)
+
+    def failed(self, event):
+        mongo_command_duration_seconds.observe(event.duration_micros / 1_000_000, command=event.command_name)
+        mongo_command_failures_total.inc(command=event.command_name)
@@ -0,0 +1,41 @@
+import hmac
+
+import anyio
+from fastapi import APIRouter, HTTPException, Request, Response, status
+
+from src.settings import config
+from src.auth.hashing import password_hasher
+from src.metrics.registry import registry
+from src.metrics.instruments import *
+
+
+METRICS_TOKEN = config.get('METRICS_TOKEN')
+
+router = APIRouter(
+    tags=['internal'],
+    prefix='/internal'
+)
+
+
+def collect_password_hashing():
+    stats = password_hasher.stats()
+    password_hashing_in_flight.set(stats['in_flight'])
+    password_hashing_queue_depth.set(stats['queue_depth'])
+
+registry.add_collector(collect_password_hashing)
+
+
+@router.get('/metrics', include_in_schema=False)
+async def get_metrics(request: Request):
+    # Off unless a token is configured, which the scraper has to present as a bearer token
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not allowed to read metrics")
+
+    # The thread limiter can only be read from within the event loop
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    threadpool_threads_total.set(limiter.total_tokens)
+    threadpool_threads_busy.set(limiter.borrowed_tokens)
+
+    return Response(content=registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -31,4 +31,33 @@ class Entity(BaseModel):
         db.collections[self._COLLECTION_NAME].update_one({'_id' : self.id}, {'$set' : self.dict()}, upsert=True)
 
         doc = db.collections[self._COLLECTION_NAME].find_one({'_id' : self.id})
-        return self.__class__(**doc)
\ No newline at end of file
+        return self.__class__(**doc)
+
+    def insert(self) -> Self:
+        """
+        Insert the model as a new document in mongodb. Unlike save this is a single
+        round trip, so use it for entities that are known not to exist yet
+
+        :returns the instance itself
+        """
+        db = MongoDatabase()
+
+        if self._COLLECTION_NAME is None:
+            raise NotImplementedError(f"model '{self.__class__.__name__}' is missing a collection name. *Hint set the COLLECTION_NAME attribute on the model")
+
+        # Same document shape as save produces
+        db.collections[self._COLLECTION_NAME].insert_one({'_id': self.id, **self.dict()})
+        return self
+
+    @classmethod
+    def find_one(cls, filter: dict, read_policy: str = 'primary') -> Self | None:
+        """
+        Finds a single entity. Read only routes can pass a read policy to read from a
+        secondary, see READ_PREFERENCES in src/database.py
+        """
+        collection_name = cls.__private_attributes__['_COLLECTION_NAME'].default
+        if collection_name is None:
+            raise NotImplementedError(f"model '{cls.__name__}' is missing a collection name. *Hint set the COLLECTION_NAME attribute on the model")
+
+        doc = MongoDatabase().read_collection(collection_name, read_policy).find_one(filter)
+        return cls(**doc) if doc else None
@@ -1,14 +1,45 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from src.settings import config
+from src.metrics.instruments import sms_send_duration_seconds, sms_send_failures_total
+
+SMS_BATCH_CONCURRENCY = int(config.get('SMS_BATCH_CONCURRENCY', 4))
+
+_sessions: dict[int, requests.Session] = {}
+
+
+def _session() -> requests.Session:
+    """ Keeps the connection to the gateway open between messages. One session per server worker """
+    pid = os.getpid()
+    if pid not in _sessions:
+        _sessions.clear()
+        _sessions[pid] = requests.Session()
+    return _sessions[pid]
+
+
+def _api_url() -> str:
+    # SMS_API_URL points the messages to another gateway, ex. the fake one used by the load tests
+    return config.get('SMS_API_URL') or f"https://api.twilio.com/2010-04-01/Accounts/{config['TWILLIO_ACCOUNT_SID']}/Messages.json"
+
+
+def connect():
+    """ Opens the connection to the gateway ahead of the first message """
+    if config['SMS_ENABLED'] == 'NO':
+        return
+    _session().head(_api_url(), timeout=5)
+
 
 def send_sms(msg: str, to: str):
     
     if config['SMS_ENABLED'] == 'NO':
         return False
     
-    API_URL = f"https://api.twilio.com/2010-04-01/Accounts/{config['TWILLIO_ACCOUNT_SID']}/Messages.json"
+    API_URL = _api_url()
 
-    response = requests.post(
+    started = time.perf_counter()
+    response = _session().post(
         API_URL, 
         data={
             "Body" : msg,
@@ -18,5 +49,28 @@ def send_sms(msg: str, to: str):
         auth=(config['TWILLIO_ACCOUNT_SID'], config['TWILLIO_AUTH_TOKEN'])
     )
 
+    sms_send_duration_seconds.observe(time.perf_counter() - started)
+
     # Error and success handling
-    return response.ok
\ No newline at end of file
+    if not response.ok:
+        sms_send_failures_total.inc()
+    return response.ok
+
+
+def send_sms_batch(messages: list[tuple[str, str]]) -> int:
+    """
+    Sends many (msg, to) messages over a few connections at a time. Messages
+    to the same recipient are sent one after the other, in the given order.
+    Meant to run as a background task after the response has been sent
+
+    :returns the number of messages the gateway accepted
+    """
+    by_recipient: dict[str, list[str]] = {}
+    for msg, to in messages:
+        by_recipient.setdefault(to, []).append(msg)
+
+    def send_all(to: str) -> int:
+        return sum(bool(send_sms(msg=msg, to=to)) for msg in by_recipient[to])
+
+    with ThreadPoolExecutor(max_workers=SMS_BATCH_CONCURRENCY, thread_name_prefix='sms') as pool:
+        return sum(pool.map(send_all, by_recipient))
@@ -0,0 +1,121 @@
+"""
+    Export of an owner's bikes and transfer history
+
+    Rows are produced straight from MongoDB cursors and written out a batch
+    at a time, so an export never holds more than one batch in memory no
+    matter how many bikes and transfers the owner has.
+"""
+
+import csv
+import datetime
+import io
+import json
+import uuid
+from enum import Enum
+from typing import Iterator
+
+from pymongo.database import Database
+
+from src.settings import config
+
+
+EXPORT_BATCH_SIZE = int(config.get('EXPORT_BATCH_SIZE', 500))
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson",
+    CSV = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: 'application/x-ndjson',
+    ExportFormat.CSV: 'text/csv',
+}
+
+# Columns of the CSV export. Bikes and transfers share one header, and each row fills in the columns it has
+COLUMNS = (
+    'record', 'id', 'frame_number', 'brand', 'kind', 'color', 'gender', 'is_electric', 'reported_stolen',
+    'state', 'direction', 'counterpart_phone_number', 'created_at', 'claimed_date', 'stolen_date', 'closed_at',
+)
+
+BIKE_PROJECTION = {
+    'frame_number': 1, 'brand': 1, 'kind': 1, 'color': 1, 'gender': 1, 'is_electric': 1,
+    'reported_stolen': 1, 'state': 1, 'created_at': 1, 'claimed_date': 1, 'stolen_date': 1,
+}
+
+TRANSFER_PROJECTION = {
+    'sender': 1, 'state': 1, 'created_at': 1, 'closed_at': 1, 'bike_snapshot.frame_number': 1,
+    'sender_snapshot.phone_number': 1, 'receiver_snapshot.phone_number': 1,
+}
+
+
+def _bike_row(doc: dict) -> dict:
+    return {'record': 'bike', 'id': doc.pop('_id'), **doc}
+
+
+def _transfer_row(doc: dict, owner_id: uuid.UUID) -> dict:
+    outgoing = doc['sender'] == owner_id
+    # Transfers made before snapshots were added have no frame or phone numbers until backfilled
+    counterpart = doc.get('receiver_snapshot' if outgoing else 'sender_snapshot') or {}
+    return {
+        'record': 'transfer',
+        'id': doc['_id'],
+        'frame_number': (doc.get('bike_snapshot') or {}).get('frame_number'),
+        'state': doc['state'],
+        'direction': 'outgoing' if outgoing else 'incoming',
+        'counterpart_phone_number': counterpart.get('phone_number'),
+        'created_at': doc.get('created_at'),
+        'closed_at': doc.get('closed_at'),
+    }
+
+
+def export_rows(collections: Database, owner_id: uuid.UUID) -> Iterator[dict]:
+    """ All bikes of the owner followed by every transfer the owner took part in, oldest first """
+    bikes = collections['bikes'].find({'owner': owner_id}, projection=BIKE_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
+    for doc in bikes:
+        yield _bike_row(doc)
+
+    transfers = collections['transfers'].find(
+        {'$or': [{'sender': owner_id}, {'receiver': owner_id}]},
+        projection=TRANSFER_PROJECTION,
+        batch_size=EXPORT_BATCH_SIZE
+    ).sort('created_at', 1)
+    for doc in transfers:
+        yield _transfer_row(doc, owner_id)
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def _ndjson_line(row: dict) -> str:
+    return json.dumps({key: _plain(value) for key, value in row.items()}) + '\n'
+
+
+def _csv_line(row: dict) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(['' if row.get(column) is None else _plain(row.get(column)) for column in COLUMNS])
+    return buffer.getvalue()
+
+
+def stream_export(rows: Iterator[dict], format: ExportFormat) -> Iterator[str]:
+    """ Encodes the rows and yields them a batch at a time to keep the number of writes down """
+    batch = []
+    if format == ExportFormat.CSV:
+        batch.append(_csv_line(dict(zip(COLUMNS, COLUMNS))))
+
+    encode = _csv_line if format == ExportFormat.CSV else _ndjson_line
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield ''.join(batch)
+            batch = []
+
+    if batch:
+        yield ''.join(batch)
@@ -2,7 +2,6 @@ import datetime
 from pydantic import Field, PrivateAttr
 
 from src.models import Entity
-from src.auth.models import DeviceList
 
 
 class BikeOwner(Entity):
@@ -11,5 +10,4 @@ class BikeOwner(Entity):
     
     phone_number: str   # TODO: Maybe hash this at some point to avoid possible leakage
     hash: bytes
-    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
-    devices: DeviceList = DeviceList()
\ No newline at end of file
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
\ No newline at end of file
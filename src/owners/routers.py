@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, Request, HTTPException, status
+from fastapi.responses import StreamingResponse
 from jose import JOSEError
 
+from src.owners.export import MEDIA_TYPES, ExportFormat, export_rows, stream_export
 from src.owners.models import BikeOwner
 from src.auth.dependencies import authenticated_request
+from src.ratelimit.dependencies import enforce
 
 router = APIRouter(
     tags=['owners'],
@@ -26,4 +29,19 @@ def get_transfer(
     except JOSEError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail=str(e))
\ No newline at end of file
+            detail=str(e))
+
+
+@router.get('/me/export', summary="Export all of a user's bikes and transfers", status_code=status.HTTP_200_OK, response_class=StreamingResponse)
+def export_owner_data(request: Request, format: ExportFormat = ExportFormat.NDJSON, user: BikeOwner = Depends(authenticated_request)):
+    """
+    Streams one row per bike followed by one row per transfer, as NDJSON or CSV.
+    The rows are read from the database while the response is being sent
+    """
+    enforce('export', str(user.id))
+
+    return StreamingResponse(
+        stream_export(export_rows(request.app.collections, user.id), format),
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="mybike-export.{format.value}"'}
+    )
@@ -0,0 +1,115 @@
+import hmac
+import os
+import time
+
+import anyio
+import sentry_sdk
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.profiling.sampler import StackSampler, profile_file_name, prune_profiles
+from src.settings import config, trace_sampler
+
+
+PROFILING_TOKEN = config.get('PROFILING_TOKEN')
+PROFILE_OUTPUT_DIR = config.get('PROFILE_OUTPUT_DIR', 'profiles')
+PROFILE_INTERVAL_SECONDS = float(config.get('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_MAX_FILES = int(config.get('PROFILE_MAX_FILES', 200))     # Older profiles are deleted
+
+# At most one report per route and kind (slow or failed) in this interval. During an incident
+# every request would otherwise become a sentry event. Sentry tracks the exceptions themselves
+SLOW_REQUEST_REPORT_INTERVAL_SECONDS = float(config.get('SLOW_REQUEST_REPORT_INTERVAL_SECONDS', 60))
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests on demand and reports slow or failing requests.
+
+    A request is profiled when it carries 'X-Profile: <PROFILING_TOKEN>' or when
+    the trace sampler picks it (PROFILE_SAMPLE_RATE). The profile is written to
+    PROFILE_OUTPUT_DIR in folded stack format and its file name is returned in
+    the 'X-Profile-Id' header.
+
+    Requests slower than SLOW_REQUEST_SECONDS or answered with a 5xx are sent
+    to sentry, even when their transaction was not sampled, but at most once per
+    route every SLOW_REQUEST_REPORT_INTERVAL_SECONDS. The report tells how many
+    were left out since the last one.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._reported: dict[tuple[str, str, str], tuple[float, int]] = {}   # (method, route, kind) -> (last report, suppressed since)
+
+    def _requested(self, scope: Scope) -> bool:
+        token = Headers(scope=scope).get('x-profile')
+        if token and PROFILING_TOKEN and hmac.compare_digest(token, PROFILING_TOKEN):
+            return True
+        return trace_sampler.should_profile()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        sampler = None
+        file_name = None
+        if self._requested(scope):
+            sampler = StackSampler(interval=PROFILE_INTERVAL_SECONDS)
+            sampler.start()
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code, file_name
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if sampler is not None:
+                    # The route is known once the router has run, which is before the response starts
+                    route = getattr(scope.get('route'), 'path', 'unmatched')
+                    file_name = profile_file_name(scope['method'], route)
+                    MutableHeaders(scope=message).append('X-Profile-Id', file_name)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+
+            if sampler is not None:
+                sampler.stop()
+                if file_name is not None:
+                    await anyio.to_thread.run_sync(self._write_profile, sampler, file_name)
+
+            if duration > trace_sampler.slow_request_seconds or status_code >= 500:
+                self._report(scope, status_code, duration, file_name)
+
+    @staticmethod
+    def _write_profile(sampler: StackSampler, file_name: str):
+        sampler.write(os.path.join(PROFILE_OUTPUT_DIR, file_name))
+        prune_profiles(PROFILE_OUTPUT_DIR, PROFILE_MAX_FILES)
+
+    def _should_report(self, key: tuple[str, str, str]) -> int | None:
+        """ Returns the number of reports left out since the last one, or None when this one should be left out too """
+        now = time.monotonic()
+        last_reported, suppressed = self._reported.get(key, (None, 0))
+        if last_reported is not None and now - last_reported < SLOW_REQUEST_REPORT_INTERVAL_SECONDS:
+            self._reported[key] = (last_reported, suppressed + 1)
+            return None
+        self._reported[key] = (now, 0)
+        return suppressed
+
+    def _report(self, scope: Scope, status_code: int, duration: float, file_name: str | None):
+        route = getattr(scope.get('route'), 'path', 'unmatched')
+        suppressed = self._should_report((scope['method'], route, 'failed' if status_code >= 500 else 'slow'))
+        if suppressed is None:
+            return
+
+        with sentry_sdk.push_scope() as sentry_scope:
+            sentry_scope.set_extra('suppressed_since_last_report', suppressed)
+            sentry_scope.set_tag('route', route)
+            sentry_scope.set_tag('status_code', status_code)
+            sentry_scope.set_extra('duration_seconds', round(duration, 3))
+            if file_name is not None:
+                sentry_scope.set_extra('profile', file_name)
+            level = 'error' if status_code >= 500 else 'warning'
+            sentry_sdk.capture_message(f"Slow or failed request: {scope['method']} {route} ({status_code}, {duration:.2f}s)", level=level)
@@ -0,0 +1,80 @@
+import collections
+import os
+import sys
+import threading
+import time
+import uuid
+
+
+# Stacks whose innermost frame is in one of these files are threads waiting for work
+IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py', 'thread.py')
+
+
+def _folded(frame) -> str:
+    """ Turns a frame into 'outer;...;inner', the line format flamegraph tools read """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """
+    Statistical profiler that records the stacks of all busy threads at a fixed interval.
+
+    Sampling from a separate thread means the profiled code runs unmodified, so
+    the overhead is the same for async and sync routes. Other requests running
+    at the same time show up in the profile too, which is rarely a problem
+    since the slow request dominates the samples.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: collections.Counter = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                self.samples[_folded(frame)] += 1
+
+    def write(self, path: str):
+        """ Writes the samples in folded stack format, ex. for flamegraph.pl or speedscope """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def profile_file_name(method: str, route: str) -> str:
+    route = route.strip('/').replace('/', '_').replace('{', '').replace('}', '') or 'root'
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{method.lower()}-{route}-{uuid.uuid4().hex[:8]}.folded"
+
+
+def prune_profiles(directory: str, max_files: int):
+    """ Deletes the oldest profiles in the directory beyond the newest max_files """
+    try:
+        paths = [entry.path for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith('.folded')]
+    except FileNotFoundError:
+        return
+    paths.sort(key=lambda path: os.path.getmtime(path), reverse=True)
+    for path in paths[max_files:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass   # Removed by another worker
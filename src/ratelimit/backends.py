@@ -0,0 +1,91 @@
+import datetime
+import threading
+import time
+
+from src.database import MongoDatabase
+
+
+class InMemoryBackend:
+    """
+    Keeps the window counters in process memory. Fast, but every worker
+    process has its own counters, so only use it with a single worker.
+    """
+
+    MAX_BUCKETS = 100_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, list[int]] = {}     # bucket -> [window index, current count, previous count, expires at]
+
+    def counts(self, bucket: str, index: int) -> tuple[int, int]:
+        """ Returns the (current, previous) window counts of a bucket """
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is None:
+                return 0, 0
+            if entry[0] == index:
+                return entry[1], entry[2]
+            if entry[0] == index - 1:
+                return 0, entry[1]
+            return 0, 0
+
+    def increment(self, bucket: str, index: int, window: int):
+        # The window must outlive the next one, as it is used as the previous window there
+        expires_at = (index + 2) * window
+        with self._lock:
+            entry = self._buckets.get(bucket)
+            if entry is None or entry[0] < index - 1:
+                self._buckets[bucket] = [index, 1, 0, expires_at]
+            elif entry[0] == index - 1:
+                self._buckets[bucket] = [index, 1, entry[1], expires_at]
+            else:
+                entry[1] += 1
+
+            if len(self._buckets) > self.MAX_BUCKETS:
+                self._prune()
+
+    def reset(self, bucket: str, index: int):
+        with self._lock:
+            self._buckets.pop(bucket, None)
+
+    def _prune(self):
+        # Window indexes differ per policy, so expiry is compared in wall clock time
+        now = time.time()
+        expired = [bucket for bucket, entry in self._buckets.items() if entry[3] < now]
+        for bucket in expired:
+            del self._buckets[bucket]
+
+
+class MongoBackend:
+    """
+    Stores one small document per bucket and window in the 'rate_limits'
+    collection. Documents expire through a TTL index once the window can
+    no longer influence a decision.
+
+    Checking a bucket is a single read. Only allowed requests are written.
+    """
+
+    COLLECTION_NAME = 'rate_limits'
+
+    def _collection(self):
+        return MongoDatabase().collections[self.COLLECTION_NAME]
+
+    def counts(self, bucket: str, index: int) -> tuple[int, int]:
+        docs = self._collection().find(
+            {'_id': {'$in': [f"{bucket}:{index}", f"{bucket}:{index - 1}"]}},
+            projection={'count': 1}
+        )
+        counts = {doc['_id']: doc['count'] for doc in docs}
+        return counts.get(f"{bucket}:{index}", 0), counts.get(f"{bucket}:{index - 1}", 0)
+
+    def increment(self, bucket: str, index: int, window: int):
+        # The window must outlive the next one, as it is used as the previous window there
+        expires_at = datetime.datetime.fromtimestamp((index + 2) * window, tz=datetime.timezone.utc)
+        self._collection().update_one(
+            {'_id': f"{bucket}:{index}"},
+            {'$inc': {'count': 1}, '$setOnInsert': {'expires_at': expires_at}},
+            upsert=True
+        )
+
+    def reset(self, bucket: str, index: int):
+        self._collection().delete_many({'_id': {'$in': [f"{bucket}:{index}", f"{bucket}:{index - 1}"]}})
@@ -0,0 +1,31 @@
+from fastapi import HTTPException, Request, status
+
+from src.ratelimit.limiter import RateLimitResult, limiter
+from src.ratelimit.policies import POLICIES
+
+
+def enforce(policy: str, key: str, status_code: int = status.HTTP_429_TOO_MANY_REQUESTS,
+            msg: str = "Too many requests. Please wait before trying again.") -> RateLimitResult:
+    """
+    Counts a hit against the named policy and raises if the key is over its limit.
+    Use this inside a route when the hit should only count once the request is validated
+    """
+    result = limiter.hit(POLICIES[policy], key)
+    if not result.allowed:
+        raise HTTPException(status_code=status_code, detail={
+            "msg": msg,
+            "cooldown_expires_at": str(result.reset_at)
+        }, headers={'Retry-After': str(result.retry_after)})
+    return result
+
+
+class RateLimit:
+    """ Route dependency that rate limits requests per client ip address """
+
+    def __init__(self, policy: str):
+        if policy not in POLICIES:
+            raise KeyError(f"Unknown rate limit policy '{policy}'")
+        self.policy = policy
+
+    def __call__(self, request: Request):
+        enforce(self.policy, request.client.host)
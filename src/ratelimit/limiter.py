@@ -0,0 +1,94 @@
+import datetime
+import math
+import time
+
+from pydantic import BaseModel
+
+from src.settings import config
+from src.ratelimit.backends import InMemoryBackend, MongoBackend
+from src.metrics.instruments import rate_limit_rejections_total
+
+
+class RateLimitPolicy(BaseModel):
+    name: str
+    limit: int          # Number of allowed hits per window
+    window: int         # Length of the window in seconds
+
+
+class RateLimitResult(BaseModel):
+    allowed: bool
+    remaining: int
+    retry_after: int    # Seconds until the next hit would be allowed. 0 when allowed
+
+    @property
+    def reset_at(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.retry_after)
+
+
+class RateLimiter:
+    """
+    Sliding window rate limiter.
+
+    Hits are counted in fixed windows, and the count of the previous window
+    is weighted by how much of it still overlaps the sliding window. This
+    gives a close approximation of a true sliding log while only storing
+    two counters per key.
+    """
+
+    def __init__(self, backend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+
+    def _estimate(self, policy: RateLimitPolicy, key: str, now: float) -> tuple[float, int, int, float]:
+        index = int(now // policy.window)
+        elapsed = (now - index * policy.window) / policy.window
+        current, previous = self.backend.counts(f"{policy.name}:{key}", index)
+        return previous * (1 - elapsed) + current, current, previous, elapsed
+
+    def _result(self, policy: RateLimitPolicy, estimate: float, current: int, previous: int, elapsed: float) -> RateLimitResult:
+        if estimate + 1 <= policy.limit:
+            return RateLimitResult(allowed=True, remaining=int(policy.limit - estimate - 1), retry_after=0)
+
+        # Find when enough of the previous window has slid out, or else wait for the next window
+        if previous and current + 1 <= policy.limit:
+            free_at = 1 - (policy.limit - current - 1) / previous
+            retry_after = (free_at - elapsed) * policy.window
+        else:
+            retry_after = (1 - elapsed) * policy.window
+        return RateLimitResult(allowed=False, remaining=0, retry_after=max(1, math.ceil(retry_after)))
+
+    def peek(self, policy: RateLimitPolicy, key: str) -> RateLimitResult:
+        """ Checks whether a hit would be allowed without counting it """
+        if not self.enabled:
+            return RateLimitResult(allowed=True, remaining=policy.limit, retry_after=0)
+
+        return self._result(policy, *self._estimate(policy, key, time.time()))
+
+    def hit(self, policy: RateLimitPolicy, key: str) -> RateLimitResult:
+        """ Counts a hit on the key. Rejected hits are not counted and cost no writes """
+        if not self.enabled:
+            return RateLimitResult(allowed=True, remaining=policy.limit, retry_after=0)
+
+        now = time.time()
+        estimate, current, previous, elapsed = self._estimate(policy, key, now)
+        result = self._result(policy, estimate, current, previous, elapsed)
+        if result.allowed:
+            self.backend.increment(f"{policy.name}:{key}", int(now // policy.window), policy.window)
+        else:
+            rate_limit_rejections_total.inc(policy=policy.name)
+        return result
+
+    def reset(self, policy: RateLimitPolicy, key: str):
+        if self.enabled:
+            self.backend.reset(f"{policy.name}:{key}", int(time.time() // policy.window))
+
+
+BACKENDS = {
+    'memory': InMemoryBackend,
+    'mongo': MongoBackend,
+}
+
+limiter = RateLimiter(
+    backend=BACKENDS[config.get('RATE_LIMIT_BACKEND', 'mongo')](),
+    enabled=config.get('RATE_LIMIT_ENABLED', 'YES') != 'NO'
+)
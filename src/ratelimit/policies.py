@@ -0,0 +1,47 @@
+"""
+    Rate limit policies
+
+    Every rate limited route refers to one of the policies below by name.
+    A policy can be overridden from the environment with a setting named
+    after the policy, e.g. RATE_LIMIT_REGISTER_OWNER="1/300" allows one hit
+    every 300 seconds.
+"""
+
+from src.settings import config
+from src.ratelimit.limiter import RateLimitPolicy
+
+
+DEFAULT_POLICIES = [
+    # Any login attempt from a single ip address
+    RateLimitPolicy(name='login', limit=30, window=60),
+    # Failed logins for a phone number from a single ip address before a cooldown kicks in
+    RateLimitPolicy(name='login-cooldown', limit=3, window=60),
+    # Failed logins for a phone number from a single ip address before the device gets blacklisted
+    RateLimitPolicy(name='login-blacklist', limit=7, window=60 * 60),
+    # Device verification SMS'es for a phone number and ip address
+    RateLimitPolicy(name='unknown-device-sms', limit=1, window=2 * 60),
+    # Registration SMS'es per ip address
+    RateLimitPolicy(name='register-owner', limit=1, window=5 * 60),
+    # Password reset SMS'es per phone number
+    RateLimitPolicy(name='password-reset', limit=1, window=5 * 60),
+    # Bike registrations, and with that claim token SMS'es, per ip address
+    RateLimitPolicy(name='register-bike', limit=30, window=60 * 60),
+    # Bulk bike registrations per ip address. Each can hold up to BIKE_IMPORT_MAX_ROWS bikes
+    RateLimitPolicy(name='import-bikes', limit=10, window=60 * 60),
+    # Full exports of bikes and transfers per owner
+    RateLimitPolicy(name='export', limit=10, window=60 * 60),
+]
+
+
+def _load_policies() -> dict[str, RateLimitPolicy]:
+    policies = {}
+    for policy in DEFAULT_POLICIES:
+        override = config.get(f"RATE_LIMIT_{policy.name.upper().replace('-', '_')}")
+        if override:
+            limit, window = override.split('/')
+            policy = RateLimitPolicy(name=policy.name, limit=int(limit), window=int(window))
+        policies[policy.name] = policy
+    return policies
+
+
+POLICIES = _load_policies()
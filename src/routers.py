@@ -13,6 +13,9 @@ from src.auth.routers import router as auth_router
 from src.transfers.routers import router as transfer_router
 from src.activities.routers import router as activities_router
 from src.owners.routers import router as owners_router
+from src.metrics.routers import router as metrics_router
+from src.sync.routers import router as sync_router
+from src.health.routers import router as health_router
 
 
 main_router = APIRouter()
@@ -23,4 +26,7 @@ main_router.include_router(transfer_router)
 main_router.include_router(activities_router)
 main_router.include_router(auth_router)
 main_router.include_router(owners_router)
+main_router.include_router(sync_router)
+main_router.include_router(metrics_router)
+main_router.include_router(health_router)
 
@@ -1,7 +1,7 @@
 import logging
 import os
+import random
 from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
 from dotenv import dotenv_values
 import sentry_sdk
 from sentry_sdk.integrations.logging import LoggingIntegration
@@ -19,26 +19,61 @@ class Bcolors:
     UNDERLINE = '\033[4m'
     
     
+class TraceSampler:
+    """
+    Decides how large a share of the requests to each route gets traced.
+
+    Rates are matched on the longest route prefix, ex. with the rates
+    {'/auth': 0.01, '/auth/refresh': 0.5} a request to '/auth/refresh' is
+    traced half of the time and every other '/auth' request 1% of the time.
+    Requests that error or are slower than `slow_request_seconds` are always
+    reported, see src/profiling/middleware.py.
+    """
+
+    def __init__(self, default_rate: float, route_rates: dict[str, float], profile_rate: float, slow_request_seconds: float):
+        self.default_rate = default_rate
+        # Longest prefixes first so the most specific rate wins
+        self.route_rates = sorted(route_rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self.profile_rate = profile_rate
+        self.slow_request_seconds = slow_request_seconds
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'TraceSampler':
+        # TRACES_SAMPLE_RATES="/auth/token=0.01,/bikes=0.2"
+        route_rates = {}
+        for entry in filter(None, config.get('TRACES_SAMPLE_RATES', '').split(',')):
+            prefix, rate = entry.split('=')
+            route_rates[prefix.strip()] = float(rate)
+
+        return cls(
+            default_rate=float(config.get('TRACES_SAMPLE_RATE', 0.1)),
+            route_rates=route_rates,
+            profile_rate=float(config.get('PROFILE_SAMPLE_RATE', 0)),
+            slow_request_seconds=float(config.get('SLOW_REQUEST_SECONDS', 1.0)),
+        )
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def __call__(self, sampling_context: dict) -> float:
+        """ Used as sentry's traces_sampler """
+        # Follow the decision of an upstream service
+        if sampling_context.get('parent_sampled') is not None:
+            return float(sampling_context['parent_sampled'])
+
+        scope = sampling_context.get('asgi_scope') or {}
+        return self.rate_for(scope.get('path', ''))
+
+    def should_profile(self) -> bool:
+        """ Whether a request without the profiling header gets profiled anyway """
+        return self.profile_rate > 0 and random.random() < self.profile_rate
+
+
 if os.getenv('ENV') == 'prod':
     print(f"{Bcolors.OKBLUE}[Log]:{Bcolors.ENDC}    production")
-    # All of this is already happening by default!
-    sentry_logging = LoggingIntegration(
-        level=logging.INFO,        # Capture info and above as breadcrumbs
-        event_level=logging.ERROR  # Send errors as events
-    )
-
-    sentry_sdk.init(
-        dsn="https://2564cb71cf79471588d58b6c5e368093@o4505115189772288.ingest.sentry.io/4505115191476224",
-        environment="production",
-        
-        # Set traces_sample_rate to 1.0 to capture 100%
-        # of transactions for performance monitoring.
-        # We recommend adjusting this value in production,
-        traces_sample_rate=1.0,
-        integrations=[
-            sentry_logging
-        ]
-    )
 else:
     print(f"{Bcolors.OKBLUE}[Log]:{Bcolors.ENDC}    local")
 
@@ -61,6 +96,28 @@ else:
     app = FastAPI()
 
 
+trace_sampler = TraceSampler.from_config(config)
+
+if os.getenv('ENV') == 'prod':
+    # All of this is already happening by default!
+    sentry_logging = LoggingIntegration(
+        level=logging.INFO,        # Capture info and above as breadcrumbs
+        event_level=logging.ERROR  # Send errors as events
+    )
+
+    sentry_sdk.init(
+        dsn="https://2564cb71cf79471588d58b6c5e368093@o4505115189772288.ingest.sentry.io/4505115191476224",
+        environment="production",
+        
+        # Errors are always sent. Transactions are sampled per route by
+        # the trace sampler, configured with TRACES_SAMPLE_RATE(S)
+        traces_sampler=trace_sampler,
+        integrations=[
+            sentry_logging
+        ]
+    )
+
+
 origins = [
     "http://127.0.0.1",
     "http://localhost",
@@ -73,12 +130,4 @@ origins = [
     "http://mincykelapp.dk",
     "https://mincykelapp.dk",
 ]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_origin_regex="http[s]?://172.25.0.3:[0-9]{1,5}",
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
\ No newline at end of file
+origin_regex = "http[s]?://172.25.0.3:[0-9]{1,5}"
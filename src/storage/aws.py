@@ -1,24 +1,45 @@
 import datetime
 import logging
+import os
+import threading
 import boto3
 from botocore.exceptions import ClientError
 from fastapi import HTTPException, UploadFile
 
 from src.settings import config
 
-s3_client = boto3.client(
-    service_name='s3',
-    aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
-    aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'],
-    region_name=config['AWS_DEFAULT_REGION']
-)
+_s3_clients: dict[int, object] = {}
+_s3_clients_lock = threading.Lock()     # Creating boto3 clients is not thread safe
+
+
+def get_s3_client():
+    """
+    Returns the S3 client of the current process.
+
+    boto3 clients hold connection pools that must not be shared across a fork,
+    so every server worker creates its own the first time it needs one
+    """
+    pid = os.getpid()
+    if pid not in _s3_clients:
+        with _s3_clients_lock:
+            if pid not in _s3_clients:
+                _s3_clients.clear()
+                _s3_clients[pid] = boto3.client(
+                    service_name='s3',
+                    aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
+                    aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'],
+                    region_name=config['AWS_DEFAULT_REGION'],
+                    endpoint_url=config.get('AWS_ENDPOINT_URL')     # Only set for S3 compatible stand-ins
+                )
+    return _s3_clients[pid]
+
 
 def save_file(file: UploadFile):
     
     object_name = str(datetime.datetime.now(datetime.timezone.utc)) + file.filename
 
     try:
-        s3_client.upload_fileobj(file.file, config['AWS_BUCKET_NAME'], object_name)
+        get_s3_client().upload_fileobj(file.file, config['AWS_BUCKET_NAME'], object_name)
         return object_name
             
     except ClientError as e:
@@ -0,0 +1,140 @@
+"""
+    Orphaned upload collection
+
+    Files are uploaded to S3 before the entity referencing them is saved, so a
+    failed save leaves the file behind. So does deleting a discovery. This job
+    deletes every object under the upload paths of the S3File fields that no
+    document references, as long as it is older than STORAGE_GC_GRACE_HOURS.
+    The grace period keeps uploads whose entity is still being saved.
+
+    Usage:
+        python -m src.storage.gc [--dry-run]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+
+from src.bikes.models import Bike, FoundBikeReport
+from src.database import MongoDatabase
+from src.metrics.instruments import s3_orphan_bytes_reclaimed_total, s3_orphans_deleted_total
+from src.settings import config
+from src.storage.aws import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+STORAGE_GC_INTERVAL_SECONDS = int(config.get('STORAGE_GC_INTERVAL_SECONDS', 24 * 60 * 60))
+STORAGE_GC_GRACE = datetime.timedelta(hours=int(config.get('STORAGE_GC_GRACE_HOURS', 24)))
+
+# The fields holding an S3File and the collections they are saved in. Transfers keep a
+# copy of the bike image in their snapshot, which must outlive the bike's own reference
+REFERENCES = {
+    'transfers': ['bike_snapshot.image.obj_name'],
+    'discoveries': ['image.obj_name'],
+    'bikes': ['image.obj_name', 'receipt.obj_name'],
+}
+
+# Only objects under these paths are ever deleted
+MANAGED_PREFIXES = tuple(f"{model.__fields__[field].default._path}/" for model, field in (
+    (Bike, 'image'), (Bike, 'receipt'), (FoundBikeReport, 'image')))
+
+DELETE_BATCH_SIZE = 1000    # The most S3 deletes in one request
+
+
+def _get(doc: dict, path: str):
+    for key in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def referenced_objects(batch_size: int = 1000) -> set[str]:
+    """ The object names referenced from mongo. Streams the documents with only the referencing fields """
+    db = MongoDatabase()
+    referenced = set()
+    for collection_name, paths in REFERENCES.items():
+        cursor = db.collections[collection_name].find(
+            {'$or': [{path: {'$ne': None}} for path in paths]},
+            projection={path: 1 for path in paths} | {'_id': 0},
+            batch_size=batch_size
+        )
+        for doc in cursor:
+            referenced.update(name for name in (_get(doc, path) for path in paths) if name)
+    return referenced
+
+
+def collect_orphaned_uploads(dry_run: bool = False) -> dict:
+    """
+    Deletes unreferenced uploads older than the grace period.
+
+    The references are read before the bucket is listed. An object uploaded for a
+    document saved after that is younger than the grace period, and is kept
+
+    :returns a report of what was scanned and how much storage was reclaimed
+    """
+    referenced = referenced_objects()
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - STORAGE_GC_GRACE
+    client = get_s3_client()
+    bucket = config['AWS_BUCKET_NAME']
+
+    report = {
+        'dry_run': dry_run,
+        'referenced_objects': len(referenced),
+        'scanned_objects': 0,
+        'scanned_bytes': 0,
+        'orphaned_objects': 0,
+        'orphaned_bytes': 0,
+        'deleted_objects': 0,
+        'reclaimed_bytes': 0,
+        'failed_deletes': 0,
+    }
+
+    def delete(batch: list[dict]):
+        if dry_run:
+            return
+        result = client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': obj['Key']} for obj in batch], 'Quiet': True})
+        failed = {error['Key'] for error in result.get('Errors', [])}
+        for error in result.get('Errors', []):
+            logger.warning(f"Failed to delete orphaned upload '{error['Key']}': {error.get('Message')}")
+
+        deleted = [obj for obj in batch if obj['Key'] not in failed]
+        reclaimed = sum(obj['Size'] for obj in deleted)
+        report['deleted_objects'] += len(deleted)
+        report['reclaimed_bytes'] += reclaimed
+        report['failed_deletes'] += len(failed)
+        s3_orphans_deleted_total.inc(len(deleted))
+        s3_orphan_bytes_reclaimed_total.inc(reclaimed)
+
+    paginator = client.get_paginator('list_objects_v2')
+    for prefix in MANAGED_PREFIXES:
+        batch = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                report['scanned_objects'] += 1
+                report['scanned_bytes'] += obj['Size']
+                if obj['Key'] in referenced or obj['LastModified'] > cutoff:
+                    continue
+
+                report['orphaned_objects'] += 1
+                report['orphaned_bytes'] += obj['Size']
+                batch.append(obj)
+                if len(batch) >= DELETE_BATCH_SIZE:
+                    delete(batch)
+                    batch = []
+        if batch:
+            delete(batch)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Deletes uploads that no document references")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+    args = parser.parse_args()
+
+    db = MongoDatabase()
+    db.connect()
+    print(json.dumps(collect_orphaned_uploads(dry_run=args.dry_run), indent=2))
+    db.disconnect()
@@ -1,21 +1,16 @@
 import datetime
 import logging
+import time
 from typing import Self
 import uuid
-import boto3
 from fastapi import HTTPException, UploadFile
 from pydantic import BaseModel, Field, PrivateAttr
 from botocore.exceptions import ClientError
 
 from src.models import Entity
 from src.settings import config
-
-s3_client = boto3.client(
-    service_name='s3',
-    aws_access_key_id=config['AWS_ACCESS_KEY_ID'],
-    aws_secret_access_key=config['AWS_SECRET_ACCESS_KEY'],
-    region_name=config['AWS_DEFAULT_REGION']
-)
+from src.storage.aws import get_s3_client
+from src.metrics.instruments import s3_upload_duration_seconds, s3_upload_failures_total
 
 
 class S3File(BaseModel):
@@ -57,11 +52,14 @@ class S3File(BaseModel):
         self.obj_url      = f"https://{config['AWS_BUCKET_NAME']}.s3.{config['AWS_DEFAULT_REGION']}.amazonaws.com/{self.obj_name}"
 
         # Everything is fine. Begin upload to s3
+        started = time.perf_counter()
         try:
-            s3_client.upload_fileobj(file.file, config['AWS_BUCKET_NAME'], file_obj_name)
+            get_s3_client().upload_fileobj(file.file, config['AWS_BUCKET_NAME'], file_obj_name)
+            s3_upload_duration_seconds.observe(time.perf_counter() - started)
             
         except ClientError as e:
             logging.error(e)
+            s3_upload_failures_total.inc()
             raise HTTPException(status_code=500, detail=f"{datetime.datetime.now(datetime.timezone.utc)}: Failed to save file {file.filename}")
     
     class Config:
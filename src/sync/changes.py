@@ -0,0 +1,99 @@
+"""
+    Per owner change log for delta sync
+
+    Every write to a bike, transfer or discovery records a change for each
+    owner who can see it. A change gets the next number of that owner's
+    sequence in 'sync_sequences', and is upserted into 'sync_changes' keyed on
+    (owner, kind, entity), so the log only keeps the latest change of every
+    entity. A client that syncs from a cursor gets each changed entity once,
+    no matter how often it changed since.
+
+    Deletions are kept as tombstones for SYNC_TOMBSTONE_RETENTION_DAYS. Clients
+    with an older cursor are told to reload everything.
+"""
+
+import datetime
+import uuid
+from collections import defaultdict
+from enum import Enum
+from typing import NamedTuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from src.database import SYNC_TOMBSTONE_RETENTION_SECONDS, MongoDatabase
+
+
+SEQUENCES_COLLECTION_NAME = 'sync_sequences'
+CHANGES_COLLECTION_NAME = 'sync_changes'
+TOMBSTONE_RETENTION = datetime.timedelta(seconds=SYNC_TOMBSTONE_RETENTION_SECONDS)
+
+
+class ChangeKind(str, Enum):
+    BIKE = "bike",
+    TRANSFER = "transfer",
+    DISCOVERY = "discovery"
+
+
+class Change(NamedTuple):
+    owner_id: uuid.UUID
+    kind: ChangeKind
+    entity_id: uuid.UUID
+    deleted: bool = False   # Deleted, or no longer visible to the owner, ex. a bike that was handed over
+
+
+def record(changes: list[Change]):
+    """ Stamps the changes with the next sequence numbers of their owners. One round trip per owner plus one """
+    if not changes:
+        return
+
+    by_owner: dict[uuid.UUID, list[Change]] = defaultdict(list)
+    for change in changes:
+        by_owner[change.owner_id].append(change)
+
+    db = MongoDatabase()
+    operations = []
+    for owner_id, owner_changes in by_owner.items():
+        # Reserve a range of sequence numbers at once
+        sequence = db.collections[SEQUENCES_COLLECTION_NAME].find_one_and_update(
+            {'_id': owner_id}, {'$inc': {'seq': len(owner_changes)}}, upsert=True, return_document=ReturnDocument.AFTER)
+        first = sequence['seq'] - len(owner_changes) + 1
+        changed_at = datetime.datetime.now(datetime.timezone.utc)
+
+        for offset, change in enumerate(owner_changes):
+            operations.append(UpdateOne(
+                {'owner_id': owner_id, 'kind': change.kind, 'entity_id': change.entity_id},
+                {'$set': {'seq': first + offset, 'deleted': change.deleted, 'changed_at': changed_at}},
+                upsert=True
+            ))
+
+    db.collections[CHANGES_COLLECTION_NAME].bulk_write(operations, ordered=False)
+
+
+def transfer_changes(transfers: list[tuple[uuid.UUID, uuid.UUID, uuid.UUID, uuid.UUID]], deleted: bool = False, handed_over: bool = False) -> list[Change]:
+    """
+    Builds the changes of opening, closing or deleting (transfer_id, sender, receiver, bike_id) transfers.
+    The transfer changes for both parties and the bike for the sender, and for the receiver too when handed over
+    """
+    changes = []
+    for transfer_id, sender, receiver, bike_id in transfers:
+        changes.append(Change(sender, ChangeKind.TRANSFER, transfer_id, deleted))
+        changes.append(Change(receiver, ChangeKind.TRANSFER, transfer_id, deleted))
+        changes.append(Change(sender, ChangeKind.BIKE, bike_id, deleted=handed_over))
+        if handed_over:
+            changes.append(Change(receiver, ChangeKind.BIKE, bike_id))
+    return changes
+
+
+def current_sequence(owner_id: uuid.UUID) -> int:
+    doc = MongoDatabase().collections[SEQUENCES_COLLECTION_NAME].find_one({'_id': owner_id}) or {}
+    return doc.get('seq', 0)
+
+
+def changes_since(owner_id: uuid.UUID, seq: int, limit: int) -> list[dict]:
+    """ The latest change of every entity changed after seq, oldest first. Served by the (owner_id, seq) index """
+    return list(MongoDatabase().collections[CHANGES_COLLECTION_NAME].find(
+        {'owner_id': owner_id, 'seq': {'$gt': seq}},
+        projection={'_id': 0, 'kind': 1, 'entity_id': 1, 'deleted': 1, 'seq': 1, 'changed_at': 1},
+        sort=[('seq', 1)],
+        limit=limit
+    ))
@@ -0,0 +1,103 @@
+import datetime
+
+from fastapi import APIRouter, Depends, Request, status
+
+from src.auth.dependencies import authenticated_request
+from src.owners.models import BikeOwner
+from src.settings import config
+from src.sync.changes import TOMBSTONE_RETENTION, ChangeKind, changes_since, current_sequence
+from src.transfers.models import BikeTransfer
+from src.transfers.utils import expand_transfer
+
+
+SYNC_PAGE_SIZE = int(config.get('SYNC_PAGE_SIZE', 200))
+
+# Sequence numbers are reserved before the change is written, so a change can
+# briefly be visible before one with a lower number. The cursor is not moved
+# past changes younger than this, which are sent again on the next sync instead
+SETTLE_TIME = datetime.timedelta(seconds=int(config.get('SYNC_SETTLE_SECONDS', 5)))
+
+
+router = APIRouter(
+    tags=['sync'],
+    prefix='/sync'
+)
+
+
+def _encode_cursor(seq: int) -> str:
+    # The issue time tells whether tombstones the client has not seen yet may have expired
+    return f"{seq}.{int(datetime.datetime.now(datetime.timezone.utc).timestamp())}"
+
+
+def _decode_cursor(cursor: str) -> tuple[int, datetime.datetime] | None:
+    try:
+        seq, issued_at = cursor.split('.')
+        return int(seq), datetime.datetime.fromtimestamp(int(issued_at), datetime.timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        # Malformed, or an issue time out of range
+        return None
+
+
+@router.get('', summary="Get the bikes, transfers and discoveries that changed since a cursor", status_code=status.HTTP_200_OK)
+def sync(request: Request, cursor: str | None = None, user: BikeOwner = Depends(authenticated_request)):
+    """
+    Without a cursor, or when the cursor is too old, the response has 'reset' set. The client should
+    then reload everything through the regular endpoints and sync from the returned cursor afterwards.
+
+    Otherwise the response holds the current version of every entity that changed since the cursor,
+    and the ids of the ones that were deleted or are no longer visible to the user. Keep syncing
+    with the returned cursor while 'has_more' is set
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    decoded = _decode_cursor(cursor) if cursor else None
+    latest = current_sequence(user.id)
+
+    if decoded is None or decoded[1] < now - TOMBSTONE_RETENTION or decoded[0] > latest:
+        return {'reset': True, 'cursor': _encode_cursor(latest), 'has_more': False}
+
+    seq = decoded[0]
+    changes = changes_since(user.id, seq, SYNC_PAGE_SIZE)
+
+    # Move the cursor up to the first change that has not settled yet
+    settled_before = now - SETTLE_TIME
+    next_seq = seq
+    for change in changes:
+        if change['changed_at'] > settled_before:
+            break
+        next_seq = change['seq']
+
+    ids = {kind: [] for kind in ChangeKind}
+    deleted = {kind: set() for kind in ChangeKind}
+    for change in changes:
+        if change['deleted']:
+            deleted[change['kind']].add(change['entity_id'])
+        else:
+            ids[change['kind']].append(change['entity_id'])
+
+    # At most one query per kind. Entities the user can no longer see are sent as deleted
+    bikes, transfers, discoveries = [], [], []
+    if ids[ChangeKind.BIKE]:
+        bikes = list(request.app.collections['bikes'].find({'_id': {'$in': ids[ChangeKind.BIKE]}, 'owner': user.id}))
+    if ids[ChangeKind.TRANSFER]:
+        transfers = [BikeTransfer(**transfer) for transfer in request.app.collections['transfers'].find(
+            {'_id': {'$in': ids[ChangeKind.TRANSFER]}, '$or': [{'sender': user.id}, {'receiver': user.id}]})]
+    if ids[ChangeKind.DISCOVERY]:
+        discoveries = list(request.app.collections['discoveries'].find({'_id': {'$in': ids[ChangeKind.DISCOVERY]}, 'bike_owner': user.id}))
+
+    deleted[ChangeKind.BIKE].update(set(ids[ChangeKind.BIKE]) - {bike['_id'] for bike in bikes})
+    deleted[ChangeKind.TRANSFER].update(set(ids[ChangeKind.TRANSFER]) - {transfer.id for transfer in transfers})
+    deleted[ChangeKind.DISCOVERY].update(set(ids[ChangeKind.DISCOVERY]) - {discovery['_id'] for discovery in discoveries})
+
+    return {
+        'reset': False,
+        'cursor': _encode_cursor(next_seq),
+        'has_more': len(changes) == SYNC_PAGE_SIZE and next_seq > seq,
+        'bikes': bikes,
+        'transfers': [expand_transfer(transfer, request) for transfer in transfers],
+        'discoveries': discoveries,
+        'deleted': {
+            'bikes': list(deleted[ChangeKind.BIKE]),
+            'transfers': list(deleted[ChangeKind.TRANSFER]),
+            'discoveries': list(deleted[ChangeKind.DISCOVERY]),
+        }
+    }
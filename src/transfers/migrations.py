@@ -0,0 +1,64 @@
+"""
+    Transfer migrations
+
+    Backfills the sender, receiver and bike snapshots on transfers made before
+    the snapshots were introduced. Owners and bikes are loaded per batch with
+    a single $in query each. Safe to run more than once.
+
+    Usage:
+        python -m src.transfers.migrations
+"""
+
+from pymongo import UpdateOne
+
+from src.database import MongoDatabase
+from src.transfers.models import BIKE_SNAPSHOT_FIELDS, BikeSnapshot, PartySnapshot
+
+
+def backfill_snapshots(batch_size: int = 500) -> int:
+    db = MongoDatabase()
+    transfers = db.collections['transfers']
+    backfilled = 0
+
+    def flush(batch: list[dict]):
+        owner_ids = {transfer['sender'] for transfer in batch} | {transfer['receiver'] for transfer in batch}
+        owners = {owner['_id']: owner for owner in db.collections['bike_owners'].find(
+            {'_id': {'$in': list(owner_ids)}}, projection={'phone_number': 1})}
+        bikes = {bike['_id']: bike for bike in db.collections['bikes'].find(
+            {'_id': {'$in': list({transfer['bike_id'] for transfer in batch})}}, projection=BIKE_SNAPSHOT_FIELDS)}
+
+        operations = []
+        for transfer in batch:
+            sender, receiver, bike = owners.get(transfer['sender']), owners.get(transfer['receiver']), bikes.get(transfer['bike_id'])
+            if not (sender and receiver and bike):
+                # Leave transfers pointing at deleted documents on the lookup path
+                continue
+
+            operations.append(UpdateOne({'_id': transfer['_id']}, {'$set': {
+                'sender_snapshot': PartySnapshot(id=sender['_id'], phone_number=sender['phone_number']).dict(),
+                'receiver_snapshot': PartySnapshot(id=receiver['_id'], phone_number=receiver['phone_number']).dict(),
+                'bike_snapshot': BikeSnapshot.from_doc(bike).dict(),
+            }}))
+
+        if operations:
+            transfers.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    batch = []
+    cursor = transfers.find({'bike_snapshot': None}, projection={'sender': 1, 'receiver': 1, 'bike_id': 1}, batch_size=batch_size)
+    for transfer in cursor:
+        batch.append(transfer)
+        if len(batch) >= batch_size:
+            backfilled += flush(batch)
+            batch = []
+    if batch:
+        backfilled += flush(batch)
+
+    return backfilled
+
+
+if __name__ == '__main__':
+    db = MongoDatabase()
+    db.connect()
+    print(f"Backfilled snapshots on {backfill_snapshots()} transfers")
+    db.disconnect()
@@ -6,12 +6,41 @@ from pydantic import BaseModel, Field, PrivateAttr, validator
 import re as regex
 
 from src.models import Entity
+from src.storage.models import S3File
 
 
 class BikeTransferState(str, Enum):
     PENDING = "pending",
     ACCEPTED = "accepted",
-    DECLINED = "declined"
+    DECLINED = "declined",
+    EXPIRED = "expired"     # Pending for too long. See transfers/sweeper.py
+
+class PartySnapshot(BaseModel):
+    """ The sender or receiver of a transfer, as they were when the transfer was made """
+    id: uuid.UUID
+    phone_number: str
+
+
+# Bike fields copied onto a transfer. Also used as projection when reading bikes for a transfer
+BIKE_SNAPSHOT_FIELDS = ('frame_number', 'brand', 'kind', 'color', 'gender', 'is_electric', 'reported_stolen', 'image')
+
+
+class BikeSnapshot(BaseModel):
+    """ The parts of a bike needed to display a transfer without looking up the bike """
+    id: uuid.UUID
+    frame_number: str
+    brand: str
+    kind: str
+    color: str
+    gender: str
+    is_electric: bool
+    reported_stolen: bool = False
+    image: S3File | None = None     # Only the thumbnail of the bike. The receipt is never shown on a transfer
+
+    @classmethod
+    def from_doc(cls, bike_doc: dict) -> 'BikeSnapshot':
+        return cls(id=bike_doc['_id'], **{field: bike_doc.get(field) for field in BIKE_SNAPSHOT_FIELDS if bike_doc.get(field) is not None})
+
 
 class BikeTransfer(Entity):
 
@@ -23,3 +52,8 @@ class BikeTransfer(Entity):
     created_at: datetime.datetime = Field(default_factory= lambda : datetime.datetime.now(datetime.timezone.utc))
     closed_at: datetime.datetime = None
     state: BikeTransferState = BikeTransferState.PENDING
+
+    # Filled in when the transfer is made so it can be shown without further lookups
+    sender_snapshot: PartySnapshot | None = None
+    receiver_snapshot: PartySnapshot | None = None
+    bike_snapshot: BikeSnapshot | None = None
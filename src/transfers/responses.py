@@ -0,0 +1,15 @@
+import uuid
+from pydantic import BaseModel
+
+
+class BatchItemResult(BaseModel):
+    id          : uuid.UUID             # The bike id when creating, the transfer id when accepting
+    success     : bool
+    transfer_id : uuid.UUID | None = None
+    detail      : str | None = None     # Reason for the failure
+
+
+class BatchTransferResponse(BaseModel):
+    succeeded : int
+    failed    : int
+    results   : list[BatchItemResult]
@@ -1,13 +1,19 @@
 import uuid
 import datetime
 from fastapi import APIRouter, Body, Depends, Request, HTTPException, status
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 
-from src.bikes.models import Bike, BikeState
+from src.bikes.models import BikeState
+from src.bikes import events
 from src.owners.models import BikeOwner
 from src.auth.dependencies import authenticated_request
-from src.transfers.models import BikeTransfer, BikeTransferState
-from src.transfers.dependencies import bike_with_id_exists
+from src.transfers.models import BIKE_SNAPSHOT_FIELDS, BikeSnapshot, BikeTransfer, BikeTransferState, PartySnapshot
+from src.activities import counters
+from src.sync import changes
+from src.transfers.responses import BatchItemResult, BatchTransferResponse
 from src.transfers.utils import expand_transfer
+from src.settings import config
 
 
 router = APIRouter(
@@ -15,6 +21,8 @@ router = APIRouter(
     prefix='/transfers'
 )
 
+MAX_BATCH_SIZE = int(config.get('TRANSFER_BATCH_MAX_SIZE', 200))
+
 
 @router.get('/{transfer_id}', summary="Get a single transfer", status_code=status.HTTP_200_OK)
 def get_transfer(request: Request, transfer_id: uuid.UUID, user: BikeOwner = Depends(authenticated_request)):
@@ -39,51 +47,278 @@ def create_transfer(
     request: Request, 
     sender: BikeOwner = Depends(authenticated_request), 
     receiver_phone_number = Body(), 
-    bike_id: uuid.UUID = Depends(bike_with_id_exists)
+    bike_id: uuid.UUID = Body()
 ) -> BikeTransfer:
     
     # Check receiver exists
-    receiver_in_db = request.app.collections["bike_owners"].find_one({"phone_number": receiver_phone_number})
+    receiver_in_db = request.app.collections["bike_owners"].find_one({"phone_number": receiver_phone_number}, projection={'phone_number': 1})
     if not receiver_in_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike owner with phone number {receiver_phone_number} not found")
-        
-    # Check bike exists
-    # is done in dependencies
-
-    # Check sender owns bike
-    bike_owner_in_db = request.app.collections["bikes"].find_one({"owner": sender.id})
-    if not bike_owner_in_db:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike owner with phone number {sender.phone_number} does not own bike with id {bike_id}")
     
     # Check sender is not also receiver
-    receiver = BikeOwner(**receiver_in_db)
-    if sender.id == receiver.id:
+    if sender.id == receiver_in_db["_id"]:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"System does not allow transferral of a bike to yourself")
 
-    # Check bike not stolen
-    bike_in_db = request.app.collections["bikes"].find_one({"_id": bike_id})
-    bike = Bike(**bike_in_db)
-    if bike.reported_stolen:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Bike is reported stolen. Transfer disallowed")
-    
-    # Check bike is transferable
-    if not bike.state == BikeState.TRANSFERABLE:
-        raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail=f"Bike is already in transfer or not transferable")
-    
     # Make a transfer object
-    transfer_info = {
-        'sender': sender.id, 
-        'receiver': receiver_in_db["_id"],
-        'bike_id': bike_id,
-    }
+    transfer = BikeTransfer(sender=sender.id, receiver=receiver_in_db["_id"], bike_id=bike_id)
+
+    # Put the bike in transfer. The filter makes sure the sender owns the bike, that it is
+    # not stolen and that it is transferable, so two concurrent requests can't both succeed
+    bike_in_db = request.app.collections["bikes"].find_one_and_update(
+        {'_id': bike_id, 'owner': sender.id, 'reported_stolen': False, 'state': BikeState.TRANSFERABLE},
+        {'$set': {'state': BikeState.IN_TRANSFER, 'pending_transfer': transfer.id}},
+        projection=BIKE_SNAPSHOT_FIELDS
+    )
+    if not bike_in_db:
+        _raise_bike_not_transferable(request, bike_id, sender)
+
+    _set_snapshots(transfer, sender, receiver_in_db, bike_in_db)
 
-    transfer = BikeTransfer(**transfer_info)
-    bike.state = BikeState.IN_TRANSFER
+    try:
+        transfer.insert()
+    except PyMongoError:
+        # Don't leave the bike stuck in transfer
+        request.app.collections["bikes"].update_one(
+            {'_id': bike_id, 'pending_transfer': transfer.id},
+            {'$set': {'state': BikeState.TRANSFERABLE, 'pending_transfer': None}}
+        )
+        raise
 
-    bike.save()
+    counters.increment_many(counters.transfer_deltas([(transfer.sender, transfer.receiver)], sign=1))
+    changes.record(changes.transfer_changes([(transfer.id, transfer.sender, transfer.receiver, transfer.bike_id)]))
 
     # Return transfer object to request sender
-    return transfer.save()
+    return transfer
+
+
+def _set_snapshots(transfer: BikeTransfer, sender: BikeOwner, receiver_doc: dict, bike_doc: dict):
+    transfer.sender_snapshot = PartySnapshot(id=sender.id, phone_number=sender.phone_number)
+    transfer.receiver_snapshot = PartySnapshot(id=receiver_doc['_id'], phone_number=receiver_doc['phone_number'])
+    transfer.bike_snapshot = BikeSnapshot.from_doc(bike_doc)
+
+
+def _raise_bike_not_transferable(request: Request, bike_id: uuid.UUID, sender: BikeOwner):
+    """ Finds out why a bike could not be put in transfer. Only runs when the transfer is refused """
+    bike_in_db = request.app.collections["bikes"].find_one({'_id': bike_id}, projection={'owner': 1, 'reported_stolen': 1, 'state': 1})
+    if not bike_in_db:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Bike with id: {bike_id} not found")
+
+    # Check sender owns bike
+    if bike_in_db.get('owner') != sender.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike owner with phone number {sender.phone_number} does not own bike with id {bike_id}")
+
+    # Check bike not stolen
+    if bike_in_db.get('reported_stolen'):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Bike is reported stolen. Transfer disallowed")
+
+    raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail=f"Bike is already in transfer or not transferable")
+
+
+@router.post('/batch', description="Create transfers of many bikes to a single receiver", status_code=status.HTTP_200_OK)
+def create_transfers_batch(
+    request: Request,
+    sender: BikeOwner = Depends(authenticated_request),
+    receiver_phone_number: str = Body(),
+    bike_ids: list[uuid.UUID] = Body()
+) -> BatchTransferResponse:
+
+    bike_ids = list(dict.fromkeys(bike_ids))   # Removes duplicates while keeping the order
+    _check_batch_size(bike_ids)
+
+    # Check receiver exists
+    receiver_in_db = request.app.collections["bike_owners"].find_one({"phone_number": receiver_phone_number}, projection={'phone_number': 1})
+    if not receiver_in_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike owner with phone number {receiver_phone_number} not found")
+
+    # Check sender is not also receiver
+    if sender.id == receiver_in_db["_id"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"System does not allow transferral of a bike to yourself")
+
+    # Validate all bikes with a single query
+    bikes = {bike['_id']: bike for bike in request.app.collections["bikes"].find(
+        {'_id': {'$in': bike_ids}}, projection=('owner', 'state', *BIKE_SNAPSHOT_FIELDS))}
+
+    results: dict[uuid.UUID, BatchItemResult] = {}
+    transfers: dict[uuid.UUID, BikeTransfer] = {}
+    for bike_id in bike_ids:
+        bike = bikes.get(bike_id)
+        if not bike:
+            results[bike_id] = BatchItemResult(id=bike_id, success=False, detail="Bike not found")
+        elif bike.get('owner') != sender.id:
+            results[bike_id] = BatchItemResult(id=bike_id, success=False, detail="Sender does not own the bike")
+        elif bike.get('reported_stolen'):
+            results[bike_id] = BatchItemResult(id=bike_id, success=False, detail="Bike is reported stolen. Transfer disallowed")
+        elif bike.get('state') != BikeState.TRANSFERABLE:
+            results[bike_id] = BatchItemResult(id=bike_id, success=False, detail="Bike is already in transfer or not transferable")
+        else:
+            transfers[bike_id] = BikeTransfer(sender=sender.id, receiver=receiver_in_db["_id"], bike_id=bike_id)
+            _set_snapshots(transfers[bike_id], sender, receiver_in_db, bike)
+
+    if transfers:
+        # Put every bike in transfer in one round trip. The same guards as a single transfer
+        # apply, so bikes changed by a concurrent request since the read above are skipped
+        flipped = request.app.collections["bikes"].bulk_write([
+            UpdateOne(
+                {'_id': bike_id, 'owner': sender.id, 'reported_stolen': False, 'state': BikeState.TRANSFERABLE},
+                {'$set': {'state': BikeState.IN_TRANSFER, 'pending_transfer': transfer.id}}
+            ) for bike_id, transfer in transfers.items()
+        ], ordered=False)
+
+        if flipped.modified_count < len(transfers):
+            # Some bikes lost a race. Only keep the ones that point at our transfers
+            ours = {bike['_id'] for bike in request.app.collections["bikes"].find(
+                {'_id': {'$in': list(transfers)}, 'pending_transfer': {'$in': [transfer.id for transfer in transfers.values()]}},
+                projection={'_id': 1})}
+            for bike_id in list(transfers):
+                if bike_id not in ours:
+                    del transfers[bike_id]
+                    results[bike_id] = BatchItemResult(id=bike_id, success=False, detail="Bike is already in transfer or not transferable")
+
+    if transfers:
+        documents = [{'_id': transfer.id, **transfer.dict()} for transfer in transfers.values()]
+        try:
+            request.app.collections["transfers"].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            failed = {documents[error['index']]['bike_id'] for error in e.details.get('writeErrors', [])}
+            _release_failed_transfers(request, transfers, failed, results)
+        except PyMongoError:
+            # Unknown which inserts made it, so look them up
+            inserted = {transfer['_id'] for transfer in request.app.collections["transfers"].find(
+                {'_id': {'$in': [transfer.id for transfer in transfers.values()]}}, projection={'_id': 1})}
+            failed = {bike_id for bike_id, transfer in transfers.items() if transfer.id not in inserted}
+            _release_failed_transfers(request, transfers, failed, results)
+
+    if transfers:
+        for bike_id, transfer in transfers.items():
+            results[bike_id] = BatchItemResult(id=bike_id, success=True, transfer_id=transfer.id)
+
+        counters.increment_many(counters.transfer_deltas(
+            [(transfer.sender, transfer.receiver) for transfer in transfers.values()], sign=1))
+        changes.record(changes.transfer_changes(
+            [(transfer.id, transfer.sender, transfer.receiver, transfer.bike_id) for transfer in transfers.values()]))
+
+    return _batch_response([results[bike_id] for bike_id in bike_ids])
+
+
+@router.put('/batch/accept', description="Accept many bike transfers at once", status_code=status.HTTP_200_OK)
+def accept_transfers_batch(
+    request: Request,
+    requester: BikeOwner = Depends(authenticated_request),
+    transfer_ids: list[uuid.UUID] = Body(embed=True)
+) -> BatchTransferResponse:
+
+    transfer_ids = list(dict.fromkeys(transfer_ids))
+    _check_batch_size(transfer_ids)
+
+    # Only pending transfers to the requester can be accepted
+    transfers = {transfer['_id']: BikeTransfer(**transfer) for transfer in request.app.collections["transfers"].find(
+        {'_id': {'$in': transfer_ids}, 'receiver': requester.id, 'state': BikeTransferState.PENDING})}
+
+    bikes = {bike['_id']: bike for bike in request.app.collections["bikes"].find(
+        {'_id': {'$in': [transfer.bike_id for transfer in transfers.values()]}},
+        projection={'owner': 1, 'reported_stolen': 1, 'state': 1})}
+
+    results: dict[uuid.UUID, BatchItemResult] = {}
+    for transfer_id in transfer_ids:
+        transfer = transfers.get(transfer_id)
+        if not transfer:
+            results[transfer_id] = BatchItemResult(id=transfer_id, success=False, detail="Transfer not found, not pending or not addressed to requester")
+            continue
+
+        bike = bikes.get(transfer.bike_id)
+        if not bike:
+            results[transfer_id] = BatchItemResult(id=transfer_id, success=False, detail="Bike is not in system")
+        elif bike.get('reported_stolen'):
+            results[transfer_id] = BatchItemResult(id=transfer_id, success=False, detail="Bike is reported stolen. Transfer disallowed")
+        elif bike.get('state') != BikeState.IN_TRANSFER or bike.get('owner') != transfer.sender:
+            results[transfer_id] = BatchItemResult(id=transfer_id, success=False, detail="Bike is not in a transferable state")
+
+        if transfer_id in results:
+            del transfers[transfer_id]
+
+    if transfers:
+        # Marks which transfers this request closed. Concurrent requests may close transfers at the same time
+        accepted_by_request = uuid.uuid4()
+        closed_at = datetime.datetime.now(datetime.timezone.utc)
+        closed = request.app.collections["transfers"].bulk_write([
+            UpdateOne({'_id': transfer_id, 'state': BikeTransferState.PENDING},
+                      {'$set': {'state': BikeTransferState.ACCEPTED, 'closed_at': closed_at, 'accepted_by_request': accepted_by_request}})
+            for transfer_id in transfers
+        ], ordered=False)
+
+        if closed.modified_count < len(transfers):
+            ours = {transfer['_id'] for transfer in request.app.collections["transfers"].find(
+                {'_id': {'$in': list(transfers)}, 'accepted_by_request': accepted_by_request}, projection={'_id': 1})}
+            for transfer_id in list(transfers):
+                if transfer_id not in ours:
+                    del transfers[transfer_id]
+                    results[transfer_id] = BatchItemResult(id=transfer_id, success=False, detail="Transfer is not pending")
+
+    if transfers:
+        # Hand over all bikes in one round trip
+        handed_over = request.app.collections["bikes"].bulk_write([
+            UpdateOne(
+                {'_id': transfer.bike_id, 'owner': transfer.sender, 'reported_stolen': False, 'state': BikeState.IN_TRANSFER},
+                {'$set': {'owner': requester.id, 'state': BikeState.TRANSFERABLE, 'pending_transfer': None}}
+            ) for transfer in transfers.values()
+        ], ordered=False)
+
+        if handed_over.modified_count < len(transfers):
+            owned = {bike['_id'] for bike in request.app.collections["bikes"].find(
+                {'_id': {'$in': [transfer.bike_id for transfer in transfers.values()]}, 'owner': requester.id}, projection={'_id': 1})}
+            failed = [transfer_id for transfer_id, transfer in transfers.items() if transfer.bike_id not in owned]
+
+            # Reopen the transfers whose bike could not be handed over
+            request.app.collections["transfers"].update_many(
+                {'_id': {'$in': failed}, 'state': BikeTransferState.ACCEPTED, 'accepted_by_request': accepted_by_request},
+                {'$set': {'state': BikeTransferState.PENDING, 'closed_at': None}, '$unset': {'accepted_by_request': ''}})
+            for transfer_id in failed:
+                del transfers[transfer_id]
+                results[transfer_id] = BatchItemResult(id=transfer_id, success=False, detail="Bike is not in a transferable state")
+
+        for transfer_id in transfers:
+            results[transfer_id] = BatchItemResult(id=transfer_id, success=True, transfer_id=transfer_id)
+
+        counters.increment_many(counters.transfer_deltas(
+            [(transfer.sender, transfer.receiver) for transfer in transfers.values()], sign=-1))
+        changes.record(changes.transfer_changes(
+            [(transfer.id, transfer.sender, transfer.receiver, transfer.bike_id) for transfer in transfers.values()], handed_over=True))
+        events.append([events.OwnershipEvent(
+            bike_id=transfer.bike_id, kind=events.OwnershipEventKind.TRANSFERRED, ts=closed_at,
+            owner_id=transfer.receiver, previous_owner_id=transfer.sender, transfer_id=transfer.id
+        ) for transfer in transfers.values()])
+
+    return _batch_response([results[transfer_id] for transfer_id in transfer_ids])
+
+
+def _release_failed_transfers(request: Request, transfers: dict[uuid.UUID, BikeTransfer], failed: set[uuid.UUID],
+                              results: dict[uuid.UUID, BatchItemResult]):
+    """ Makes the bikes of transfers that could not be saved transferable again, and reports them as failed """
+    if not failed:
+        return
+
+    # Don't leave the bikes stuck in transfer
+    request.app.collections["bikes"].bulk_write([
+        UpdateOne({'_id': bike_id, 'pending_transfer': transfers[bike_id].id},
+                  {'$set': {'state': BikeState.TRANSFERABLE, 'pending_transfer': None}})
+        for bike_id in failed
+    ], ordered=False)
+    for bike_id in failed:
+        del transfers[bike_id]
+        results[bike_id] = BatchItemResult(id=bike_id, success=False, detail="Transfer could not be saved. Please try again")
+
+
+def _check_batch_size(ids: list[uuid.UUID]):
+    if not ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"The batch is empty")
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"A batch can contain at most {MAX_BATCH_SIZE} items")
+
+
+def _batch_response(results: list[BatchItemResult]) -> BatchTransferResponse:
+    succeeded = sum(1 for result in results if result.success)
+    return BatchTransferResponse(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
 
 @router.put('/{transfer_id}/retract',
             description="retracting a bike transfer",
@@ -94,32 +329,35 @@ def retract_transfer(
     requester: BikeOwner = Depends(authenticated_request)
     ):
     
-    transfer_in_db: BikeTransfer = request.app.collections["transfers"].find_one({"_id": transfer_id})
-    transfer = BikeTransfer(**transfer_in_db)
+    # Only the original transferer can retract, and only while the transfer is pending
+    transfer_in_db = request.app.collections["transfers"].find_one_and_delete(
+        {'_id': transfer_id, 'sender': requester.id, 'state': BikeTransferState.PENDING},
+        projection={'bike_id': 1, 'sender': 1, 'receiver': 1}
+    )
 
-    # Check transfer exist
     if not transfer_in_db:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No such transfer found")
-    
-    # Check transfer pending
-    if not transfer.state == BikeTransferState.PENDING:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Transfer is not pending. Cannot decline transfer")
+        transfer_in_db = request.app.collections["transfers"].find_one({"_id": transfer_id}, projection={'sender': 1, 'state': 1})
+
+        # Check transfer exist
+        if not transfer_in_db:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No such transfer found")
+
+        # Check transfer pending
+        if not transfer_in_db['state'] == BikeTransferState.PENDING:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Transfer is not pending. Cannot decline transfer")
 
-    # Check sender is original transferer 
-    if not requester.id == transfer.sender:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Requester id does not match original transferer. Cannot decline transfer")
     
     # Update bike state
-    bike_in_db: Bike = request.app.collections["bikes"].find_one({"_id": transfer.bike_id})
-    bike = Bike(**bike_in_db)
-    bike.state = BikeState.TRANSFERABLE
-    bike.save()
-
-    delete_result = request.app.collections["transfers"].delete_one({"_id": transfer_id})
-    print(delete_result)
-    if not delete_result.deleted_count == 1:
-        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"failed to delete transfer with id {transfer_id}")
-    
+    request.app.collections["bikes"].update_one(
+        {'_id': transfer_in_db['bike_id'], 'state': BikeState.IN_TRANSFER},
+        {'$set': {'state': BikeState.TRANSFERABLE, 'pending_transfer': None}}
+    )
+
+    counters.increment_many(counters.transfer_deltas([(transfer_in_db['sender'], transfer_in_db['receiver'])], sign=-1))
+    changes.record(changes.transfer_changes(
+        [(transfer_in_db['_id'], transfer_in_db['sender'], transfer_in_db['receiver'], transfer_in_db['bike_id'])], deleted=True))
+
     return {"message": "transfer deleted successfully"}
     
 
@@ -130,40 +368,49 @@ def accept_transfer(
     requester: BikeOwner = Depends(authenticated_request)
 ) -> BikeTransfer:
 
-    # Check transfer exists
-    transfer_in_db = request.app.collections["transfers"].find_one({"_id": transfer_id})
+    # Close the transfer, but only if the requester is the receiver and it is still pending
+    transfer_in_db = request.app.collections["transfers"].find_one_and_update(
+        {'_id': transfer_id, 'receiver': requester.id, 'state': BikeTransferState.PENDING},
+        {'$set': {'state': BikeTransferState.ACCEPTED, 'closed_at': datetime.datetime.now(datetime.timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
     if not transfer_in_db:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Transfer is not in system")
+        _raise_transfer_not_closable(request, transfer_id, requester)
     
     transfer = BikeTransfer(**transfer_in_db)
     
-    # Check bike exists
-    bike_in_db = request.app.collections["bikes"].find_one({"_id": transfer.bike_id})
-    if not bike_in_db:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike is not in system")
-    
-    # Checks the bike is not stolen
-    bike = Bike(**bike_in_db)
-    if bike.reported_stolen:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Bike is reported stolen. Transfer disallowed")
+    # This hands over the ownership to the receiver, as long as the bike is still in transfer
+    # from the sender and has not been reported stolen in the meantime
+    handed_over = request.app.collections["bikes"].update_one(
+        {'_id': transfer.bike_id, 'owner': transfer.sender, 'reported_stolen': False, 'state': BikeState.IN_TRANSFER},
+        {'$set': {'owner': requester.id, 'state': BikeState.TRANSFERABLE, 'pending_transfer': None}}
+    )
 
-    # Checks bike is in transfer and transfer is pending
-    if bike.state != BikeState.IN_TRANSFER or transfer.state != BikeTransferState.PENDING:
+    if not handed_over.matched_count:
+        # Reopen the transfer, the bike could not be handed over
+        request.app.collections["transfers"].update_one(
+            {'_id': transfer_id, 'state': BikeTransferState.ACCEPTED},
+            {'$set': {'state': BikeTransferState.PENDING, 'closed_at': None}}
+        )
+
+        bike_in_db = request.app.collections["bikes"].find_one({"_id": transfer.bike_id}, projection={'reported_stolen': 1})
+        if not bike_in_db:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Bike is not in system")
+        
+        if bike_in_db['reported_stolen']:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Bike is reported stolen. Transfer disallowed")
+        
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Bike is not in a transferable state or transfer state not valid")
-    
-    # Checks if the requester is also the receiver from a transfer
-    if requester.id != transfer.receiver:
-        raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail=f"Requester is not recipient in the transfer")
-    
-    # This hands over the ownership to the sender of the request
-    bike.owner = requester.id
-    bike.state = BikeState.TRANSFERABLE
-    transfer.state = BikeTransferState.ACCEPTED
-    transfer.closed_at = datetime.datetime.now(datetime.timezone.utc)
 
-    bike.save()
+    counters.increment_many(counters.transfer_deltas([(transfer.sender, transfer.receiver)], sign=-1))
+    changes.record(changes.transfer_changes([(transfer.id, transfer.sender, transfer.receiver, transfer.bike_id)], handed_over=True))
+    events.append([events.OwnershipEvent(
+        bike_id=transfer.bike_id, kind=events.OwnershipEventKind.TRANSFERRED, ts=transfer.closed_at,
+        owner_id=transfer.receiver, previous_owner_id=transfer.sender, transfer_id=transfer.id
+    )])
+
+    return transfer
 
-    return transfer.save()
 
 @router.put('/{transfer_id}/reject', description="Rejects a bike transfer", status_code=status.HTTP_202_ACCEPTED)
 def reject_transfer(
@@ -172,27 +419,37 @@ def reject_transfer(
     requester: BikeOwner = Depends(authenticated_request), 
 ) -> BikeTransfer:
          
-    # Get transfer
-    transfer_in_db = request.app.collections["transfers"].find_one({"_id": transfer_id})
-    transfer = BikeTransfer(**transfer_in_db)
+    # Close the transfer, but only if the requester is the receiver and it is still pending
+    transfer_in_db = request.app.collections["transfers"].find_one_and_update(
+        {'_id': transfer_id, 'receiver': requester.id, 'state': BikeTransferState.PENDING},
+        {'$set': {'state': BikeTransferState.DECLINED, 'closed_at': datetime.datetime.now(datetime.timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not transfer_in_db:
+        _raise_transfer_not_closable(request, transfer_id, requester)
 
-    # Checks if the requester is also the receiver in a transfer
-    if not requester.id == transfer.receiver:
-        raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail=f"Requester does not match transfer recipient")
-    
-    # Get bike
-    bike_in_db = request.app.collections["bikes"].find_one({"_id": transfer.bike_id})
-    bike = Bike(**bike_in_db)
-    
-    # Checks bike is in transfer and transfer is pending
-    if not bike.state == BikeState.IN_TRANSFER or not transfer.state == BikeTransferState.PENDING:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Bike not in transfer or transfer not pending")
+    transfer = BikeTransfer(**transfer_in_db)
     
-    # This does not hand over the ownership to the sender of the request
-    bike.state = BikeState.TRANSFERABLE
-    transfer.state = BikeTransferState.DECLINED
-    transfer.closed_at = datetime.datetime.now(datetime.timezone.utc)
+    # This does not hand over the ownership, the bike just becomes transferable again
+    request.app.collections["bikes"].update_one(
+        {'_id': transfer.bike_id, 'state': BikeState.IN_TRANSFER},
+        {'$set': {'state': BikeState.TRANSFERABLE, 'pending_transfer': None}}
+    )
+
+    counters.increment_many(counters.transfer_deltas([(transfer.sender, transfer.receiver)], sign=-1))
+    changes.record(changes.transfer_changes([(transfer.id, transfer.sender, transfer.receiver, transfer.bike_id)]))
+
+    return transfer
 
-    bike.save()
 
-    return transfer.save()
\ No newline at end of file
+def _raise_transfer_not_closable(request: Request, transfer_id: uuid.UUID, requester: BikeOwner):
+    """ Finds out why a transfer could not be accepted or rejected. Only runs when it is refused """
+    transfer_in_db = request.app.collections["transfers"].find_one({"_id": transfer_id}, projection={'receiver': 1, 'state': 1})
+    if not transfer_in_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Transfer is not in system")
+
+    # Checks if the requester is also the receiver from a transfer
+    if requester.id != transfer_in_db['receiver']:
+        raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED, detail=f"Requester is not recipient in the transfer")
+
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Transfer is not pending")
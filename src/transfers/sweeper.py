@@ -0,0 +1,76 @@
+import datetime
+
+from src.database import MongoDatabase
+from src.settings import config
+from src.bikes.models import BikeState
+from src.transfers.models import BikeTransferState
+from src.activities import counters
+from src.sync import changes
+
+
+PENDING_TRANSFER_EXPIRY = datetime.timedelta(hours=int(config.get('TRANSFER_PENDING_EXPIRY_HOURS', 14 * 24)))
+SWEEP_INTERVAL_SECONDS = int(config.get('TRANSFER_SWEEP_INTERVAL_SECONDS', 5 * 60))
+
+
+def expire_pending_transfers(batch_size: int = 500) -> int:
+    """
+    Expires transfers that have been pending for longer than PENDING_TRANSFER_EXPIRY
+    and makes their bikes transferable again.
+
+    Every update is guarded on the state it expects, so it is safe to run while
+    transfers are being accepted and on several workers at once.
+
+    :returns the number of expired transfers
+    """
+    db = MongoDatabase()
+    transfers = db.collections['transfers']
+    bikes = db.collections['bikes']
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cutoff = now - PENDING_TRANSFER_EXPIRY
+    expired = 0
+
+    while True:
+        # Served by the (state, created_at) index
+        batch = list(transfers.find(
+            {'state': BikeTransferState.PENDING, 'created_at': {'$lt': cutoff}},
+            projection={'bike_id': 1, 'sender': 1, 'receiver': 1},
+            limit=batch_size
+        ))
+        if not batch:
+            break
+
+        transfer_ids = [transfer['_id'] for transfer in batch]
+        result = transfers.update_many(
+            {'_id': {'$in': transfer_ids}, 'state': BikeTransferState.PENDING},
+            {'$set': {'state': BikeTransferState.EXPIRED, 'closed_at': now}}
+        )
+
+        # Another worker or an accept may have closed some of them first. Only the
+        # bikes of the transfers this sweep expired are made transferable again
+        if result.modified_count < len(batch):
+            ours = {transfer['_id'] for transfer in transfers.find(
+                {'_id': {'$in': transfer_ids}, 'state': BikeTransferState.EXPIRED, 'closed_at': now}, projection={'_id': 1})}
+            batch = [transfer for transfer in batch if transfer['_id'] in ours]
+
+        if batch:
+            # Bikes put in transfer before they tracked their pending transfer have it unset
+            bikes.update_many(
+                {
+                    '_id': {'$in': [transfer['bike_id'] for transfer in batch]},
+                    'state': BikeState.IN_TRANSFER,
+                    'pending_transfer': {'$in': [transfer['_id'] for transfer in batch] + [None]}
+                },
+                {'$set': {'state': BikeState.TRANSFERABLE, 'pending_transfer': None}}
+            )
+
+        counters.increment_many(counters.transfer_deltas(
+            [(transfer['sender'], transfer['receiver']) for transfer in batch], sign=-1))
+        changes.record(changes.transfer_changes(
+            [(transfer['_id'], transfer['sender'], transfer['receiver'], transfer['bike_id']) for transfer in batch]))
+
+        expired += result.modified_count
+        if len(transfer_ids) < batch_size:
+            break
+
+    return expired
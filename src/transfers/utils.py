@@ -1,16 +1,25 @@
 from fastapi import Request
 
-from src.bikes.models import Bike
+from src.bikes.models import Bike, BikeState
+from src.database import MongoDatabase
 from src.owners.models import BikeOwner
-from src.transfers.models import BikeTransfer
+from src.sync import changes
+from src.transfers.models import BIKE_SNAPSHOT_FIELDS, BikeSnapshot, BikeTransfer, BikeTransferState
 
 
 def expand_transfer(transfer: BikeTransfer, request: Request) -> dict:
     """ Serializes a single bike transfer to expand ids into full objects """
     
-    sender   = BikeOwner(**request.app.collections['bike_owners'].find_one({'_id' : transfer.sender})).dict(include={'id', 'phone_number'})
-    receiver = BikeOwner(**request.app.collections['bike_owners'].find_one({'_id' : transfer.receiver})).dict(include={'id', 'phone_number'})
-    bike     = Bike(**request.app.collections['bikes'].find_one({'_id' : transfer.bike_id})).dict(exclude={'receipt'})
+    if transfer.sender_snapshot and transfer.receiver_snapshot and transfer.bike_snapshot:
+        # Everything needed is embedded on the transfer
+        sender   = transfer.sender_snapshot.dict()
+        receiver = transfer.receiver_snapshot.dict()
+        bike     = transfer.bike_snapshot.dict()
+    else:
+        # Transfers made before snapshots were added and not yet backfilled. Same shape as the snapshots
+        sender   = BikeOwner(**request.app.collections['bike_owners'].find_one({'_id' : transfer.sender})).dict(include={'id', 'phone_number'})
+        receiver = BikeOwner(**request.app.collections['bike_owners'].find_one({'_id' : transfer.receiver})).dict(include={'id', 'phone_number'})
+        bike     = BikeSnapshot.from_doc(request.app.collections['bikes'].find_one({'_id' : transfer.bike_id}, projection=BIKE_SNAPSHOT_FIELDS)).dict()
     
     return {
         'transfer_id': transfer.id,
@@ -20,4 +29,27 @@ def expand_transfer(transfer: BikeTransfer, request: Request) -> dict:
         'created_at' : transfer.created_at,
         'closed_at'  : transfer.closed_at,
         'state'      : transfer.state
-    }
\ No newline at end of file
+    }
+
+
+def refresh_bike_snapshot(bike: Bike):
+    """
+    Updates the bike snapshot of the pending transfer of a bike after the bike has changed.
+    Closed transfers keep the bike as it was when they were closed
+    """
+    if bike.state != BikeState.IN_TRANSFER:
+        return
+
+    transfers = MongoDatabase().collections['transfers']
+    pending = list(transfers.find({'bike_id': bike.id, 'state': BikeTransferState.PENDING}, projection={'sender': 1, 'receiver': 1}))
+    if not pending:
+        return
+
+    bike_doc = {'_id': bike.id, **bike.dict(include=set(BIKE_SNAPSHOT_FIELDS))}
+    transfers.update_many(
+        {'_id': {'$in': [transfer['_id'] for transfer in pending]}, 'state': BikeTransferState.PENDING},
+        {'$set': {'bike_snapshot': BikeSnapshot.from_doc(bike_doc).dict()}}
+    )
+
+    changes.record(changes.transfer_changes(
+        [(transfer['_id'], transfer['sender'], transfer['receiver'], bike.id) for transfer in pending]))